@@ -0,0 +1,191 @@
+"""
+Inference backends behind Inpainter
+
+A backend runs the LaMa model on a batch of normalized inputs: float32 NCHW
+images and masks in [0, 1]. It returns float32 NHWC results in [0, 1].
+"""
+
+import contextlib
+import os
+from typing import Optional
+
+import numpy as np
+import torch
+from loguru import logger
+
+# Autocast dtype for each supported inference precision
+PRECISIONS = {
+    "fp32": None,
+    "bf16": torch.bfloat16,
+    "fp16": torch.float16,
+}
+
+# Names accepted by Inpainter(backend=...)
+BACKENDS = ["torchscript", "onnx"]
+
+
+class InferenceBackend:
+    """Base class for model runtimes"""
+
+    name = "base"
+
+    def forward(self, image: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        """Run the model on (N, 3, H, W) images and (N, 1, H, W) masks"""
+        raise NotImplementedError
+
+    def allocate_input(self, shape: tuple) -> np.ndarray:
+        """Host float32 array that forward() inputs are written into"""
+        return np.empty(shape, dtype=np.float32)
+
+    def clear_cache(self):
+        """Release cached device memory, if the runtime has any"""
+
+    def nbytes(self) -> int:
+        """Memory held by the model weights"""
+        return 0
+
+
+class TorchScriptBackend(InferenceBackend):
+    """TorchScript model with optional autocast, channels_last and graph freezing"""
+
+    name = "torchscript"
+
+    def __init__(self,
+                 checkpoint_path: str,
+                 device: str,
+                 precision: str = "fp32",
+                 channels_last: bool = False,
+                 optimize: bool = False):
+        if precision not in PRECISIONS:
+            logger.error(f"Invalid precision '{precision}'. Must be one of: {list(PRECISIONS)}")
+            raise ValueError(f"Invalid precision '{precision}'. Must be one of: {list(PRECISIONS)}")
+        if precision == "fp16" and device == "cpu":
+            logger.error("fp16 precision requires a CUDA or MPS device")
+            raise ValueError("fp16 precision requires a CUDA or MPS device")
+        if optimize and precision != "fp32":
+            # Frozen graphs are not re-traced under autocast, the precision would be ignored
+            logger.error("optimize is only supported with fp32 precision")
+            raise ValueError("optimize is only supported with fp32 precision")
+
+        self.device = device
+        self.precision = precision
+        self.channels_last = channels_last
+        self.optimize = optimize
+
+        try:
+            logger.info(f"Loading model from checkpoint: {checkpoint_path}")
+            self.model = torch.jit.load(checkpoint_path, map_location=self.device)
+            self.model.eval().to(self.device)
+            logger.info("Model loaded successfully")
+
+            if self.channels_last:
+                self.model = self.model.to(memory_format=torch.channels_last)
+                logger.info("Model converted to channels_last memory format")
+            if self.optimize:
+                self.model = torch.jit.optimize_for_inference(torch.jit.freeze(self.model))
+                logger.info("Model frozen and optimized for inference")
+        except Exception as e:
+            logger.error(f"Failed to load model: {str(e)}")
+            raise
+
+    def _autocast(self):
+        """Autocast context for the configured precision"""
+        dtype = PRECISIONS[self.precision]
+        if dtype is None:
+            return contextlib.nullcontext()
+        return torch.autocast(device_type=self.device, dtype=dtype)
+
+    def allocate_input(self, shape: tuple) -> np.ndarray:
+        if self.device != "cuda":
+            return super().allocate_input(shape)
+        # Page-locked memory lets the host to device copy run asynchronously
+        return torch.empty(shape, dtype=torch.float32, pin_memory=True).numpy()
+
+    def forward(self, image: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        with torch.no_grad():
+            logger.info("Creating tensors and moving to device")
+            # Create tensors
+            image_tensor = torch.from_numpy(image).to(self.device, non_blocking=True)
+            mask_tensor = torch.from_numpy(mask).to(self.device, non_blocking=True)
+            if self.channels_last:
+                image_tensor = image_tensor.contiguous(memory_format=torch.channels_last)
+                mask_tensor = mask_tensor.contiguous(memory_format=torch.channels_last)
+            logger.info(f"Tensors created - image_tensor shape: {image_tensor.shape},\
+                          mask_tensor shape: {mask_tensor.shape}")
+            logger.info(f"Tensors on device: {image_tensor.device}, {mask_tensor.device}")
+
+            # Run inference
+            logger.info("Running model inference")
+            with self._autocast():
+                result_tensor = self.model(image_tensor, mask_tensor).float()
+            logger.info(f"Model inference completed, result shape: {result_tensor.shape}")
+
+            # Move to CPU immediately
+            logger.info("Moving result to CPU")
+            result = result_tensor.permute(0, 2, 3, 1).cpu().numpy()
+            logger.info(f"Result moved to CPU, numpy array shape: {result.shape}")
+
+            # Explicitly delete GPU tensors
+            logger.info("Cleaning up tensors")
+            del image_tensor, mask_tensor, result_tensor
+
+        return result
+
+    def nbytes(self) -> int:
+        tensors = list(self.model.parameters()) + list(self.model.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+
+    def clear_cache(self):
+        if self.device == "mps":
+            torch.mps.empty_cache()
+        elif self.device == "cuda":
+            torch.cuda.empty_cache()
+
+
+class OnnxRuntimeBackend(InferenceBackend):
+    """ONNX Runtime CPU session over a model exported with export_onnx.py"""
+
+    name = "onnx"
+
+    def __init__(self,
+                 onnx_path: str,
+                 num_threads: Optional[int] = None,
+                 interop_threads: Optional[int] = None):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            logger.error("onnxruntime is not installed")
+            raise ImportError(
+                "The onnx backend requires onnxruntime, install it with `uv sync --extra onnx`")
+
+        if not os.path.exists(onnx_path):
+            logger.error(f"ONNX model not found: {onnx_path}")
+            raise FileNotFoundError(
+                f"ONNX model not found: {onnx_path}, create it with export_onnx.py")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        if interop_threads:
+            options.inter_op_num_threads = interop_threads
+
+        self.onnx_path = onnx_path
+        logger.info(f"Loading ONNX model: {onnx_path}")
+        self.session = ort.InferenceSession(
+            onnx_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        logger.info(f"ONNX Runtime session created with inputs: {self.input_names}")
+
+    def forward(self, image: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        logger.info("Running ONNX Runtime inference")
+        result = self.session.run(None, {
+            self.input_names[0]: np.ascontiguousarray(image),
+            self.input_names[1]: np.ascontiguousarray(mask),
+        })[0]
+        logger.info(f"ONNX Runtime inference completed, result shape: {result.shape}")
+        return np.transpose(result, (0, 2, 3, 1))
+
+    def nbytes(self) -> int:
+        # The session keeps its own copy of the initializers, about the file size
+        return os.path.getsize(self.onnx_path)
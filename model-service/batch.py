@@ -0,0 +1,245 @@
+"""
+Offline batch inpainting of image + mask pairs from disk
+
+Decoding and encoding run on a pool of worker threads (or processes) while
+the main thread keeps the model busy: the next `--prefetch` pairs are decoded
+ahead of inference and finished results are encoded and written in the
+background. Outputs that already exist are skipped, so an interrupted run can
+be restarted with the same command.
+
+Pairs come from either
+- --images DIR --masks DIR: masks are matched to images by file name stem
+- --manifest FILE: CSV with `image,mask[,output]` columns, or JSON lines
+  with the same keys. Relative paths are resolved against the manifest.
+
+Usage:
+    python main.py batch --images photos/ --masks masks/ --output results/ --format png
+"""
+
+import argparse
+import csv
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+from backends import BACKENDS, PRECISIONS
+from formats import OUTPUT_FORMATS, encode_image
+from inpainter import Inpainter
+from models import download_model_if_missing
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tif", ".tiff"}
+
+
+def pairs_from_dirs(images_dir: str, masks_dir: str) -> list:
+    """(image, mask, output) path pairs matched by file name stem, output left unset"""
+    masks = {}
+    for path in sorted(Path(masks_dir).iterdir()):
+        if path.suffix.lower() in IMAGE_EXTENSIONS:
+            masks.setdefault(path.stem, path)
+
+    pairs = []
+    for path in sorted(Path(images_dir).iterdir()):
+        if path.suffix.lower() not in IMAGE_EXTENSIONS:
+            continue
+        mask = masks.get(path.stem)
+        if mask is None:
+            print(f"No mask for {path.name}, skipping")
+            continue
+        pairs.append((path, mask, None))
+    return pairs
+
+
+def pairs_from_manifest(manifest: str) -> list:
+    """(image, mask, output) path pairs from a CSV or JSON lines manifest"""
+    base = Path(manifest).parent
+    with open(manifest, newline="") as f:
+        if manifest.endswith((".jsonl", ".json")):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = list(csv.DictReader(f))
+
+    return [(base / row["image"], base / row["mask"],
+             base / row["output"] if row.get("output") else None) for row in rows]
+
+
+def decode_pair(image_path: Path, mask_path: Path) -> tuple:
+    """Load an RGB image and its grayscale mask"""
+    with Image.open(image_path) as image, Image.open(mask_path) as mask:
+        return np.asarray(image.convert("RGB")), np.asarray(mask.convert("L"))
+
+
+def encode_and_write(result: np.ndarray, output_path: Path, fmt: str, quality: int) -> int:
+    """Encode a result and write it atomically, returns the encoded size"""
+    data = encode_image(result, fmt, quality)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    # Partial files never look finished to a resumed run
+    tmp_path = output_path.with_name(f".{output_path.name}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, output_path)
+    return len(data)
+
+
+def add_pipeline_arguments(parser: argparse.ArgumentParser):
+    """Output, worker and model options, shared with sequence.py"""
+    parser.add_argument("--output", required=True, help="Output directory")
+    parser.add_argument("--format", choices=list(OUTPUT_FORMATS), default="png",
+                        help="Output format (default: png)")
+    parser.add_argument("--quality", type=int, default=95, help="JPEG/WebP quality")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1),
+                        help="Decode/encode workers")
+    parser.add_argument("--processes", action="store_true",
+                        help="Decode/encode in worker processes instead of threads")
+    parser.add_argument("--prefetch", type=int, default=None,
+                        help="Inputs decoded ahead of inference (default: 2 x workers)")
+    parser.add_argument("--overwrite", action="store_true", help="Redo existing outputs")
+    parser.add_argument("--device", default=None, help="Inference device (default: auto)")
+    parser.add_argument("--backend", choices=BACKENDS, default="torchscript",
+                        help="Inference backend")
+    parser.add_argument("--precision", choices=list(PRECISIONS), default="fp32",
+                        help="Inference precision")
+    parser.add_argument("--threads", type=int, default=None, help="Torch intra-op threads")
+    parser.add_argument("--max-image-size", type=int, default=1080,
+                        help="Longest side sent through the model (0 disables downscaling)")
+    parser.add_argument("--checkpoint", default=None, help="TorchScript model (default: big-lama)")
+    parser.add_argument("--onnx-path", default=None, help="ONNX model for the onnx backend")
+
+
+def load_inpainter(args) -> Inpainter:
+    """Inpainter configured from add_pipeline_arguments options"""
+    if args.checkpoint is None:
+        download_model_if_missing()
+    return Inpainter(device=args.device,
+                     max_image_size=args.max_image_size or None,
+                     precision=args.precision,
+                     num_threads=args.threads,
+                     backend=args.backend,
+                     onnx_path=args.onnx_path,
+                     checkpoint_path=args.checkpoint)
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """Batch options, shared by `python main.py batch` and `python batch.py`"""
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--images", help="Directory of input images (needs --masks)")
+    source.add_argument("--manifest", help="CSV or JSON lines file with image, mask[, output]")
+    parser.add_argument("--masks", help="Directory of masks named like the images (with --images)")
+    add_pipeline_arguments(parser)
+    parser.add_argument("--tiled", action="store_true", help="Use tiled full-resolution inference")
+    # The parser reports usage errors found after parsing, e.g. --images without --masks
+    parser.set_defaults(func=run, parser=parser)
+
+
+def run(args) -> int:
+    """Inpaint every pair, returns the process exit code"""
+    if args.images and not args.masks:
+        args.parser.error("--images needs --masks")
+    if args.manifest and args.masks:
+        args.parser.error("--masks can't be used with --manifest, it lists the masks")
+
+    pairs = pairs_from_manifest(args.manifest) if args.manifest \
+        else pairs_from_dirs(args.images, args.masks)
+    extension = OUTPUT_FORMATS[args.format][2]
+    output_dir = Path(args.output)
+    jobs = []
+    skipped = 0
+    for image_path, mask_path, output_path in pairs:
+        output_path = output_path or output_dir / f"{image_path.stem}{extension}"
+        if output_path.exists() and not args.overwrite:
+            skipped += 1
+            continue
+        jobs.append((image_path, mask_path, output_path))
+    print(f"{len(pairs)} pairs, {skipped} already done, {len(jobs)} to inpaint")
+    if not jobs:
+        return 0
+
+    inpainter = load_inpainter(args)
+
+    prefetch = args.prefetch or 2 * args.workers
+    executor_class = ProcessPoolExecutor if args.processes else ThreadPoolExecutor
+    failed = []
+    done = written = pixels = 0
+    wait_time = infer_time = 0.0
+    start_time = time.perf_counter()
+
+    with executor_class(max_workers=args.workers) as pool:
+        decoding = deque()
+        writing = deque()
+        next_job = 0
+
+        def collect(future, output_path):
+            nonlocal written
+            try:
+                future.result()
+                written += 1
+            except Exception as e:
+                failed.append((output_path, f"write failed: {e}"))
+
+        for image_path, mask_path, output_path in jobs:
+            # Keep the decode queue full so the model never waits on I/O
+            while next_job < len(jobs) and len(decoding) < prefetch:
+                decoding.append(pool.submit(decode_pair, *jobs[next_job][:2]))
+                next_job += 1
+
+            wait_start = time.perf_counter()
+            try:
+                image_np, mask_np = decoding.popleft().result()
+            except Exception as e:
+                failed.append((output_path, f"decode failed: {e}"))
+                continue
+            wait_time += time.perf_counter() - wait_start
+
+            if image_np.shape[:2] != mask_np.shape:
+                failed.append((output_path, f"mask size {mask_np.shape[::-1]} does not match "
+                                            f"image size {image_np.shape[1::-1]}"))
+                continue
+
+            infer_start = time.perf_counter()
+            try:
+                result = inpainter.inpaint(image_np, mask_np, tiled=args.tiled)
+            except Exception as e:
+                failed.append((output_path, f"inpaint failed: {e}"))
+                continue
+            infer_time += time.perf_counter() - infer_start
+
+            writing.append((pool.submit(encode_and_write, result, output_path,
+                                        args.format, args.quality), output_path))
+            # Bound the results held in memory while they wait for a writer
+            while len(writing) > prefetch:
+                collect(*writing.popleft())
+
+            done += 1
+            pixels += image_np.shape[0] * image_np.shape[1]
+            if done % 50 == 0:
+                elapsed = time.perf_counter() - start_time
+                print(f"{done}/{len(jobs)} done, {done / elapsed:.2f} images/s")
+
+        while writing:
+            collect(*writing.popleft())
+
+    elapsed = time.perf_counter() - start_time
+    print(f"Inpainted {written} images in {elapsed:.1f}s: {written / elapsed:.2f} images/s, "
+          f"{pixels / elapsed / 1e6:.2f} MP/s")
+    print(f"Model busy {infer_time / elapsed:.0%} of the time, "
+          f"{wait_time:.1f}s waiting for decodes")
+    for output_path, reason in failed:
+        print(f"FAILED {output_path}: {reason}")
+    return 1 if failed else 0
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Batch inpaint image + mask pairs from disk")
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,334 @@
+"""
+Inference benchmark suite
+
+Runs Inpainter.inpaint over a matrix of resolutions, mask coverage ratios,
+mask shapes, thread counts and execution modes. Reports per-stage p50/p95
+latency, peak RSS and throughput, saves the results as JSON and compares
+them against a stored baseline.
+
+By default the model is a tiny stand-in TorchScript network created on the
+fly, so the suite runs on CPU without downloading the checkpoint (e.g. in CI).
+The stage timings then cover everything around the model. Pass --checkpoint
+to benchmark the real model.
+
+Usage:
+    python main.py bench --resolutions 512x512,1920x1080 --coverage 0.05,0.3 \\
+                         --output results.json --baseline baseline.json
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+import numpy as np
+import psutil
+import torch
+from PIL import Image, ImageDraw
+
+import stages
+from inpainter import Inpainter
+
+# Inpainter keyword arguments of each --modes entry
+MODES = {
+    "fp32": {},
+    "bf16": {"precision": "bf16"},
+    "fp16": {"precision": "fp16"},
+    "channels_last": {"channels_last": True},
+    "optimize": {"optimize": True},
+    "onnx": {"backend": "onnx"},
+}
+
+MASK_SHAPES = ["box", "strokes", "scatter"]
+
+
+class StandInModel(torch.nn.Module):
+    """Cheap model with LaMa's signature: fills the hole with the image mean"""
+
+    def forward(self, image: torch.Tensor, mask: torch.Tensor) -> torch.Tensor:
+        return image * (1 - mask) + mask * image.mean(dim=(2, 3), keepdim=True)
+
+
+def make_standin_checkpoint(path: str) -> str:
+    """Save the stand-in model as a TorchScript checkpoint"""
+    torch.jit.save(torch.jit.script(StandInModel().eval()), path)
+    return path
+
+
+def make_image(height: int, width: int, rng: np.random.Generator) -> np.ndarray:
+    """Synthetic RGB image: smooth gradients with mild noise"""
+    rows = np.linspace(0, 255, height, dtype=np.float32)[:, np.newaxis]
+    cols = np.linspace(0, 255, width, dtype=np.float32)[np.newaxis, :]
+    image = np.stack(np.broadcast_arrays(rows, cols, (rows + cols) / 2), axis=2)
+    return np.clip(image + rng.normal(0, 8, image.shape), 0, 255).astype(np.uint8)
+
+
+def make_mask(shape: str, height: int, width: int, coverage: float,
+              rng: np.random.Generator) -> np.ndarray:
+    """
+    Synthetic mask covering roughly coverage of the image
+    Args:
+        shape: "box" (one centered rectangle), "strokes" (brush strokes) or
+               "scatter" (small blocks spread over the whole image)
+    """
+    if shape == "box":
+        mask = np.zeros((height, width), dtype=np.uint8)
+        box_h = max(int(height * coverage ** 0.5), 1)
+        box_w = max(int(width * coverage ** 0.5), 1)
+        top, left = (height - box_h) // 2, (width - box_w) // 2
+        mask[top:top + box_h, left:left + box_w] = 255
+        return mask
+
+    if shape == "strokes":
+        canvas = Image.new("L", (width, height))
+        draw = ImageDraw.Draw(canvas)
+        brush = max(min(height, width) // 30, 2)
+        mask = np.asarray(canvas)
+        for _ in range(1000):
+            if (mask > 0).mean() >= coverage:
+                break
+            points = [(int(x), int(y)) for x, y in
+                      rng.random((4, 2)) * (width, height)]
+            draw.line(points, fill=255, width=brush, joint="curve")
+            mask = np.asarray(canvas)
+        return mask.copy()
+
+    if shape == "scatter":
+        block = 8
+        blocks = rng.random((height // block + 1, width // block + 1)) < coverage
+        mask = np.repeat(np.repeat(blocks, block, axis=0), block, axis=1)[:height, :width]
+        return mask.astype(np.uint8) * 255
+
+    raise ValueError(f"Invalid mask shape '{shape}'. Must be one of: {MASK_SHAPES}")
+
+
+def reset_peak_rss() -> bool:
+    """Reset the process peak RSS counter (Linux only)"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb() -> float:
+    """Peak RSS since the last reset, or the current RSS where it isn't available"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return psutil.Process().memory_info().rss / 1024 / 1024
+
+
+def case_id(case: dict) -> str:
+    """Stable key of a benchmark case, used to match results against a baseline"""
+    return (f"{case['mode']}/t{case['threads']}/{case['resolution']}/"
+            f"{case['mask_shape']}/{case['coverage']:.2f}")
+
+
+def summarize(samples: list, pixels: int) -> dict:
+    """Per-stage p50/p95 in milliseconds and throughput over timed runs"""
+    names = sorted({name for sample in samples for name in sample})
+    stage_stats = {}
+    for name in names:
+        values = np.array([sample.get(name, 0.0) for sample in samples]) * 1000
+        stage_stats[name] = {"p50_ms": float(np.percentile(values, 50)),
+                             "p95_ms": float(np.percentile(values, 95))}
+
+    elapsed = sum(sample["total"] for sample in samples)
+    return {
+        "stages": stage_stats,
+        "images_per_s": len(samples) / elapsed,
+        "megapixels_per_s": len(samples) * pixels / elapsed / 1e6,
+    }
+
+
+def run_case(inpainter: Inpainter, case: dict, iterations: int, warmup: int,
+             roi: bool, tiled: bool, seed: int = 0) -> dict:
+    """Time inpaint() on one synthetic image and mask"""
+    width, height = (int(v) for v in case["resolution"].split("x"))
+    rng = np.random.default_rng(seed)
+    image = make_image(height, width, rng)
+    mask = make_mask(case["mask_shape"], height, width, case["coverage"], rng)
+
+    for _ in range(warmup):
+        inpainter.inpaint(image, mask, roi=roi, tiled=tiled)
+
+    gc.collect()
+    peak_reset = reset_peak_rss()
+    samples = []
+    for _ in range(iterations):
+        with stages.collect() as timings:
+            start = time.perf_counter()
+            inpainter.inpaint(image, mask, roi=roi, tiled=tiled)
+            timings["total"] = time.perf_counter() - start
+        samples.append(timings)
+
+    result = {"id": case_id(case), "case": case,
+              "actual_coverage": float((mask > 0).mean()),
+              "peak_rss_mb": peak_rss_mb(), "peak_rss_reset": peak_reset}
+    result.update(summarize(samples, width * height))
+    return result
+
+
+def build_inpainter(mode: str, threads: int, args, tmp_dir: str) -> Inpainter:
+    """Inpainter for one mode and thread count"""
+    options = dict(MODES[mode])
+    onnx_path = args.onnx_path
+    if options.get("backend") == "onnx" and onnx_path is None and args.checkpoint is None:
+        # The stand-in model is exported once per run
+        onnx_path = os.path.join(tmp_dir, "standin.onnx")
+        if not os.path.exists(onnx_path):
+            from export_onnx import export_onnx
+            export_onnx(args.checkpoint_path, onnx_path, sample_size=64)
+
+    return Inpainter(device=None if options.get("backend") == "onnx" else args.device,
+                     max_image_size=args.max_image_size or None,
+                     num_threads=threads,
+                     onnx_path=onnx_path,
+                     checkpoint_path=args.checkpoint_path,
+                     **options)
+
+
+def compare(results: list, baseline: dict, max_regression: float) -> list:
+    """Print p50/throughput changes against a baseline, returns the regressed case ids"""
+    previous = {r["id"]: r for r in baseline.get("results", [])}
+    regressions = []
+    print(f"\n{'case':<44} {'p50 ms':>9} {'baseline':>9} {'change':>8}")
+    for result in results:
+        before = previous.get(result["id"])
+        if before is None:
+            continue
+        now_ms = result["stages"]["total"]["p50_ms"]
+        then_ms = before["stages"]["total"]["p50_ms"]
+        change = now_ms / then_ms - 1
+        flag = ""
+        if change > max_regression:
+            regressions.append(result["id"])
+            flag = "  REGRESSION"
+        print(f"{result['id']:<44} {now_ms:9.1f} {then_ms:9.1f} {change:+7.1%}{flag}")
+    return regressions
+
+
+def parse_list(value: str, cast=str) -> list:
+    """Comma-separated CLI list"""
+    return [cast(v.strip()) for v in value.split(",") if v.strip()]
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """Benchmark options, shared by `python main.py bench` and `python benchmark.py`"""
+    parser.add_argument("--resolutions", default="512x512,1024x768,1920x1080",
+                        help="Comma-separated WIDTHxHEIGHT image sizes")
+    parser.add_argument("--coverage", default="0.05,0.25",
+                        help="Comma-separated masked fractions of the image")
+    parser.add_argument("--mask-shapes", default="box,strokes",
+                        help=f"Comma-separated mask shapes: {', '.join(MASK_SHAPES)}")
+    parser.add_argument("--threads", default="",
+                        help="Comma-separated torch intra-op thread counts (default: current)")
+    parser.add_argument("--modes", default="fp32",
+                        help=f"Comma-separated execution modes: {', '.join(MODES)}")
+    parser.add_argument("--iterations", type=int, default=5, help="Timed runs per case")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed runs per case")
+    parser.add_argument("--device", default="cpu", help="Inference device")
+    parser.add_argument("--max-image-size", type=int, default=1080,
+                        help="Inpainter max_image_size (0 disables downscaling)")
+    parser.add_argument("--no-roi", action="store_true", help="Run the model on the whole image")
+    parser.add_argument("--tiled", action="store_true", help="Use tiled inference")
+    parser.add_argument("--checkpoint", default=None,
+                        help="TorchScript model to benchmark (defaults to a tiny stand-in)")
+    parser.add_argument("--onnx-path", default=None, help="ONNX model for the onnx mode")
+    parser.add_argument("--output", default="benchmark-results.json", help="JSON results file")
+    parser.add_argument("--baseline", default=None, help="JSON results to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.10,
+                        help="Allowed p50 slowdown against the baseline before failing")
+    parser.set_defaults(func=run)
+
+
+def run(args) -> int:
+    """Run the benchmark matrix, returns the process exit code"""
+    resolutions = parse_list(args.resolutions)
+    coverages = parse_list(args.coverage, float)
+    shapes = parse_list(args.mask_shapes)
+    threads = parse_list(args.threads, int) or [torch.get_num_threads()]
+    modes = parse_list(args.modes)
+    for mode in modes:
+        if mode not in MODES:
+            raise ValueError(f"Invalid mode '{mode}'. Must be one of: {list(MODES)}")
+    for shape in shapes:
+        if shape not in MASK_SHAPES:
+            raise ValueError(f"Invalid mask shape '{shape}'. Must be one of: {MASK_SHAPES}")
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        args.checkpoint_path = args.checkpoint or make_standin_checkpoint(
+            os.path.join(tmp_dir, "standin.pt"))
+
+        print(f"{'case':<44} {'p50 ms':>9} {'p95 ms':>9} {'img/s':>8} {'MP/s':>8} {'peak MB':>9}")
+        for mode in modes:
+            for num_threads in threads:
+                inpainter = build_inpainter(mode, num_threads, args, tmp_dir)
+                for resolution in resolutions:
+                    for shape in shapes:
+                        for coverage in coverages:
+                            case = {"mode": mode, "threads": num_threads,
+                                    "resolution": resolution.lower(),
+                                    "mask_shape": shape, "coverage": coverage}
+                            result = run_case(inpainter, case, args.iterations, args.warmup,
+                                              roi=not args.no_roi, tiled=args.tiled)
+                            total = result["stages"]["total"]
+                            print(f"{result['id']:<44} {total['p50_ms']:9.1f} "
+                                  f"{total['p95_ms']:9.1f} {result['images_per_s']:8.2f} "
+                                  f"{result['megapixels_per_s']:8.2f} {result['peak_rss_mb']:9.0f}")
+                            results.append(result)
+                del inpainter
+                gc.collect()
+
+    report = {
+        "meta": {
+            "created": datetime.now(timezone.utc).isoformat(),
+            "model": args.checkpoint or "stand-in",
+            "device": args.device,
+            "max_image_size": args.max_image_size,
+            "roi": not args.no_roi,
+            "tiled": args.tiled,
+            "iterations": args.iterations,
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.max_regression)
+        if regressions:
+            print(f"\n{len(regressions)} case(s) regressed by more than {args.max_regression:.0%}")
+            return 1
+    return 0
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Kupu inference benchmark suite")
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,71 @@
+"""
+Reusable buffers for the pre/post-processing pipeline
+
+Forward passes of the same padded shape reuse the same input and scratch
+arrays instead of allocating fresh ones for every request. Buffers are kept
+per thread, so concurrent inference workers (and the batch scheduler) never
+write into each other's inputs, up to a byte cap per thread. The memory manager
+drops them all under memory pressure.
+"""
+
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import numpy as np
+
+
+class BufferPool:
+    """Per-thread arrays keyed by name, shape and dtype"""
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        # Per thread, least recently used buffers are dropped past this many bytes
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Buffers of each thread, released with the thread
+        self._threads = weakref.WeakKeyDictionary()
+
+    def get(self, name: str, shape: tuple, dtype=np.float32,
+            allocate: Optional[Callable] = None) -> np.ndarray:
+        """
+        Uninitialized buffer for this thread, reused across calls with the same key
+        Args:
+            name: Role of the buffer, so equally shaped inputs don't share memory
+            shape: Array shape
+            dtype: Array dtype
+            allocate: Factory called as allocate(shape) on a miss (defaults to np.empty)
+        """
+        thread = threading.current_thread()
+        key = (name, tuple(shape), np.dtype(dtype).str)
+        with self._lock:
+            buffers = self._threads.get(thread)
+            buffer = buffers.get(key) if buffers is not None else None
+            if buffer is not None:
+                buffers.move_to_end(key)
+                return buffer
+
+        buffer = allocate(shape) if allocate is not None else np.empty(shape, dtype=dtype)
+        if buffer.nbytes > self.max_bytes:
+            # Never kept, it would evict every other buffer of the thread
+            return buffer
+
+        with self._lock:
+            buffers = self._threads.setdefault(thread, OrderedDict())
+            buffers[key] = buffer
+            nbytes = sum(kept.nbytes for kept in buffers.values())
+            while nbytes > self.max_bytes:
+                _, evicted = buffers.popitem(last=False)
+                nbytes -= evicted.nbytes
+        return buffer
+
+    def clear(self):
+        """Drop the buffers of every thread, buffers in use stay valid until released"""
+        with self._lock:
+            self._threads.clear()
+
+    def nbytes(self) -> int:
+        """Bytes held by the buffers of every thread"""
+        with self._lock:
+            return sum(buffer.nbytes for buffers in self._threads.values()
+                       for buffer in buffers.values())
@@ -0,0 +1,173 @@
+"""
+Content-addressed cache for inpainting results
+
+Results are keyed by a hash of the decoded image and the binarized mask, so
+retries and repeated edits skip the forward pass. Entries live in an in-memory
+LRU bounded by a byte budget, with an optional on-disk tier behind it.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from loguru import logger
+
+
+class ResultCache:
+    """Two-tier (memory LRU + optional disk) cache of inpainting results"""
+
+    def __init__(self,
+                 max_bytes: int = 256 * 1024 * 1024,
+                 disk_dir: Optional[str] = None,
+                 max_disk_bytes: int = 1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._disk_bytes = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.disk_dir is not None:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            self._disk_bytes = sum(size for _, size, _ in self._disk_files())
+            logger.info(f"Result cache disk tier at {self.disk_dir}, "
+                        f"{self._disk_bytes / 1024 / 1024:.1f}MB in use")
+
+    @staticmethod
+    def make_key(image_np: np.ndarray, mask_np: np.ndarray, **options) -> str:
+        """Hash the image pixels, binarized mask and inpaint options"""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(repr((image_np.shape, image_np.dtype.str, sorted(options.items()))).encode())
+        digest.update(np.ascontiguousarray(image_np).data)
+        # Binarize the same way Inpainter.inpaint does so equivalent masks share a key
+        digest.update(np.packbits(mask_np > 128).data)
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Return the cached result for key, or None on a miss"""
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return result
+
+        result = self._disk_get(key)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._memory_put(key, result)
+        return result
+
+    def put(self, key: str, result: np.ndarray):
+        """Store a result in memory and, when configured, on disk"""
+        result = result.copy()
+        result.setflags(write=False)
+        with self._lock:
+            self._memory_put(key, result)
+        self._disk_put(key, result)
+
+    def stats(self) -> dict:
+        """Hit/miss counters and tier usage"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "memory_entries": len(self._entries),
+                "memory_bytes": self._bytes,
+                "max_memory_bytes": self.max_bytes,
+                "disk_bytes": self._disk_bytes if self.disk_dir else None,
+                "max_disk_bytes": self.max_disk_bytes if self.disk_dir else None,
+            }
+
+    def _memory_put(self, key: str, result: np.ndarray):
+        """Insert into the LRU and evict down to the byte budget (lock held)"""
+        if result.nbytes > self.max_bytes:
+            return
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+
+        self._entries[key] = result
+        self._bytes += result.nbytes
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.nbytes
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / f"{key}.npy"
+
+    def _disk_get(self, key: str) -> Optional[np.ndarray]:
+        """Load a result from the disk tier, refreshing its recency"""
+        if self.disk_dir is None:
+            return None
+        path = self._disk_path(key)
+        try:
+            result = np.load(path)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        result.setflags(write=False)
+        return result
+
+    def _disk_put(self, key: str, result: np.ndarray):
+        """Write a result to the disk tier and evict least recently used files"""
+        if self.disk_dir is None or result.nbytes > self.max_disk_bytes:
+            return
+        path = self._disk_path(key)
+        if path.exists():
+            return
+
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp_path, "wb") as f:
+                np.save(f, result)
+                size = f.tell()
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write cache entry {path}: {e}")
+            tmp_path.unlink(missing_ok=True)
+            return
+
+        with self._lock:
+            self._disk_bytes += size
+            if self._disk_bytes <= self.max_disk_bytes:
+                return
+            # Prefork workers share the directory, rescan it for the actual usage
+            files = sorted(self._disk_files())
+            self._disk_bytes = sum(size for _, size, _ in files)
+            for _, size, f in files:
+                if self._disk_bytes <= self.max_disk_bytes:
+                    break
+                try:
+                    f.unlink()
+                except FileNotFoundError:
+                    # Already evicted by another worker
+                    pass
+                except OSError:
+                    continue
+                self._disk_bytes -= size
+
+    def _disk_files(self) -> list:
+        """(mtime, size, path) of the disk tier files, skipping files removed mid-scan"""
+        files = []
+        for f in self.disk_dir.glob("*.npy"):
+            try:
+                stat = f.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, f))
+        return files
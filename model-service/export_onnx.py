@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+One-time export of the LaMa TorchScript checkpoint to ONNX
+
+The TorchScript exporter has no symbolics for LaMa's FFT layers, so they are
+registered here on top of the ONNX DFT op. Every written model is checked
+against the fp32 TorchScript checkpoint before the script reports success.
+
+Usage:
+    python export_onnx.py [--checkpoint checkpoints/big-lama.pt]
+                          [--output checkpoints/big-lama.onnx] [--quantize]
+                          [--skip-verify]
+"""
+
+import argparse
+import inspect
+import os
+import sys
+from pathlib import Path
+
+import torch
+from loguru import logger
+from torch.onnx import errors, symbolic_helper
+
+current_dir = Path(__file__).parent
+
+# Mean absolute difference (0-255 scale) tolerated against the TorchScript
+# checkpoint, the fp32 and onnx entries of EXECUTION_MODE_TOLERANCES
+VERIFY_TOLERANCES = {"fp32": 0.5, "int8": 4.0}
+
+# Opsets with the DFT op taking its axis as an attribute
+FFT_OPSETS = (17, 18, 19)
+
+
+def _fft_axes(dims: list) -> list:
+    """ONNX axes of FFT dims, complex values carry a trailing real/imaginary axis"""
+    return [dim - 1 if dim < 0 else dim for dim in dims]
+
+
+def _signal_numel(g, x, dims: list):
+    """Number of elements of x over dims, as a float scalar"""
+    sizes = g.op("Gather", g.op("Shape", x),
+                 g.op("Constant", value_t=torch.tensor(dims, dtype=torch.int64)), axis_i=0)
+    return g.op("Cast", g.op("ReduceProd", sizes, keepdims_i=0), to_i=1)
+
+
+def _fft_norm(norm) -> str:
+    return "backward" if symbolic_helper._is_none(norm) else symbolic_helper._maybe_get_const(norm, "s")
+
+
+@symbolic_helper.parse_args("v", "v", "is", "v")
+def _fft_rfftn(g, self, s, dim, norm):
+    if not symbolic_helper._is_none(s):
+        raise errors.SymbolicValueError("fft_rfftn with an explicit size is not supported", self)
+    axes = _fft_axes(dim)
+    # One-sided transform of the last dim first, as torch does, then full transforms
+    output = g.op("DFT", symbolic_helper._unsqueeze_helper(g, self, [-1]), axis_i=axes[-1], onesided_i=1)
+    for axis in axes[:-1]:
+        output = g.op("DFT", output, axis_i=axis)
+    norm = _fft_norm(norm)
+    if norm == "ortho":
+        return g.op("Div", output, g.op("Sqrt", _signal_numel(g, self, dim)))
+    if norm == "forward":
+        return g.op("Div", output, _signal_numel(g, self, dim))
+    return output
+
+
+@symbolic_helper.parse_args("v", "v", "is", "v")
+def _fft_irfftn(g, self, s, dim, norm):
+    axes = _fft_axes(dim)
+    output = self
+    for axis in axes[:-1]:
+        output = g.op("DFT", output, axis_i=axis, inverse_i=1)
+    # Real output length of the one-sided last dim, from s or 2 * (n - 1) like torch
+    if symbolic_helper._is_none(s):
+        size = g.op("Gather", g.op("Shape", self), g.op("Constant", value_t=torch.tensor(axes[-1])), axis_i=0)
+        length = g.op("Mul", g.op("Sub", size, g.op("Constant", value_t=torch.tensor(1))),
+                      g.op("Constant", value_t=torch.tensor(2)))
+    else:
+        length = symbolic_helper._maybe_get_const(s, "is")
+        if symbolic_helper._is_value(length):
+            length = g.op("Gather", length, g.op("Constant", value_t=torch.tensor(-1)), axis_i=0)
+        else:
+            length = g.op("Constant", value_t=torch.tensor(length[-1]))
+    output = g.op("DFT", output, length, axis_i=axes[-1], inverse_i=1, onesided_i=1)
+    output = symbolic_helper._squeeze_helper(g, output, [-1])
+    # The inverse DFT already divides by the signal size
+    norm = _fft_norm(norm)
+    if norm == "ortho":
+        return g.op("Mul", output, g.op("Sqrt", _signal_numel(g, output, dim)))
+    if norm == "forward":
+        return g.op("Mul", output, _signal_numel(g, output, dim))
+    return output
+
+
+def _real(g, self):
+    return g.op("Gather", self, g.op("Constant", value_t=torch.tensor(0)), axis_i=-1)
+
+
+def _imag(g, self):
+    return g.op("Gather", self, g.op("Constant", value_t=torch.tensor(1)), axis_i=-1)
+
+
+def _complex(g, real, imag):
+    return g.op("Concat", symbolic_helper._unsqueeze_helper(g, real, [-1]),
+                symbolic_helper._unsqueeze_helper(g, imag, [-1]), axis_i=-1)
+
+
+def register_fft_symbolics(opset: int):
+    """Export LaMa's FFT ops with the ONNX DFT op, complex values as (..., 2) real tensors"""
+    if opset not in FFT_OPSETS:
+        raise ValueError(f"The FFT layers export with ONNX opset {FFT_OPSETS[0]} to {FFT_OPSETS[-1]}, got {opset}")
+    for name, symbolic in (("fft_rfftn", _fft_rfftn), ("fft_irfftn", _fft_irfftn),
+                           ("real", _real), ("imag", _imag), ("complex", _complex)):
+        torch.onnx.register_custom_op_symbolic(f"aten::{name}", symbolic, opset)
+
+
+def _exporter_kwargs() -> dict:
+    """Select the TorchScript exporter where torch.onnx.export also offers the dynamo one"""
+    # dynamo appeared in torch 2.5 and became the default in 2.9, it can't keep the FFT width dynamic
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        return {"dynamo": False}
+    return {}
+
+
+def export_onnx(checkpoint_path: str, output_path: str, opset: int = 17,
+                sample_size: int = 512) -> str:
+    """Export the TorchScript model with dynamic batch, height and width axes"""
+    register_fft_symbolics(opset)
+    logger.info(f"Loading TorchScript model: {checkpoint_path}")
+    model = torch.jit.load(checkpoint_path, map_location="cpu").eval()
+
+    # Sample inputs only drive tracing, the exported axes stay dynamic
+    image = torch.rand(1, 3, sample_size, sample_size)
+    mask = torch.zeros(1, 1, sample_size, sample_size)
+    mask[:, :, sample_size // 4:sample_size * 3 // 4, sample_size // 4:sample_size * 3 // 4] = 1
+
+    dynamic_axes = {"batch": 0, "height": 2, "width": 3}
+    logger.info(f"Exporting to ONNX opset {opset}: {output_path}")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (image, mask),
+            output_path,
+            input_names=["image", "mask"],
+            output_names=["output"],
+            dynamic_axes={
+                name: {axis: label for label, axis in dynamic_axes.items()}
+                for name in ("image", "mask", "output")
+            },
+            opset_version=opset,
+            **_exporter_kwargs(),
+        )
+    return output_path
+
+
+def quantize_onnx(input_path: str, output_path: str) -> str:
+    """Apply dynamic int8 weight quantization with ONNX Runtime"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    logger.info(f"Quantizing {input_path} to int8: {output_path}")
+    quantize_dynamic(input_path, output_path, weight_type=QuantType.QInt8)
+    return output_path
+
+
+def verify_onnx(checkpoint_path: str, onnx_path: str, tolerance: float,
+                height: int = 384, width: int = 512) -> dict:
+    """
+    Compare an exported model against the fp32 TorchScript checkpoint
+    Args:
+        tolerance: Allowed mean absolute difference on the 0-255 scale
+        height, width: Test input size, away from the export sample size so
+                       the dynamic axes are exercised
+    Returns:
+        Difference metrics and whether the model passed
+    """
+    import numpy as np
+    import onnxruntime as ort
+
+    rng = np.random.default_rng(0)
+    image = rng.random((1, 3, height, width), dtype=np.float32)
+    mask = np.zeros((1, 1, height, width), dtype=np.float32)
+    mask[:, :, height // 4:height * 3 // 4, width // 3:width * 2 // 3] = 1
+
+    model = torch.jit.load(checkpoint_path, map_location="cpu").eval()
+    with torch.no_grad():
+        reference = model(torch.from_numpy(image), torch.from_numpy(mask)).numpy()
+    session = ort.InferenceSession(onnx_path, providers=["CPUExecutionProvider"])
+    names = [i.name for i in session.get_inputs()]
+    result = session.run(None, {names[0]: image, names[1]: mask})[0]
+
+    diff = np.abs(np.clip(result, 0, 1) - np.clip(reference, 0, 1)) * 255
+    mse = float(np.mean(diff ** 2))
+    metrics = {
+        "max_abs_diff": float(diff.max()),
+        "mean_abs_diff": float(diff.mean()),
+        "psnr": float("inf") if mse == 0 else float(10 * np.log10(255 ** 2 / mse)),
+        "tolerance": tolerance,
+    }
+    metrics["passed"] = metrics["mean_abs_diff"] <= tolerance
+    return metrics
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Export the Kupu model to ONNX')
+    parser.add_argument('--checkpoint', type=str,
+                        default=str(current_dir / "checkpoints" / "big-lama.pt"),
+                        help='TorchScript checkpoint to export (default: checkpoints/big-lama.pt)')
+    parser.add_argument('--output', type=str, default=None,
+                        help='ONNX output path (default: checkpoint path with .onnx suffix)')
+    parser.add_argument('--opset', type=int, default=17, choices=FFT_OPSETS,
+                        help='ONNX opset version with DFT support for the FFT layers (default: 17)')
+    parser.add_argument('--quantize', action='store_true',
+                        help='Also write a dynamic int8 quantized model (*.int8.onnx)')
+    parser.add_argument('--skip-verify', action='store_true',
+                        help='Skip the comparison of the written models against the TorchScript checkpoint')
+
+    args = parser.parse_args()
+    output = args.output or os.path.splitext(args.checkpoint)[0] + ".onnx"
+
+    export_onnx(args.checkpoint, output, args.opset)
+    logger.info(f"✅ ONNX model written to: {output}")
+    written = [(output, VERIFY_TOLERANCES["fp32"])]
+
+    if args.quantize:
+        quantized = os.path.splitext(output)[0] + ".int8.onnx"
+        quantize_onnx(output, quantized)
+        logger.info(f"✅ Quantized model written to: {quantized}")
+        written.append((quantized, VERIFY_TOLERANCES["int8"]))
+
+    if not args.skip_verify:
+        for path, tolerance in written:
+            metrics = verify_onnx(args.checkpoint, path, tolerance)
+            if not metrics["passed"]:
+                logger.error(f"❌ {path} differs from the TorchScript checkpoint: "
+                             f"mean abs diff {metrics['mean_abs_diff']:.3f} > {tolerance}")
+                sys.exit(1)
+            logger.info(f"✅ {path} matches the TorchScript checkpoint: mean abs diff "
+                        f"{metrics['mean_abs_diff']:.3f}, max {metrics['max_abs_diff']:.1f}, "
+                        f"PSNR {metrics['psnr']:.1f}dB")
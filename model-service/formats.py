@@ -0,0 +1,54 @@
+"""
+Output image formats and delta patches
+"""
+
+import io
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+# Format name -> (PIL format, media type, file extension)
+OUTPUT_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg", ".jpg"),
+    "png": ("PNG", "image/png", ".png"),
+    "webp": ("WEBP", "image/webp", ".webp"),
+}
+
+
+def encode_image(image: np.ndarray, fmt: str = "jpeg", quality: int = 95) -> bytes:
+    """
+    Encode a uint8 RGB image
+    Args:
+        image: RGB image as numpy array (H, W, 3)
+        fmt: One of OUTPUT_FORMATS
+        quality: JPEG/WebP quality (1-100), ignored for PNG
+    """
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Invalid format '{fmt}'. Must be one of: {list(OUTPUT_FORMATS)}")
+
+    pil_format = OUTPUT_FORMATS[fmt][0]
+    options = {} if pil_format == "PNG" else {"quality": quality}
+    buffer = io.BytesIO()
+    Image.fromarray(image.astype(np.uint8, copy=False)).save(buffer, format=pil_format, **options)
+    return buffer.getvalue()
+
+
+def delta_patch(result: np.ndarray, mask: np.ndarray, threshold: int = 128) -> Optional[tuple]:
+    """
+    Crop a result to the bounding box of the pixels the inpainter may have changed
+    Args:
+        result: Inpainted image as numpy array (H, W, 3)
+        mask: Mask passed to Inpainter.inpaint, only pixels above threshold are inpainted
+    Returns:
+        (patch, (x, y)) with the patch's top-left offset, or None for an empty mask
+    """
+    inpainted = mask > threshold
+    rows = np.flatnonzero(inpainted.any(axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(inpainted.any(axis=0))
+
+    top, bottom = int(rows[0]), int(rows[-1]) + 1
+    left, right = int(cols[0]), int(cols[-1]) + 1
+    return result[top:bottom, left:right], (left, top)
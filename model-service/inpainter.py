@@ -6,21 +6,60 @@ import torch
 import torch.nn.functional as F
 import numpy as np
 import os
+import functools
 import gc
+import math
 import traceback
 import time
 
 from typing import Optional
 from loguru import logger
+from PIL import Image
+
+from backends import BACKENDS, OnnxRuntimeBackend, TorchScriptBackend
+from buffers import BufferPool
+from stages import stage
 
 logger.remove()
 
+# Mean absolute difference (0-255 scale) tolerated against the fp32 reference
+# by verify_execution_mode, see README.md
+EXECUTION_MODE_TOLERANCES = {
+    "fp32": 0.5,
+    "bf16": 3.0,
+    "fp16": 1.0,
+    "onnx": 4.0,
+}
+
 class Inpainter:
     """Core inpainting functionality class"""
 
-    def __init__(self, device=None):
+    def __init__(self,
+                 device=None,
+                 max_image_size: Optional[int] = 1080,
+                 precision: str = "fp32",
+                 channels_last: bool = False,
+                 optimize: bool = False,
+                 num_threads: Optional[int] = None,
+                 interop_threads: Optional[int] = None,
+                 backend: str = "torchscript",
+                 onnx_path: Optional[str] = None,
+                 bucket_sizes: Optional[list] = None,
+                 checkpoint_path: Optional[str] = None):
         logger.info("Initializing Inpainter class")
 
+        if backend not in BACKENDS:
+            logger.error(f"Invalid backend '{backend}'. Must be one of: {BACKENDS}")
+            raise ValueError(f"Invalid backend '{backend}'. Must be one of: {BACKENDS}")
+        if backend == "onnx":
+            if device not in (None, "cpu"):
+                logger.error("The onnx backend only supports the cpu device")
+                raise ValueError("The onnx backend only supports the cpu device")
+            if precision != "fp32" or channels_last or optimize:
+                logger.error("precision, channels_last and optimize only apply to the torchscript backend")
+                raise ValueError("precision, channels_last and optimize only apply to the torchscript backend")
+            device = "cpu"
+
         # Set device based on parameter or auto-detect
         if device is None:
             self.device = "cuda" if torch.cuda.is_available() \
@@ -45,7 +84,12 @@ class Inpainter:
             self.device = device
             logger.info(f"Using specified device: {self.device}")
 
-        checkpoint_path = "./checkpoints/big-lama.pt"
+        self.precision = precision
+        self.channels_last = channels_last
+        self.optimize = optimize
+        self._configure_threads(num_threads, interop_threads)
+
+        checkpoint_path = checkpoint_path or "./checkpoints/big-lama.pt"
 
         # Handle absolute path for checkpoint
         if not os.path.isabs(checkpoint_path):
@@ -53,39 +97,183 @@ class Inpainter:
             checkpoint_path = os.path.join(script_dir, checkpoint_path)
             logger.info(f"Converted to absolute path: {checkpoint_path}")
 
+        self.checkpoint_path = checkpoint_path
+
         if not os.path.exists(checkpoint_path):
             logger.error(f"Checkpoint file not found: {checkpoint_path}")
             raise FileNotFoundError(f"Checkpoint file not found: {checkpoint_path}")
 
-        try:
-            logger.info(f"Loading model from checkpoint: {checkpoint_path}")
-            self.model = torch.jit.load(checkpoint_path, map_location=self.device)
-            self.model.eval().to(self.device)
-            logger.info("Model loaded successfully")
-        except Exception as e:
-            logger.error(f"Failed to load model: {str(e)}")
-            raise
+        if backend == "onnx":
+            onnx_path = onnx_path or os.path.splitext(checkpoint_path)[0] + ".onnx"
+            self.backend = OnnxRuntimeBackend(onnx_path, num_threads, interop_threads)
+        else:
+            self.backend = TorchScriptBackend(
+                checkpoint_path, self.device, precision, channels_last, optimize)
 
         # Preallocation constants from config
         self.pad_to_square = False
         self.min_size = None
         self.pad_mod = 8
 
-        # Preallocate lookup table for histogram matching
-        self._lookup_table = np.zeros(256, dtype=np.uint8)
+        # Canonical (height, width) padding targets, so the model only ever sees
+        # a few input shapes that can be warmed up ahead of time
+        self.bucket_sizes = sorted(
+            ((self._ceil_modulo(h, self.pad_mod), self._ceil_modulo(w, self.pad_mod))
+             for h, w in (bucket_sizes or [])),
+            key=lambda size: size[0] * size[1]
+        )
+
+        # Optional micro-batching scheduler shared by concurrent callers
+        self.scheduler = None
+
+        # Optional memory manager admitting forward passes under a memory budget
+        self.memory_manager = None
 
-        # Memory management settings
-        self.max_image_size = 1080
+        # Per-thread input and scratch buffers reused by forward passes of the same shape
+        self.buffers = BufferPool()
 
-        logger.info(f"Inpainter initialized with device: {self.device},\
-                      max_image_size: {self.max_image_size}")
+        # Preallocate lookup table for histogram matching
+        self._lookup_table = np.zeros(256, dtype=np.uint8)
 
-    def inpaint(self, image_np: np.ndarray, mask_np: np.ndarray) -> np.ndarray:
+        # Memory management settings: the longest side sent through the model,
+        # larger inputs are downscaled for inference and blended back at full
+        # resolution (None disables the limit)
+        self.max_image_size = max_image_size
+
+        # Region-of-interest settings: only the mask bounding box plus this
+        # much surrounding context is sent through the model
+        self.use_roi = True
+        self.roi_margin = 128
+
+        # Tiled inference settings: large inputs are split into overlapping
+        # tiles so model activations are bounded by the tile size, not the image size
+        self.use_tiling = False
+        self.tile_size = 512
+        self.tile_overlap = 64
+
+        logger.info(f"Inpainter initialized with device: {self.device}, backend: {self.backend.name},\
+                      max_image_size: {self.max_image_size}, precision: {self.precision},\
+                      channels_last: {self.channels_last}, optimize: {self.optimize}")
+
+    def _configure_threads(self, num_threads: Optional[int], interop_threads: Optional[int]):
+        """Apply intra-op/inter-op thread settings to the torch runtime"""
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        if interop_threads:
+            try:
+                torch.set_num_interop_threads(interop_threads)
+            except RuntimeError as e:
+                # Only allowed before the first parallel torch operation
+                logger.warning(f"Could not set inter-op threads: {e}")
+        logger.info(f"Torch threads - intra-op: {torch.get_num_threads()}, "
+                    f"inter-op: {torch.get_num_interop_threads()}")
+
+    def warmup(self, sizes: Optional[list] = None, batch_size: int = 1) -> dict:
+        """
+        Run dummy forward passes so the first real request at each shape is fast
+        Args:
+            sizes: (height, width) shapes to warm up (defaults to the bucket sizes,
+                   or a single 512x512 pass when no buckets are configured)
+            batch_size: Largest batch of the micro-batching scheduler, warmed up
+                        next to single passes when above 1
+        Returns:
+            Warmup time in seconds per "HxW" shape, "HxW@B" for batched passes
+        """
+        sizes = sizes or self.bucket_sizes or [(512, 512)]
+        batch_sizes = [1, batch_size] if batch_size > 1 else [1]
+        timings = {}
+        for h, w in sizes:
+            image = np.zeros((h, w, 3), dtype=np.uint8)
+            mask = np.zeros((h, w), dtype=np.uint8)
+            mask[h // 4:h * 3 // 4, w // 4:w * 3 // 4] = 255
+            padded_size = self._padded_size(h, w, self.pad_mod, buckets=self.bucket_sizes)
+
+            for batch in batch_sizes:
+                key = f"{h}x{w}" if batch == 1 else f"{h}x{w}@{batch}"
+                start_time = time.time()
+                # TorchScript's profiling executor specializes on the first couple of runs.
+                # Batched passes skip admission like the scheduler's, whose callers reserve
+                # memory per request.
+                for _ in range(2):
+                    self._forward_batch([image] * batch, [mask] * batch, padded_size,
+                                        admit=batch == 1)
+                timings[key] = time.time() - start_time
+                logger.info(f"Warmed up {key} in {timings[key]:.3f}s")
+
+        return timings
+
+    def verify_execution_mode(self, size: int = 256, tolerance: Optional[float] = None) -> dict:
+        """
+        Compare the configured backend and execution mode against a plain fp32
+        TorchScript forward pass
+        Args:
+            size: Side of the synthetic square test image
+            tolerance: Allowed mean absolute difference on the 0-255 scale
+                       (defaults to the EXECUTION_MODE_TOLERANCES entry of the mode)
+        Returns:
+            Difference metrics and whether the mode passed
+        """
+        rng = np.random.default_rng(0)
+        size = self._ceil_modulo(size, self.pad_mod)
+
+        # Smooth gradients with mild noise resemble natural images better than pure noise
+        ramp = np.linspace(0, 255, size, dtype=np.float32)
+        image = np.stack([ramp[np.newaxis, :].repeat(size, 0),
+                          ramp[:, np.newaxis].repeat(size, 1),
+                          np.full((size, size), 128, dtype=np.float32)], axis=2)
+        image = np.clip(image + rng.normal(0, 8, image.shape), 0, 255).astype(np.uint8)
+        mask = np.zeros((size, size), dtype=np.uint8)
+        mask[size // 4:size * 3 // 4, size // 3:size * 2 // 3] = 255
+
+        result = self._forward(image, mask).astype(np.float32)
+
+        # Reference: freshly loaded model, fp32, default memory format
+        reference_model = torch.jit.load(self.checkpoint_path, map_location=self.device).eval()
+        with torch.no_grad():
+            reference = reference_model(
+                torch.from_numpy(self._norm_img(image)).unsqueeze(0).to(self.device),
+                torch.from_numpy((self._norm_img(mask) > 0).astype(np.float32)).unsqueeze(0).to(self.device)
+            )[0].permute(1, 2, 0).float().cpu().numpy()
+        del reference_model
+        reference = np.clip(reference * 255, 0, 255).astype(np.uint8).astype(np.float32)
+
+        diff = np.abs(result - reference)
+        mse = float(np.mean(diff ** 2))
+        mode = self.backend.name if self.backend.name != "torchscript" else self.precision
+        tolerance = EXECUTION_MODE_TOLERANCES[mode] if tolerance is None else tolerance
+        metrics = {
+            "backend": self.backend.name,
+            "precision": self.precision,
+            "channels_last": self.channels_last,
+            "optimize": self.optimize,
+            "max_abs_diff": float(diff.max()),
+            "mean_abs_diff": float(diff.mean()),
+            "psnr": float("inf") if mse == 0 else float(10 * np.log10(255 ** 2 / mse)),
+            "tolerance": tolerance,
+        }
+        metrics["passed"] = metrics["mean_abs_diff"] <= tolerance
+        logger.info(f"Execution mode check: {metrics}")
+        return metrics
+
+    def inpaint(self,
+                image_np: np.ndarray,
+                mask_np: np.ndarray,
+                roi: Optional[bool] = None,
+                roi_margin: Optional[int] = None,
+                tiled: Optional[bool] = None,
+                max_size: Optional[int] = None) -> np.ndarray:
         """
         Simplified inpaint method that only performs core AI inference
         Args:
             image_np: RGB image as numpy array (H, W, 3)
             mask_np: Binary mask as numpy array (H, W) with 255 for inpaint areas
+            roi: Run the model on the mask bounding box only (defaults to self.use_roi)
+            roi_margin: Context pixels kept around the mask bounding box
+                        (defaults to self.roi_margin)
+            tiled: Run full-resolution tiled inference instead of downscaling
+                   to max_image_size (defaults to self.use_tiling)
+            max_size: Longest side sent through the model for this call, e.g. for a
+                      low resolution preview (defaults to max_image_size, never tiled)
         Returns:
             Inpainted result as numpy array (H, W, 3)
         """
@@ -95,22 +283,34 @@ class Inpainter:
         start_time = time.time()
 
         try:
-            # Ensure mask is binary
-            mask_np = (mask_np > 128).astype(np.uint8) * 255
-
-            # Perform core inpainting
-            result = self._pad_forward(image_np, mask_np)
-
-            # Fast unmasked restore
-            mask_indices = mask_np < 127
-            if len(mask_np.shape) == 2 and len(result.shape) == 3:
-                for c in range(result.shape[2]):
-                    result[:, :, c][mask_indices] = image_np[:, :, c][mask_indices]
+            use_roi = self.use_roi if roi is None else roi
+            margin = self.roi_margin if roi_margin is None else roi_margin
+            use_tiling = (self.use_tiling if tiled is None else tiled) and max_size is None
+            forward = functools.partial(self._budgeted_forward, tiled=use_tiling, max_size=max_size)
+
+            with stage("mask"):
+                # Ensure mask is binary
+                mask_np = np.where(mask_np > 128, np.uint8(255), np.uint8(0))
+                bbox = self._mask_bbox(mask_np, margin) if use_roi else None
+
+            if use_roi:
+                if bbox is None:
+                    logger.info("Empty mask, returning input image")
+                    return image_np.copy()
+
+                # Perform core inpainting on the region of interest only
+                top, bottom, left, right = bbox
+                logger.info(f"ROI inference on rows {top}:{bottom}, cols {left}:{right}")
+                result = image_np.copy()
+                result[top:bottom, left:right] = forward(
+                    image_np[top:bottom, left:right],
+                    mask_np[top:bottom, left:right]
+                )
             else:
-                result[mask_indices] = image_np[mask_indices]
+                # Perform core inpainting
+                result = forward(image_np, mask_np)
 
-            # Clear memory
-            self.clear_memory_cache()
+            # Unmasked pixels were already restored by the forward path
 
             total_time = time.time() - start_time
             logger.info(f"Simplified inpaint completed in {total_time:.3f}s")
@@ -123,79 +323,293 @@ class Inpainter:
             logger.error(f"Traceback: {traceback.format_exc()}")
             raise
 
+    def _budgeted_forward(self, image: np.ndarray, mask: np.ndarray,
+                          tiled: bool = False, max_size: Optional[int] = None) -> np.ndarray:
+        """
+        _tiled_forward or _scaled_forward, switching to tiles or a smaller inference
+        size when a single pass would never fit the memory manager's budget
+        """
+        if self.memory_manager is None:
+            if tiled:
+                return self._tiled_forward(image, mask)
+            return self._scaled_forward(image, mask, max_size)
+
+        h, w = image.shape[:2]
+        tile = self._ceil_modulo(self.tile_size, self.pad_mod)
+        tile_fits = self._pass_fits(min(tile, h), min(tile, w))
+        if tiled and tile_fits:
+            return self._tiled_forward(image, mask)
+
+        if not tiled:
+            small_w, small_h = self._inference_size(h, w, max_size) or (w, h)
+            if self._pass_fits(small_h, small_w):
+                return self._scaled_forward(image, mask, max_size)
+            if max_size is None and tile_fits:
+                logger.info(f"{small_w}x{small_h} pass exceeds the memory budget, using tiles")
+                return self._tiled_forward(image, mask)
+
+        # Downscale to the largest size that fits, inputs that never fit fail admission
+        fitted_size = self._budget_max_size(h, w, max_size)
+        if fitted_size is not None:
+            logger.info(f"Capping inference size at {fitted_size} to fit the memory budget")
+            max_size = fitted_size
+        return self._scaled_forward(image, mask, max_size)
+
+    def _pass_fits(self, h: int, w: int) -> bool:
+        """Whether one forward pass over an unpadded h x w input fits the memory budget"""
+        if self.scheduler is not None:
+            padded_size = self._padded_size(h, w, self.scheduler.bucket_mod,
+                                            buckets=self.bucket_sizes)
+        else:
+            padded_size = self._padded_size(h, w, self.pad_mod, self.pad_to_square,
+                                            self.min_size, self.bucket_sizes)
+        return self.memory_manager.estimate(*padded_size) <= self.memory_manager.budget_bytes
+
+    def _budget_max_size(self, h: int, w: int, max_size: Optional[int] = None) -> Optional[int]:
+        """Largest longest side, at most max_size, whose forward pass fits the memory budget"""
+        longest = max(h, w) if max_size is None else min(max(h, w), max_size)
+        # Start from the pixel budget and step down past the padding overhead
+        pixels = self.memory_manager.budget_bytes // self.memory_manager.bytes_per_pixel
+        side = min(longest, math.isqrt(pixels * max(h, w) // min(h, w)))
+        while side > 0:
+            small_w, small_h = self._inference_size(h, w, side) or (w, h)
+            if self._pass_fits(small_h, small_w):
+                return side
+            side -= self.pad_mod
+        return None
+
+    def _scaled_forward(self, image: np.ndarray, mask: np.ndarray,
+                        max_size: Optional[int] = None) -> np.ndarray:
+        """Forward pass capped at max_size (default: max_image_size), blended back at full resolution"""
+        h, w = image.shape[:2]
+        small_size = self._inference_size(h, w, max_size)
+        if small_size is None:
+            return self._pad_forward(image, mask)
+
+        logger.info(f"Downscaling {w}x{h} to {small_size[0]}x{small_size[1]} for inference")
+
+        with stage("resize"):
+            small_image = self._resize(image, small_size, Image.BICUBIC)
+            small_mask = self._downscale_mask(mask, small_size)
+
+        small_result = self._pad_forward(small_image, small_mask)
+
+        # Only the inpainted pixels come from the upscaled result
+        with stage("resize"):
+            result = self._resize(small_result, (w, h), Image.BICUBIC)
+        return self._fast_unmasked_restore(result, image, mask)
+
+    def _inference_size(self, h: int, w: int, max_size: Optional[int] = None) -> Optional[tuple]:
+        """(width, height) an input is downscaled to, None if it fits max_size (default: max_image_size)"""
+        max_size = self.max_image_size if max_size is None else max_size
+        if max_size is None or max(h, w) <= max_size:
+            return None
+        scale = max_size / max(h, w)
+        return max(round(w * scale), 1), max(round(h * scale), 1)
+
+    def _downscale_mask(self, mask: np.ndarray, size: tuple) -> np.ndarray:
+        """Resize a binary mask to (width, height)"""
+        # Bilinear + any-coverage threshold keeps thin strokes in the mask
+        return np.where(self._resize(mask, size, Image.BILINEAR) > 0, np.uint8(255), np.uint8(0))
+
+    def _tiled_forward(self, image: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        """
+        Forward pass over overlapping tiles with feathered blending
+
+        Tiles are blended one row of tiles at a time: rows above the next tile
+        row are final and go straight into the uint8 result, so the float
+        accumulators only span one tile row of the image.
+        """
+        h, w = image.shape[:2]
+        tile = self._ceil_modulo(self.tile_size, self.pad_mod)
+        overlap = min(self._ceil_modulo(self.tile_overlap, self.pad_mod), tile // 2)
+        if h <= tile and w <= tile:
+            return self._pad_forward(image, mask)
+
+        result = image.copy()
+        # Accumulators of the image rows [band_top, band_top + tile)
+        band_top = 0
+        accum = np.zeros((min(tile, h), w, image.shape[2]), dtype=np.float32)
+        weight_sum = np.zeros(accum.shape[:2], dtype=np.float32)
+
+        row_starts = self._tile_starts(h, tile, tile - overlap)
+        col_starts = self._tile_starts(w, tile, tile - overlap)
+        inferred = 0
+
+        for top in row_starts:
+            bottom = min(top + tile, h)
+            if top > band_top:
+                # No later tile reaches above top, finish those rows and shift the band
+                shift = top - band_top
+                self._blend_rows(result, band_top, accum[:shift], weight_sum[:shift])
+                accum[:-shift] = accum[shift:]
+                accum[-shift:] = 0
+                weight_sum[:-shift] = weight_sum[shift:]
+                weight_sum[-shift:] = 0
+                band_top = top
+
+            for left in col_starts:
+                right = min(left + tile, w)
+
+                tile_mask = mask[top:bottom, left:right]
+                # Tiles without masked pixels are left untouched
+                if not tile_mask.any():
+                    continue
+
+                tile_result = self._pad_forward(image[top:bottom, left:right], tile_mask)
+                weight = np.outer(
+                    self._feather_ramp(bottom - top, overlap, top > 0, bottom < h),
+                    self._feather_ramp(right - left, overlap, left > 0, right < w)
+                )
+                accum[:bottom - top, left:right] += tile_result * weight[:, :, np.newaxis]
+                weight_sum[:bottom - top, left:right] += weight
+                inferred += 1
+
+        self._blend_rows(result, band_top, accum[:h - band_top], weight_sum[:h - band_top])
+        logger.info(f"Tiled inference ran {inferred} of "
+                    f"{len(row_starts) * len(col_starts)} tiles")
+
+        return self._fast_unmasked_restore(result, image, mask)
+
+    def _blend_rows(self, result: np.ndarray, top: int, accum: np.ndarray, weight_sum: np.ndarray):
+        """Write the weighted average of accumulated tile rows into result, from row top"""
+        with stage("blend"):
+            rows = result[top:top + accum.shape[0]]
+            covered = weight_sum > 0
+            rows[covered] = np.clip(
+                accum[covered] / weight_sum[covered][:, np.newaxis] + 0.5, 0, 255
+            ).astype(np.uint8)
+
+    def _tile_starts(self, length: int, tile: int, stride: int) -> list:
+        """Tile offsets covering length, the last tile aligned to the end"""
+        if length <= tile:
+            return [0]
+        starts = list(range(0, length - tile, stride))
+        starts.append(length - tile)
+        return starts
+
+    def _feather_ramp(self, length: int, overlap: int, ramp_start: bool, ramp_end: bool) -> np.ndarray:
+        """1D blending weights ramping up over the overlap on shared tile edges"""
+        weights = np.ones(length, dtype=np.float32)
+        ramp = (np.arange(overlap, dtype=np.float32) + 1) / (overlap + 1)
+        if ramp_start:
+            weights[:overlap] = np.minimum(weights[:overlap], ramp)
+        if ramp_end:
+            weights[-overlap:] = np.minimum(weights[-overlap:], ramp[::-1])
+        return weights
+
     def _pad_forward(self, image: np.ndarray, mask: np.ndarray) -> np.ndarray:
         """Forward pass with padding"""
         h, w = image.shape[:2]
 
-        result = self._forward(
-            self._pad_img_to_modulo(image, self.pad_mod, self.pad_to_square, self.min_size),
-            self._pad_img_to_modulo(mask, self.pad_mod, self.pad_to_square, self.min_size)
-        )[:h, :w]
-
-        result = self._fast_unmasked_restore(result, image, mask)
+        if self.scheduler is not None:
+            # Batched with concurrent requests of a similar shape
+            result = self.scheduler.forward(image, mask)
+        else:
+            padded_size = self._padded_size(h, w, self.pad_mod, self.pad_to_square,
+                                            self.min_size, self.bucket_sizes)
+            result = self._forward_batch([image], [mask], padded_size)[0]
 
-        return result
+        return self._fast_unmasked_restore(result, image, mask)
 
     def _forward(self, image: np.ndarray, mask: np.ndarray) -> np.ndarray:
         """Core model forward pass"""
-        logger.info(f"Starting forward pass with image shape: {image.shape}, mask shape: {mask.shape}")
+        return self._forward_batch([image], [mask])[0]
 
+    def _forward_batch(self, images: list, masks: list,
+                       padded_size: Optional[tuple] = None,
+                       mask_input: Optional[np.ndarray] = None,
+                       admit: bool = True) -> list:
+        """
+        Core model forward pass over a batch
+        Args:
+            images: RGB uint8 images (H, W, 3)
+            masks: uint8 masks (H, W), nonzero where the model inpaints
+            padded_size: (height, width) every input is symmetric-padded to
+                         (defaults to the shape of the first, already padded, image)
+            mask_input: Model mask input from prepare_mask_input, used instead of
+                        filling the masks when every image shares one mask
+            admit: Reserve the pass in the memory manager, False when every input
+                   was already admitted by its caller
+        Returns:
+            uint8 results cropped back to each input's size
+        """
+        logger.info(f"Starting forward pass with batch size: {len(images)}, "
+                    f"image shape: {images[0].shape}, mask shape: {masks[0].shape}")
+        out_h, out_w = padded_size or images[0].shape[:2]
+
+        image = mask = None
         try:
             logger.info("Normalizing input images")
-            image = self._norm_img(image)
-            mask = (self._norm_img(mask) > 0).astype(np.float32)
+            n = len(images)
+            image = self.buffers.get("image", (n, 3, out_h, out_w),
+                                      allocate=self.backend.allocate_input)
+            if mask_input is not None:
+                mask = mask_input[:n]
+            else:
+                mask = self.buffers.get("mask", (n, 1, out_h, out_w),
+                                         allocate=self.backend.allocate_input)
+            with stage("pad_normalize"):
+                for i, img in enumerate(images):
+                    self._fill_input(image[i], img, np.divide, np.float32(255))
+                    if mask_input is None:
+                        self._fill_input(mask[i], masks[i], np.greater, 0)
             logger.info(f"After normalization - image shape: {image.shape}, mask shape: {mask.shape}")
 
-            with torch.no_grad():
-                logger.info("Creating tensors and moving to device")
-                # Create tensors
-                image_tensor = torch.from_numpy(image).unsqueeze(0).to(self.device)
-                mask_tensor = torch.from_numpy(mask).unsqueeze(0).to(self.device)
-                logger.info(f"Tensors created - image_tensor shape: {image_tensor.shape},\
-                              mask_tensor shape: {mask_tensor.shape}")
-                logger.info(f"Tensors on device: {image_tensor.device}, {mask_tensor.device}")
-
-                # Run inference
-                logger.info("Running model inference")
-                result_tensor = self.model(image_tensor, mask_tensor)[0]
-                logger.info(f"Model inference completed, result shape: {result_tensor.shape}")
-
-                # Move to CPU immediately
-                logger.info("Moving result to CPU")
-                image = result_tensor.permute(1, 2, 0).cpu().numpy()
-                logger.info(f"Result moved to CPU, numpy array shape: {image.shape}")
-
-                # Explicitly delete GPU tensors
-                logger.info("Cleaning up tensors")
-                del image_tensor, mask_tensor, result_tensor
-
-            # Aggressive GPU cache clearing after inference
-            logger.info("Clearing GPU cache")
-            if self.device == "mps":
-                torch.mps.empty_cache()
-                logger.info("MPS cache cleared")
-            elif self.device == "cuda":
-                torch.cuda.empty_cache()
-                logger.info("CUDA cache cleared")
-
-            # Always force garbage collection
-            logger.info("Running garbage collection")
-            gc.collect()
-
-            final_result = np.clip(image * 255, 0, 255).astype(np.uint8)
-            logger.info(f"Final result shape: {final_result.shape}, dtype: {final_result.dtype}")
+            if self.memory_manager is not None and admit:
+                # Wait until the estimated peak memory of this pass fits the budget
+                n, _, h, w = image.shape
+                with self.memory_manager.admit(self.memory_manager.estimate(h, w, n)):
+                    with stage("forward"):
+                        image = self.backend.forward(image, mask)
+            else:
+                with stage("forward"):
+                    image = self.backend.forward(image, mask)
+            if self.memory_manager is not None:
+                # Caches are only cleared under memory pressure
+                self.memory_manager.maybe_cleanup()
+
+            # Scale and clip in place in a scratch buffer, only the uint8 results are new
+            with stage("postprocess"):
+                scratch = self.buffers.get("output", (out_h, out_w, image.shape[3]))
+                final_result = []
+                for i, img in enumerate(images):
+                    h, w = img.shape[:2]
+                    scaled = scratch[:h, :w]
+                    np.multiply(image[i, :h, :w], 255, out=scaled)
+                    np.clip(scaled, 0, 255, out=scaled)
+                    result = np.empty(scaled.shape, dtype=np.uint8)
+                    np.copyto(result, scaled, casting="unsafe")
+                    final_result.append(result)
+            logger.info(f"Final result shape: {final_result[0].shape}, dtype: {final_result[0].dtype}")
             return final_result
 
         except Exception as e:
-            logger.error(f"Error in _forward method: {str(e)}")
+            logger.error(f"Error in _forward_batch method: {str(e)}")
             logger.error(f"Error type: {type(e).__name__}")
             logger.error(f"Image shape: {getattr(image, 'shape', 'unknown')}")
             logger.error(f"Mask shape: {getattr(mask, 'shape', 'unknown')}")
-            logger.error(f"Device: {self.device}")
+            logger.error(f"Device: {self.device}, backend: {self.backend.name}")
             
             logger.error(f"Traceback: {traceback.format_exc()}")
             raise
 
+    def prepare_mask_input(self, mask: np.ndarray, padded_size: tuple,
+                           batch_size: int) -> np.ndarray:
+        """
+        Model mask input for up to batch_size images sharing one mask
+        Args:
+            mask: uint8 mask (H, W), nonzero where the model inpaints
+            padded_size: (height, width) the mask is symmetric-padded to
+            batch_size: Largest batch the input is reused for
+        Returns:
+            float32 (batch_size, 1, height, width) input for _forward_batch
+        """
+        mask_input = self.backend.allocate_input((batch_size, 1) + tuple(padded_size))
+        self._fill_input(mask_input[0], mask, np.greater, 0)
+        mask_input[1:] = mask_input[0]
+        return mask_input
+
     # ============= PREPROCESSING UTILITY FUNCTIONS =============
 
     def _norm_img(self, img: np.ndarray) -> np.ndarray:
@@ -204,16 +618,51 @@ class Inpainter:
             img = img[:, :, np.newaxis]
         return np.transpose(img, (2, 0, 1)).astype(np.float32) / 255
 
+    def _fill_input(self, dst: np.ndarray, src: np.ndarray, op, operand):
+        """
+        Write op(src, operand) as CHW into a preallocated float32 buffer, then
+        symmetric-pad it across the rest of the buffer
+        """
+        if len(src.shape) == 2:
+            src = src[:, :, np.newaxis]
+        h, w = src.shape[:2]
+        op(np.transpose(src, (2, 0, 1)), operand, out=dst[:, :h, :w])
+
+        # Mirroring the filled block across its edge matches np.pad(mode="symmetric"),
+        # the block doubles until the buffer is covered
+        out_h, out_w = dst.shape[1:]
+        filled = h
+        while filled < out_h:
+            n = min(filled, out_h - filled)
+            dst[:, filled:filled + n, :w] = dst[:, filled - n:filled, :w][:, ::-1]
+            filled += n
+        filled = w
+        while filled < out_w:
+            n = min(filled, out_w - filled)
+            dst[:, :, filled:filled + n] = dst[:, :, filled - n:filled][:, :, ::-1]
+            filled += n
 
     def _pad_img_to_modulo(self, 
                            img: np.ndarray, 
                            mod: int, 
                            square: bool = False, 
-                           min_size: Optional[int] = None) -> np.ndarray:
-        """Pad image to be divisible by modulo"""
+                           min_size: Optional[int] = None,
+                           buckets: Optional[list] = None) -> np.ndarray:
+        """Pad image to be divisible by modulo, or to the smallest fitting bucket"""
         if len(img.shape) == 2:
             img = img[:, :, np.newaxis]
         h, w = img.shape[:2]
+        out_h, out_w = self._padded_size(h, w, mod, square, min_size, buckets)
+        return np.pad(img, ((0, out_h - h), (0, out_w - w), (0, 0)), mode="symmetric")
+
+    def _padded_size(self,
+                     h: int,
+                     w: int,
+                     mod: int,
+                     square: bool = False,
+                     min_size: Optional[int] = None,
+                     buckets: Optional[list] = None) -> tuple:
+        """(height, width) an input is padded to, see _pad_img_to_modulo"""
         out_h, out_w = self._ceil_modulo(h, mod), self._ceil_modulo(w, mod)
 
         if min_size is not None:
@@ -222,7 +671,32 @@ class Inpainter:
         if square:
             out_h = out_w = max(out_h, out_w)
 
-        return np.pad(img, ((0, out_h - h), (0, out_w - w), (0, 0)), mode="symmetric")
+        if buckets:
+            # Buckets are sorted by area, inputs larger than every bucket keep their size
+            for bucket_h, bucket_w in buckets:
+                if bucket_h >= out_h and bucket_w >= out_w:
+                    out_h, out_w = bucket_h, bucket_w
+                    break
+
+        return out_h, out_w
+
+    def _resize(self, img: np.ndarray, size: tuple, resample: int) -> np.ndarray:
+        """Resize a uint8 image to (width, height)"""
+        return np.asarray(Image.fromarray(img).resize(size, resample=resample))
+
+    def _mask_bbox(self, mask: np.ndarray, margin: int) -> Optional[tuple]:
+        """Bounding box (top, bottom, left, right) of the mask grown by margin"""
+        rows = np.flatnonzero(mask.any(axis=1))
+        if rows.size == 0:
+            return None
+        cols = np.flatnonzero(mask.any(axis=0))
+        h, w = mask.shape[:2]
+
+        top = max(int(rows[0]) - margin, 0)
+        bottom = min(int(rows[-1]) + 1 + margin, h)
+        left = max(int(cols[0]) - margin, 0)
+        right = min(int(cols[-1]) + 1 + margin, w)
+        return top, bottom, left, right
 
     def _ceil_modulo(self, x: int, mod: int) -> int:
         """Round up to nearest multiple"""
@@ -230,23 +704,18 @@ class Inpainter:
 
     def _fast_unmasked_restore(self, result: np.ndarray, 
                                image: np.ndarray, mask: np.ndarray) -> np.ndarray:
-        """Fast unmasked area restoration using boolean indexing"""
-        mask = mask < 127
-        result = np.array(result)
-
-        if len(mask.shape) == 2 and len(result.shape) == 3:
-            for c in range(result.shape[2]):
-                result[:, :, c][mask] = image[:, :, c][mask]
-        else:
-            result[mask] = image[mask]
-
+        """Copy the unmasked pixels back from the input in one vectorized pass"""
+        with stage("restore"):
+            keep = mask < 127
+            if len(keep.shape) == 2 and len(result.shape) == 3:
+                keep = keep[:, :, np.newaxis]
+            if not result.flags.writeable:
+                result = result.copy()
+            np.copyto(result, image, where=keep)
         return result
 
     def clear_memory_cache(self):
         """Explicitly clear GPU memory cache"""
-        if self.device == "mps":
-            torch.mps.empty_cache()
-        elif self.device == "cuda":
-            torch.cuda.empty_cache()
+        self.backend.clear_cache()
         # Always clear Python garbage collection
         gc.collect()
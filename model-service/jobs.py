@@ -0,0 +1,176 @@
+"""
+Asynchronous inpainting jobs
+
+A job is submitted, runs in the background and keeps its encoded result
+until it expires, so clients don't have to hold a connection open for the
+whole computation. Jobs move through the stages queued -> decoding ->
+inferring -> encoding and end as done or failed. Every change wakes up the
+job's progress listeners.
+
+Jobs are created and updated on the asyncio event loop.
+"""
+
+import asyncio
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from loguru import logger
+
+JOB_STAGES = ["queued", "decoding", "inferring", "encoding"]
+FINISHED = ("done", "failed")
+
+
+class Job:
+    """Status, stage timings and result of one background inpainting job"""
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.status = "queued"
+        self.created = time.time()
+        # Seconds spent in each finished stage
+        self.timings = {}
+        self.result: Optional[bytes] = None
+        self.media_type: Optional[str] = None
+        self.headers = {}
+        self.error: Optional[str] = None
+        self.status_code: Optional[int] = None
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        # Bumped on every change, so listeners can tell what they have seen
+        self.version = 0
+
+        self._stage_started = time.monotonic()
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.result) if self.result is not None else 0
+
+    def snapshot(self) -> dict:
+        """JSON-serializable status"""
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "created": self.created,
+            "timings": dict(self.timings),
+            "error": self.error,
+            "status_code": self.status_code,
+        }
+
+    async def wait_for_change(self, timeout: float, seen: Optional[int] = None) -> bool:
+        """
+        Wait until the job changes, returns False on timeout
+        Args:
+            seen: Version the caller last saw, returns at once if the job changed since
+        """
+        if seen is not None and seen != self.version:
+            return True
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def _transition(self, status: str):
+        """Close the current stage's timing, switch status and wake up listeners"""
+        now = time.monotonic()
+        self.timings[self.status] = self.timings.get(self.status, 0.0) + now - self._stage_started
+        self._stage_started = now
+        self.status = status
+        if self.finished:
+            self.finished_at = now
+        self.version += 1
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+
+class JobStore:
+    """Job store bounded by result TTL, job count and total result bytes"""
+
+    def __init__(self, max_jobs: int = 64, ttl_seconds: float = 600,
+                 max_bytes: int = 256 * 1024 * 1024):
+        self.max_jobs = max_jobs
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+
+    def create(self) -> Job:
+        """Register a new queued job"""
+        job = Job(secrets.token_urlsafe(16))
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._evict()
+        logger.info(f"Created job {job.job_id}")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Return a job, or None if unknown or expired"""
+        with self._lock:
+            self._expire()
+            return self._jobs.get(job_id)
+
+    def active(self) -> int:
+        """Jobs that have not finished yet"""
+        with self._lock:
+            return sum(not job.finished for job in self._jobs.values())
+
+    def set_stage(self, job: Job, stage: str):
+        """Move a running job to the next stage"""
+        if stage not in JOB_STAGES:
+            raise ValueError(f"Invalid job stage '{stage}'. Must be one of: {JOB_STAGES}")
+        job._transition(stage)
+
+    def finish(self, job: Job, result: Optional[bytes], media_type: str,
+               headers: Optional[dict] = None):
+        """Store the encoded result of a job and its response headers"""
+        job.result = result
+        job.media_type = media_type
+        job.headers = headers or {}
+        job._transition("done")
+        logger.info(f"Job {job.job_id} done in {sum(job.timings.values()):.3f}s")
+        with self._lock:
+            self._evict()
+
+    def fail(self, job: Job, status_code: int, error: str):
+        """Mark a job failed with the HTTP status its synchronous request would have had"""
+        job.status_code = status_code
+        job.error = error
+        job._transition("failed")
+        logger.warning(f"Job {job.job_id} failed with {status_code}: {error}")
+
+    def delete(self, job_id: str) -> bool:
+        """Drop a job, returning whether it existed"""
+        with self._lock:
+            return self._jobs.pop(job_id, None) is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._expire()
+            return len(self._jobs)
+
+    def _expire(self):
+        """Drop jobs that finished longer than the TTL ago (lock held)"""
+        deadline = time.monotonic() - self.ttl_seconds
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.finished and job.finished_at < deadline]:
+            del self._jobs[job_id]
+            logger.info(f"Job {job_id} expired")
+
+    def _evict(self):
+        """Drop the oldest finished jobs beyond the count and byte limits (lock held)"""
+        self._expire()
+        total_bytes = sum(job.nbytes for job in self._jobs.values())
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished]:
+            if len(self._jobs) <= self.max_jobs and total_bytes <= self.max_bytes:
+                break
+            total_bytes -= self._jobs.pop(job_id).nbytes
+            logger.info(f"Job {job_id} evicted")
@@ -1,6 +1,34 @@
-def main():
-    print("Hello from model-service!")
+"""
+Kupu model service command line
+
+Usage:
+    python main.py bench [options]    Inference benchmark suite, see benchmark.py
+    python main.py batch [options]    Offline batch inpainting, see batch.py
+    python main.py sequence [options] Frame sequence inpainting, see sequence.py
+"""
+
+import argparse
+from typing import Optional
+
+import batch
+import benchmark
+import sequence
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Kupu model service tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    benchmark.add_arguments(commands.add_parser(
+        "bench", help="Benchmark Inpainter.inpaint across resolutions and mask coverage"))
+    batch.add_arguments(commands.add_parser(
+        "batch", help="Inpaint image + mask pairs from directories or a manifest"))
+    sequence.add_arguments(commands.add_parser(
+        "sequence", help="Inpaint ordered frames sharing a mask, reusing unchanged results"))
+
+    args = parser.parse_args(argv)
+    return args.func(args)
 
 
 if __name__ == "__main__":
-    main()
+    raise SystemExit(main())
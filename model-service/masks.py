@@ -0,0 +1,213 @@
+"""
+Compact mask formats rasterized straight into uint8 masks
+
+Instead of a full-size encoded PNG, clients can describe a mask as
+- RLE: {"type": "rle", "size": [height, width], "counts": [...]}, run lengths
+  in row-major order alternating between unmasked and masked pixels, starting
+  with unmasked (a leading 0 when the first pixel is masked)
+- Strokes: {"type": "strokes", "strokes": [{"points": [[x, y], ...],
+  "radius": r, "fill": false}]}, polylines in image pixel coordinates drawn
+  with round caps and joins. Strokes with "fill" are closed and filled like a
+  canvas path (nonzero winding), their outline is only drawn if radius > 0.
+
+Rasterized masks are 255 where the image is inpainted and 0 elsewhere.
+"""
+
+import numpy as np
+
+
+def decode_rle(counts: list, height: int, width: int) -> np.ndarray:
+    """Expand row-major run lengths, starting with unmasked pixels, into a mask"""
+    counts = np.asarray(counts, dtype=np.int64)
+    if counts.ndim != 1 or (counts < 0).any():
+        raise ValueError("RLE counts must be a list of non-negative integers")
+    total = int(counts.sum())
+    if total != height * width:
+        raise ValueError(f"RLE counts cover {total} pixels, the image has {height * width}")
+
+    values = np.zeros(len(counts), dtype=np.uint8)
+    values[1::2] = 255
+    return np.repeat(values, counts).reshape(height, width)
+
+
+def encode_rle(mask: np.ndarray, threshold: int = 128) -> list:
+    """Row-major run lengths of the pixels above threshold, the inverse of decode_rle"""
+    flat = (mask > threshold).ravel()
+    if flat.size == 0:
+        return []
+    bounds = np.concatenate(([0], np.flatnonzero(flat[1:] != flat[:-1]) + 1, [flat.size]))
+    counts = np.diff(bounds)
+    if flat[0]:
+        counts = np.concatenate(([0], counts))
+    return counts.tolist()
+
+
+def _fill_rows(mask: np.ndarray, rows: np.ndarray, cols: np.ndarray, weights: np.ndarray):
+    """
+    Set the pixels where the running sum of weights along each row is nonzero, in place
+    Args:
+        mask: uint8 mask (H, W)
+        rows: Row of every weight
+        cols: Column (0 to W) from which every weight applies to the rest of its row
+        weights: +1/-1 coverage changes, summing to zero on every row
+    """
+    # Every row's weights sum to zero, so only the box spanned by the changes is touched
+    top, bottom = int(rows.min()), int(rows.max()) + 1
+    left, right = int(cols.min()), int(cols.max())
+    if left == right:
+        return
+    width = right - left + 1
+    changes = np.bincount((rows - top) * width + cols - left, weights=weights,
+                          minlength=(bottom - top) * width)
+    inside = np.cumsum(changes.reshape(bottom - top, width)[:, :-1], axis=1) != 0
+    mask[top:bottom, left:right][inside] = 255
+
+
+def _row_spans(starts: np.ndarray, ends: np.ndarray) -> tuple:
+    """Index of the item and the row of every row in the per-item ranges [start, end)"""
+    spans = np.maximum(ends - starts, 0)
+    item = np.repeat(np.arange(len(spans)), spans)
+    rows = starts[item] + np.arange(item.size) - np.repeat(np.cumsum(spans) - spans, spans)
+    return item, rows
+
+
+def _linear_range(a: np.ndarray, b: np.ndarray, lo, hi) -> tuple:
+    """Interval of u where lo <= a * u + b <= hi, elementwise, empty as (inf, -inf)"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        u0 = (lo - b) / a
+        u1 = (hi - b) / a
+    start = np.where(a > 0, u0, u1)
+    end = np.where(a > 0, u1, u0)
+    # Constraints that don't depend on u hold everywhere or nowhere
+    flat = a == 0
+    holds = (lo <= b) & (b <= hi)
+    start = np.where(flat, np.where(holds, -np.inf, np.inf), start)
+    end = np.where(flat, np.where(holds, np.inf, -np.inf), end)
+    return start, end
+
+
+def draw_polyline(mask: np.ndarray, points: np.ndarray, radius: float):
+    """
+    Set the pixels whose centers lie within radius of a polyline, in place
+
+    Every segment is a capsule, the union of discs around its ends and the
+    strip between them. A capsule covers one span of each pixel row, so all
+    segments are drawn at once as row spans.
+    Args:
+        mask: uint8 mask (H, W)
+        points: (N, 2) array of x, y vertices, a single point draws a dot
+        radius: Distance from the line to pixel centers
+    """
+    h, w = mask.shape
+    if len(points) == 1:
+        points = np.concatenate([points, points])
+    ax, ay = points[:-1, 0], points[:-1, 1]
+    bx, by = points[1:, 0], points[1:, 1]
+
+    # Rows whose pixel centers lie within radius of each segment's y range
+    row_start = np.clip(np.ceil(np.minimum(ay, by) - radius - 0.5), 0, h).astype(np.int64)
+    row_end = np.clip(np.floor(np.maximum(ay, by) + radius - 0.5) + 1, 0, h).astype(np.int64)
+    seg, rows = _row_spans(row_start, row_end)
+    if seg.size == 0:
+        return
+    yc = rows + 0.5
+
+    left = np.full(seg.size, np.inf)
+    right = np.full(seg.size, -np.inf)
+    for cx, cy in ((ax[seg], ay[seg]), (bx[seg], by[seg])):
+        dy = yc - cy
+        half = np.sqrt(np.maximum(radius * radius - dy * dy, 0))
+        hit = np.abs(dy) <= radius
+        left = np.where(hit, np.minimum(left, cx - half), left)
+        right = np.where(hit, np.maximum(right, cx + half), right)
+
+    # Strip: with u = x - ax, the distance across the segment is within radius
+    # and the position along it within its length
+    length = np.hypot(bx - ax, by - ay)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ux = np.where(length > 0, (bx - ax) / length, 0)[seg]
+        uy = np.where(length > 0, (by - ay) / length, 0)[seg]
+    qy = yc - ay[seg]
+    across_lo, across_hi = _linear_range(-uy, qy * ux, -radius, radius)
+    along_lo, along_hi = _linear_range(ux, qy * uy, 0, length[seg])
+    lo = np.maximum(across_lo, along_lo)
+    hi = np.minimum(across_hi, along_hi)
+    hit = (length[seg] > 0) & (lo <= hi)
+    left = np.where(hit, np.minimum(left, ax[seg] + lo), left)
+    right = np.where(hit, np.maximum(right, ax[seg] + hi), right)
+
+    # Columns whose pixel centers lie in [left, right]
+    first = np.clip(np.ceil(left - 0.5), 0, w).astype(np.int64)
+    last = np.clip(np.floor(right - 0.5) + 1, 0, w).astype(np.int64)
+    keep = first < last
+    rows, first, last = rows[keep], first[keep], last[keep]
+    if rows.size == 0:
+        return
+    _fill_rows(mask, np.concatenate([rows, rows]), np.concatenate([first, last]),
+               np.concatenate([np.ones(rows.size), -np.ones(rows.size)]))
+
+
+def fill_polygon(mask: np.ndarray, points: np.ndarray):
+    """
+    Set the pixels whose centers lie inside a closed polygon (nonzero winding), in place
+    Args:
+        mask: uint8 mask (H, W)
+        points: (N, 2) array of x, y vertices, the last one connects back to the first
+    """
+    h, w = mask.shape
+    x0, y0 = points[:, 0], points[:, 1]
+    x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+
+    # Each edge crosses the rows whose pixel centers lie in [min(y0, y1), max(y0, y1))
+    row_start = np.clip(np.ceil(np.minimum(y0, y1) - 0.5), 0, h).astype(np.int64)
+    row_end = np.clip(np.ceil(np.maximum(y0, y1) - 0.5), 0, h).astype(np.int64)
+    edge, rows = _row_spans(row_start, row_end)
+    if edge.size == 0:
+        return
+
+    # Crossing x of every (edge, row) pair, pixels right of it get the edge's direction
+    xs = x0[edge] + (rows + 0.5 - y0[edge]) * (x1[edge] - x0[edge]) / (y1[edge] - y0[edge])
+    cols = np.clip(np.floor(xs - 0.5).astype(np.int64) + 1, 0, w)
+    _fill_rows(mask, rows, cols, np.where(y1 > y0, 1.0, -1.0)[edge])
+
+
+def rasterize_strokes(strokes: list, height: int, width: int) -> np.ndarray:
+    """Draw stroke dicts with points, radius and fill into a new mask"""
+    mask = np.zeros((height, width), dtype=np.uint8)
+    for stroke in strokes:
+        points = np.asarray(stroke["points"], dtype=np.float64).reshape(-1, 2)
+        if len(points) == 0:
+            continue
+        if not np.isfinite(points).all():
+            raise ValueError("Stroke points must be finite numbers")
+
+        radius = float(stroke.get("radius", 0))
+        if stroke.get("fill"):
+            fill_polygon(mask, points)
+            if radius > 0:
+                draw_polyline(mask, np.concatenate([points, points[:1]]), radius)
+        else:
+            # Strokes are at least one pixel wide
+            draw_polyline(mask, points, max(radius, 0.5))
+    return mask
+
+
+def rasterize(spec: dict, height: int, width: int) -> np.ndarray:
+    """
+    Rasterize an RLE or stroke mask description for an image
+    Args:
+        spec: Mask description with a "type" of "rle" or "strokes"
+        height: Image height
+        width: Image width
+    Returns:
+        uint8 mask (height, width), 255 for inpaint areas
+    """
+    kind = spec.get("type")
+    if kind == "rle":
+        size = tuple(spec["size"])
+        if size != (height, width):
+            raise ValueError(f"RLE mask size {size[::-1]} does not match image size {(width, height)}")
+        return decode_rle(spec["counts"], height, width)
+    if kind == "strokes":
+        return rasterize_strokes(spec["strokes"], height, width)
+    raise ValueError(f"Invalid mask type '{kind}'. Must be one of: ['rle', 'strokes']")
@@ -0,0 +1,160 @@
+"""
+Memory-budgeted admission control for forward passes
+
+Each forward pass reserves an estimate of its peak memory, derived from its
+padded pixel count, and waits until the reservation fits the budget. Caches
+are only cleared when device or system memory crosses a pressure threshold,
+instead of after every request.
+"""
+
+import gc
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from typing import Optional
+
+import psutil
+import torch
+from buffers import BufferPool
+from loguru import logger
+
+
+def worker_processes() -> int:
+    """Processes sharing the machine's memory, exported by prefork.serve to its workers"""
+    return max(int(os.getenv("KUPU_WORKER_PROCESSES", "1")), 1)
+
+
+class MemoryBudgetExceeded(Exception):
+    """Raised when a job can never fit in the memory budget"""
+
+
+class AdmissionTimeout(Exception):
+    """Raised when a job waited too long for memory to free up"""
+
+
+class MemoryManager:
+    """Admits forward passes while their estimated peak memory fits a budget"""
+
+    def __init__(self,
+                 device: str,
+                 budget_bytes: Optional[int] = None,
+                 bytes_per_pixel: int = 2048,
+                 high_watermark: float = 0.85,
+                 admit_timeout: float = 30.0):
+        self.device = device
+        self.bytes_per_pixel = bytes_per_pixel
+        self.high_watermark = high_watermark
+        self.admit_timeout = admit_timeout
+        self.budget_bytes = budget_bytes or self._default_budget()
+
+        self._condition = threading.Condition()
+        self._reserved = 0
+        self._active = 0
+
+        self.admitted = 0
+        self.rejected = 0
+        self.cleanups = 0
+
+        # Reusable buffers of the inpainters sharing this budget, dropped on cleanup
+        self._buffer_pools = weakref.WeakSet()
+
+        logger.info(f"Memory manager budget: {self.budget_bytes / 1024 / 1024:.0f}MB, "
+                    f"{bytes_per_pixel} bytes/pixel, cleanup above {high_watermark:.0%}")
+
+    def _default_budget(self) -> int:
+        """
+        70% of the device memory (CUDA) or of the currently available system memory,
+        split evenly between pre-forked worker processes
+        """
+        if self.device == "cuda" and torch.cuda.is_available():
+            total = torch.cuda.get_device_properties(0).total_memory
+        else:
+            total = psutil.virtual_memory().available
+        return int(total * 0.7) // worker_processes()
+
+    def estimate(self, height: int, width: int, batch_size: int = 1) -> int:
+        """Estimated peak bytes of a forward pass over padded inputs"""
+        return height * width * batch_size * self.bytes_per_pixel
+
+    @contextmanager
+    def admit(self, nbytes: int):
+        """Reserve nbytes for the duration of the block, waiting for room if needed"""
+        if nbytes > self.budget_bytes:
+            with self._condition:
+                self.rejected += 1
+            raise MemoryBudgetExceeded(
+                f"Job needs ~{nbytes / 1024 / 1024:.0f}MB, "
+                f"budget is {self.budget_bytes / 1024 / 1024:.0f}MB")
+
+        deadline = time.monotonic() + self.admit_timeout
+        with self._condition:
+            while self._reserved + nbytes > self.budget_bytes:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._condition.wait(remaining):
+                    if self._reserved + nbytes <= self.budget_bytes:
+                        break
+                    self.rejected += 1
+                    raise AdmissionTimeout(
+                        f"Timed out waiting for {nbytes / 1024 / 1024:.0f}MB of memory")
+            self._reserved += nbytes
+            self._active += 1
+            self.admitted += 1
+
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._reserved -= nbytes
+                self._active -= 1
+                self._condition.notify_all()
+
+    def track_buffers(self, pool: BufferPool):
+        """Drop pool's buffers on cleanup and report them in stats, until the pool is released"""
+        with self._condition:
+            self._buffer_pools.add(pool)
+
+    def pressure(self) -> float:
+        """Fraction of device (or system) memory currently in use"""
+        if self.device == "cuda" and torch.cuda.is_available():
+            total = torch.cuda.get_device_properties(0).total_memory
+            return torch.cuda.memory_reserved() / total
+        if self.device == "mps" and hasattr(torch.mps, "recommended_max_memory"):
+            return torch.mps.driver_allocated_memory() / torch.mps.recommended_max_memory()
+        return psutil.virtual_memory().percent / 100
+
+    def maybe_cleanup(self) -> bool:
+        """Clear caches only when memory pressure is above the high watermark"""
+        if self.pressure() < self.high_watermark:
+            return False
+
+        logger.info("Memory pressure above watermark, clearing caches")
+        with self._condition:
+            pools = list(self._buffer_pools)
+        for pool in pools:
+            pool.clear()
+        gc.collect()
+        if self.device == "mps":
+            torch.mps.empty_cache()
+        elif self.device == "cuda":
+            torch.cuda.empty_cache()
+        with self._condition:
+            self.cleanups += 1
+        return True
+
+    def stats(self) -> dict:
+        """Admission policy and current reservations"""
+        with self._condition:
+            return {
+                "budget_mb": self.budget_bytes / 1024 / 1024,
+                "reserved_mb": self._reserved / 1024 / 1024,
+                "buffer_mb": sum(pool.nbytes() for pool in self._buffer_pools) / 1024 / 1024,
+                "active_jobs": self._active,
+                "bytes_per_pixel": self.bytes_per_pixel,
+                "high_watermark": self.high_watermark,
+                "pressure": self.pressure(),
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "cleanups": self.cleanups,
+            }
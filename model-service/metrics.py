@@ -0,0 +1,141 @@
+"""
+Prometheus metrics for the model service
+
+Stage latencies come from the stage() timers in the inpainting pipeline and
+the server's decode/encode steps. Request counts are recorded per route and
+status by the server middleware. Queue depth and memory gauges are read from
+the running service at scrape time.
+
+With multiple worker processes, set PROMETHEUS_MULTIPROC_DIR to an empty
+directory before starting the server. Counters and histograms are then
+aggregated across workers, while gauges describe the worker that served
+the scrape.
+"""
+
+import os
+from typing import Callable, Optional
+
+import psutil
+import torch
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram,
+                               PlatformCollector, ProcessCollector, generate_latest, multiprocess)
+from prometheus_client.core import GaugeMetricFamily
+
+import stages
+
+MULTIPROCESS_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR") or None
+
+REGISTRY = CollectorRegistry()
+ProcessCollector(registry=REGISTRY)
+PlatformCollector(registry=REGISTRY)
+
+# Scrape-time gauges of this process, also served in multi-process mode
+_local_collectors = []
+
+STAGE_SECONDS = Histogram(
+    "kupu_stage_seconds",
+    "Time spent in each pipeline stage",
+    ["stage"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+    registry=REGISTRY,
+)
+
+REQUESTS = Counter(
+    "kupu_requests_total",
+    "HTTP requests by route and status code",
+    ["route", "method", "status"],
+    registry=REGISTRY,
+)
+
+REQUEST_SECONDS = Histogram(
+    "kupu_request_seconds",
+    "HTTP request latency by route",
+    ["route", "method"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+    registry=REGISTRY,
+)
+
+IMAGE_PIXELS = Histogram(
+    "kupu_image_pixels",
+    "Pixels per inpainted image",
+    buckets=(65_536, 262_144, 1_048_576, 2_073_600, 4_194_304, 8_294_400, 16_777_216),
+    registry=REGISTRY,
+)
+
+CACHE_LOOKUPS = Counter(
+    "kupu_cache_lookups_total",
+    "Result cache lookups by outcome",
+    ["result"],
+    registry=REGISTRY,
+)
+
+
+def observe_stage(name: str, seconds: float):
+    """stages observer feeding the stage histogram"""
+    STAGE_SECONDS.labels(name).observe(seconds)
+
+
+stages.add_observer(observe_stage)
+
+
+class ServiceCollector:
+    """Gauges read from the running service at scrape time"""
+
+    def __init__(self, pool, get_inpainter: Callable, is_ready: Callable):
+        self.pool = pool
+        self.get_inpainter = get_inpainter
+        self.is_ready = is_ready
+
+    def collect(self):
+        yield GaugeMetricFamily("kupu_model_ready", "1 once the model is loaded and warmed up",
+                                value=float(self.is_ready()))
+        yield GaugeMetricFamily("kupu_inference_in_flight", "Inference jobs running on a worker",
+                                value=self.pool.in_flight)
+        yield GaugeMetricFamily("kupu_inference_queued", "Inference jobs waiting for a worker",
+                                value=self.pool.queued)
+
+        memory = GaugeMetricFamily("kupu_device_memory_bytes", "Memory used by the model device",
+                                   labels=["device", "kind"])
+        memory.add_metric(["system", "used"], psutil.virtual_memory().used)
+        inpainter = self.get_inpainter()
+        device = inpainter.device if inpainter is not None else None
+        if device == "cuda" and torch.cuda.is_available():
+            memory.add_metric(["cuda", "allocated"], torch.cuda.memory_allocated())
+            memory.add_metric(["cuda", "reserved"], torch.cuda.memory_reserved())
+        elif device == "mps" and torch.backends.mps.is_available():
+            memory.add_metric(["mps", "allocated"], torch.mps.current_allocated_memory())
+            memory.add_metric(["mps", "driver"], torch.mps.driver_allocated_memory())
+        yield memory
+
+        manager = inpainter.memory_manager if inpainter is not None else None
+        if manager is not None:
+            stats = manager.stats()
+            yield GaugeMetricFamily("kupu_memory_budget_bytes", "Memory budget for forward passes",
+                                    value=manager.budget_bytes)
+            yield GaugeMetricFamily("kupu_memory_reserved_bytes",
+                                    "Memory reserved by admitted forward passes",
+                                    value=stats["reserved_mb"] * 1024 * 1024)
+
+
+def register_service(pool, get_inpainter: Callable, is_ready: Callable):
+    """Expose the inference pool and model state as scrape-time gauges"""
+    collector = ServiceCollector(pool, get_inpainter, is_ready)
+    REGISTRY.register(collector)
+    _local_collectors.append(collector)
+
+
+def mark_process_dead(pid: int):
+    """Drop the live-process data of an exited worker in multi-process mode"""
+    if MULTIPROCESS_DIR is not None:
+        multiprocess.mark_process_dead(pid)
+
+
+def render(registry: Optional[CollectorRegistry] = None) -> tuple:
+    """Metrics in the Prometheus text format and their content type"""
+    if registry is None and MULTIPROCESS_DIR is not None:
+        # Counters and histograms of every worker, gauges of this one
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        for collector in _local_collectors:
+            registry.register(collector)
+    return generate_latest(registry or REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,443 @@
+"""
+Registry of named inpainting models loaded on demand
+
+Models are configured as a comma-separated list of `name=source` entries,
+where the source is a local TorchScript checkpoint or `hf:owner/repo/file`
+for a checkpoint downloaded from Hugging Face into checkpoints/. Each model
+is loaded the first time a request selects it, and stays resident in an LRU
+cache bounded by a memory budget. Loading a model that doesn't fit evicts
+the least recently used idle models, a model is never evicted while it
+serves a request, and the default model is never evicted at all. Models idle
+for longer than the idle TTL are unloaded as well.
+"""
+
+import gc
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Optional
+
+import psutil
+import torch
+from huggingface_hub import hf_hub_download
+from loguru import logger
+from memory import worker_processes
+
+# Served when KUPU_MODELS is unset
+DEFAULT_MODELS = "big-lama=hf:ardiantovn/big-lama/big-lama.pt"
+
+
+class UnknownModel(Exception):
+    """Raised when a request selects a model that isn't configured"""
+
+
+class ModelBudgetExceeded(Exception):
+    """Raised when a model can never fit in the model memory budget"""
+
+
+class ModelLoadTimeout(Exception):
+    """Raised when a model waited too long for its load or for busy models to be evictable"""
+
+
+class ModelSpec:
+    """Where a named model's checkpoint comes from"""
+
+    def __init__(self, name: str, source: str, checkpoint_dir: str):
+        self.name = name
+        self.source = source
+        self.repo_id: Optional[str] = None
+        self.filename: Optional[str] = None
+
+        if source.startswith("hf:"):
+            owner, repo, filename = source[3:].split("/", 2)
+            self.repo_id = f"{owner}/{repo}"
+            self.filename = filename
+            path = os.path.join(checkpoint_dir, os.path.basename(filename))
+        else:
+            path = source
+        if not os.path.isabs(path):
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+        self.checkpoint_path = path
+
+    def estimate(self) -> int:
+        """Weight bytes before loading: the checkpoint size, 0 if not downloaded yet"""
+        try:
+            return os.path.getsize(self.checkpoint_path)
+        except OSError:
+            return 0
+
+
+def parse_model_specs(value: str, checkpoint_dir: str = "checkpoints") -> dict:
+    """Parse "name=path_or_hf:owner/repo/file,..." into ModelSpecs by name, in order"""
+    specs = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, source = item.partition("=")
+        name, source = name.strip(), source.strip()
+        if not name or not source:
+            raise ValueError(f"Invalid model entry '{item}', expected name=source")
+        if source.startswith("hf:") and source.count("/") < 2:
+            raise ValueError(f"Invalid Hugging Face source '{source}', expected hf:owner/repo/file")
+        specs[name] = ModelSpec(name, source, checkpoint_dir)
+    if not specs:
+        raise ValueError("No models configured")
+    return specs
+
+
+def download_model_if_missing(checkpoint_path: str = "./checkpoints/big-lama.pt",
+                              repo_id: str = "ardiantovn/big-lama",
+                              filename: str = "big-lama.pt"):
+    """Download a checkpoint from Hugging Face if it doesn't exist locally (default: LaMa)"""
+
+    # Convert relative path to absolute path
+    if not os.path.isabs(checkpoint_path):
+        # Remove leading "./" if present
+        clean_path = checkpoint_path.lstrip("./")
+        checkpoint_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), clean_path)
+
+    checkpoint_file = Path(checkpoint_path)
+
+    # Check if model file exists and is a valid file (not a directory)
+    if checkpoint_file.exists() and checkpoint_file.is_file() and checkpoint_file.stat().st_size > 0:
+        logger.info(f"✅ Model found at: {checkpoint_path}")
+        return
+
+    # Create checkpoints directory if it doesn't exist
+    checkpoint_file.parent.mkdir(parents=True, exist_ok=True)
+
+    logger.info(f"📥 Model not found. Downloading from Hugging Face...")
+    logger.info(f"📁 Saving to: {checkpoint_path}")
+
+    # Download model using huggingface_hub
+    downloaded_path = hf_hub_download(
+        repo_id=repo_id,
+        filename=filename,
+        cache_dir=None,  # Use default cache
+        local_dir=None   # Download to cache first
+    )
+
+    link_or_copy(downloaded_path, checkpoint_path)
+
+    logger.info(f"✅ Model downloaded successfully to: {checkpoint_path}")
+
+
+def link_or_copy(source: str, target: str):
+    """Expose a cached file at target via hardlink, symlink, or copy as a last resort"""
+    # HF cache snapshots are symlinks into the blob store, link the blob itself
+    source = os.path.realpath(source)
+    if os.path.lexists(target):
+        os.remove(target)
+
+    try:
+        os.link(source, target)
+        logger.info(f"🔗 Hardlinked {target} -> {source}")
+        return
+    except OSError as e:
+        logger.info(f"Hardlink not possible ({e}), trying symlink")
+
+    try:
+        os.symlink(source, target)
+        logger.info(f"🔗 Symlinked {target} -> {source}")
+        return
+    except OSError as e:
+        logger.info(f"Symlink not possible ({e}), copying")
+
+    shutil.copy2(source, target)
+
+
+def download_spec(spec: ModelSpec):
+    """Download a registry model's checkpoint if it comes from Hugging Face"""
+    if spec.repo_id is not None:
+        download_model_if_missing(spec.checkpoint_path, spec.repo_id, spec.filename)
+
+
+class ModelEntry:
+    """Registry state of one configured model"""
+
+    def __init__(self, spec: ModelSpec):
+        self.spec = spec
+        self.inpainter = None
+        self.nbytes = 0
+        self.in_use = 0
+        self.loading = False
+        self.last_used = time.monotonic()
+        self.loads = 0
+        self.load_seconds = 0.0
+        # Serializes loads of this model, concurrent requests wait for one load
+        self.load_lock = threading.Lock()
+
+
+class ModelRegistry:
+    """Lazily loaded models in an LRU cache bounded by a memory budget"""
+
+    def __init__(self,
+                 specs: dict,
+                 loader: Callable,
+                 default: Optional[str] = None,
+                 budget_bytes: Optional[int] = None,
+                 idle_ttl: float = 0,
+                 load_timeout: float = 60.0):
+        """
+        Args:
+            specs: ModelSpecs by name
+            loader: Called with a ModelSpec, returns a ready Inpainter
+            default: Model used when a request doesn't select one (default: the first)
+            budget_bytes: Budget for resident weights (default: 30% of CUDA memory or of
+                          available system memory, split between pre-forked workers)
+            idle_ttl: Unload models unused for this many seconds, 0 keeps them
+            load_timeout: Seconds a request waits for another load of the same model,
+                          and a load waits for busy models to become evictable
+        """
+        self.specs = specs
+        self.loader = loader
+        self.default = default or next(iter(specs))
+        if self.default not in specs:
+            raise ValueError(f"Default model '{self.default}' is not configured: {list(specs)}")
+        # The default is resolved on first use, in the worker when the registry is
+        # created before prefork.serve forks
+        self._budget_bytes = budget_bytes or None
+        self.idle_ttl = idle_ttl
+        self.load_timeout = load_timeout
+
+        self._condition = threading.Condition()
+        self._entries = {name: ModelEntry(spec) for name, spec in specs.items()}
+        # Resident and loading models, least recently used first
+        self._resident = OrderedDict()
+
+        self.evictions = 0
+
+        logger.info(f"Model registry: {list(specs)}, default '{self.default}'")
+
+    @property
+    def budget_bytes(self) -> int:
+        """Budget for resident weights"""
+        if self._budget_bytes is None:
+            self._budget_bytes = self._default_budget()
+            logger.info(f"Model budget: {self._budget_bytes / 1024 / 1024:.0f}MB")
+        return self._budget_bytes
+
+    @budget_bytes.setter
+    def budget_bytes(self, value: int):
+        self._budget_bytes = value
+
+    @staticmethod
+    def _default_budget() -> int:
+        """
+        30% of the CUDA device memory or of the currently available system memory,
+        split evenly between pre-forked worker processes
+        """
+        if torch.cuda.is_available():
+            total = torch.cuda.get_device_properties(0).total_memory
+        else:
+            total = psutil.virtual_memory().available
+        return int(total * 0.3) // worker_processes()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.specs
+
+    def acquire(self, name: Optional[str] = None):
+        """
+        Pin a model for a request, loading it first if it isn't resident
+        Args:
+            name: Configured model name (default: the default model)
+        Returns:
+            The model's Inpainter, hand it back with release(name)
+        """
+        name = name or self.default
+        entry = self._entries.get(name)
+        if entry is None:
+            raise UnknownModel(f"Unknown model '{name}'. Must be one of: {list(self.specs)}")
+        self.expire_idle()
+
+        if not entry.load_lock.acquire(timeout=self.load_timeout):
+            raise ModelLoadTimeout(f"Timed out waiting for model '{name}' to finish loading")
+        try:
+            with self._condition:
+                if entry.inpainter is not None:
+                    entry.in_use += 1
+                    entry.last_used = time.monotonic()
+                    self._resident.move_to_end(name)
+                    return entry.inpainter
+                victims = self._make_room(entry, entry.spec.estimate())
+                entry.loading = True
+                entry.in_use += 1
+                self._resident[name] = entry
+            self._unload_all(victims)
+
+            logger.info(f"📦 Loading model '{name}' from {entry.spec.source}")
+            start = time.perf_counter()
+            try:
+                inpainter = self.loader(entry.spec)
+            except Exception:
+                with self._condition:
+                    entry.loading = False
+                    entry.in_use -= 1
+                    self._resident.pop(name, None)
+                    self._condition.notify_all()
+                raise
+            seconds = time.perf_counter() - start
+
+            with self._condition:
+                entry.inpainter = inpainter
+                entry.nbytes = inpainter.backend.nbytes() or entry.spec.estimate()
+                entry.loading = False
+                entry.loads += 1
+                entry.load_seconds += seconds
+                entry.last_used = time.monotonic()
+                nbytes = entry.nbytes
+                if nbytes > self.budget_bytes:
+                    entry.in_use -= 1
+                    victims = [self._evict(entry)]
+                else:
+                    # The estimate may have been low, settle the budget with the real size
+                    victims = self._evict_over_budget()
+            if nbytes > self.budget_bytes:
+                del inpainter
+                self._unload_all(victims)
+                raise ModelBudgetExceeded(
+                    f"Model '{name}' needs {nbytes / 1024 / 1024:.0f}MB, "
+                    f"model budget is {self.budget_bytes / 1024 / 1024:.0f}MB")
+            self._unload_all(victims)
+        finally:
+            entry.load_lock.release()
+
+        logger.info(f"✅ Model '{name}' loaded in {seconds:.2f}s, "
+                    f"{nbytes / 1024 / 1024:.0f}MB resident")
+        return inpainter
+
+    def release(self, name: Optional[str] = None):
+        """Unpin a model acquired for a request"""
+        entry = self._entries[name or self.default]
+        with self._condition:
+            entry.in_use -= 1
+            entry.last_used = time.monotonic()
+            self._condition.notify_all()
+
+    @contextmanager
+    def use(self, name: Optional[str] = None):
+        """Inpainter of a model, pinned for the duration of the block"""
+        inpainter = self.acquire(name)
+        try:
+            yield inpainter
+        finally:
+            self.release(name)
+
+    def expire_idle(self) -> int:
+        """Unload models idle for longer than the idle TTL, returns how many"""
+        if not self.idle_ttl:
+            return 0
+        deadline = time.monotonic() - self.idle_ttl
+        with self._condition:
+            victims = [self._evict(entry) for entry in list(self._resident.values())
+                       if self._evictable(entry) and entry.last_used < deadline]
+        self._unload_all(victims)
+        return len(victims)
+
+    def unload_all(self):
+        """Unload every idle model, including the default, on shutdown"""
+        with self._condition:
+            victims = [self._evict(entry) for entry in list(self._resident.values())
+                       if entry.inpainter is not None and entry.in_use == 0]
+        self._unload_all(victims)
+
+    def stats(self) -> dict:
+        """Budget usage and the state of every configured model"""
+        now = time.monotonic()
+        with self._condition:
+            models = [{
+                "name": name,
+                "source": entry.spec.source,
+                "default": name == self.default,
+                "resident": entry.inpainter is not None,
+                "loading": entry.loading,
+                "in_use": entry.in_use,
+                "memory_mb": entry.nbytes / 1024 / 1024,
+                "idle_seconds": now - entry.last_used if entry.inpainter is not None else None,
+                "loads": entry.loads,
+                "load_seconds": entry.load_seconds,
+            } for name, entry in self._entries.items()]
+            return {
+                "default": self.default,
+                "budget_mb": self.budget_bytes / 1024 / 1024,
+                "resident_mb": self._resident_bytes() / 1024 / 1024,
+                "resident": [name for name, entry in self._resident.items()
+                             if entry.inpainter is not None],
+                "evictions": self.evictions,
+                "models": models,
+            }
+
+    def _resident_bytes(self) -> int:
+        """Bytes of resident models, estimates for the ones still loading (lock held)"""
+        return sum(entry.nbytes if entry.inpainter is not None else entry.spec.estimate()
+                   for entry in self._resident.values())
+
+    def _evictable(self, entry: ModelEntry) -> bool:
+        """Resident, idle and not the default model (lock held)"""
+        return (entry.inpainter is not None and entry.in_use == 0
+                and entry.spec.name != self.default)
+
+    def _make_room(self, entry: ModelEntry, nbytes: int) -> list:
+        """
+        Evict idle models until nbytes more fit the budget, waiting for busy ones (lock held)
+        Returns:
+            The evicted (name, inpainter) pairs, to unload once the lock is released
+        """
+        if nbytes > self.budget_bytes:
+            raise ModelBudgetExceeded(
+                f"Model '{entry.spec.name}' needs ~{nbytes / 1024 / 1024:.0f}MB, "
+                f"model budget is {self.budget_bytes / 1024 / 1024:.0f}MB")
+
+        victims = []
+        deadline = time.monotonic() + self.load_timeout
+        while self._resident_bytes() + nbytes > self.budget_bytes:
+            idle = next((other for other in self._resident.values() if self._evictable(other)), None)
+            if idle is not None:
+                victims.append(self._evict(idle))
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._condition.wait(remaining):
+                if self._resident_bytes() + nbytes <= self.budget_bytes:
+                    break
+                raise ModelLoadTimeout(
+                    f"Timed out waiting for busy models to free "
+                    f"{nbytes / 1024 / 1024:.0f}MB for model '{entry.spec.name}'")
+        return victims
+
+    def _evict_over_budget(self) -> list:
+        """Evict least recently used idle models while over budget (lock held)"""
+        victims = []
+        while self._resident_bytes() > self.budget_bytes:
+            idle = next((other for other in self._resident.values() if self._evictable(other)), None)
+            if idle is None:
+                break
+            victims.append(self._evict(idle))
+        return victims
+
+    def _evict(self, entry: ModelEntry) -> tuple:
+        """Drop a model from the cache, returns its (name, inpainter) to unload (lock held)"""
+        self._resident.pop(entry.spec.name, None)
+        victim = (entry.spec.name, entry.inpainter)
+        entry.inpainter = None
+        entry.nbytes = 0
+        self.evictions += 1
+        self._condition.notify_all()
+        return victim
+
+    def _unload_all(self, victims: list):
+        """Stop evicted models' schedulers and release their memory"""
+        if not victims:
+            return
+        device = victims[0][1].device
+        for name, inpainter in victims:
+            if inpainter.scheduler is not None:
+                inpainter.scheduler.stop()
+            logger.info(f"♻️ Unloaded model '{name}'")
+        del victims[:], inpainter
+        gc.collect()
+        if device == "cuda" and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        elif device == "mps" and torch.backends.mps.is_available():
+            torch.mps.empty_cache()
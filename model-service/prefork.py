@@ -0,0 +1,141 @@
+"""
+Pre-fork multi-process serving
+
+The master process loads the model weights once, binds the listening socket
+and forks the worker processes. Workers share the weights copy-on-write and
+accept connections from the shared socket. Each worker is pinned to its own
+slice of CPU cores, and its torch intra-op threads match the slice. Workers
+that die are restarted. KUPU_WORKER_PROCESSES tells the workers how many of
+them share the machine, default memory budgets are split between them.
+
+Nothing may run a forward pass, start threads or initialize CUDA in the
+master before forking: OpenMP thread pools and CUDA contexts don't survive
+fork(). Warmup therefore happens in each worker.
+"""
+
+import os
+import signal
+import socket
+import time
+from typing import Callable, Optional
+
+import torch
+import uvicorn
+from loguru import logger
+
+
+def available_cores() -> list:
+    """CPU cores this process may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def partition_cores(processes: int, threads: Optional[int] = None) -> list:
+    """
+    Split the available cores into one slice per worker process
+    Args:
+        processes: Number of worker processes
+        threads: Cores (and torch threads) per process (defaults to an even split)
+    Returns:
+        A list of core ids per process, slices wrap around when oversubscribed
+    """
+    cores = available_cores()
+    threads = threads or max(len(cores) // processes, 1)
+    if processes * threads > len(cores):
+        logger.warning(f"{processes} processes x {threads} threads oversubscribe "
+                       f"{len(cores)} cores")
+    return [[cores[(i * threads + j) % len(cores)] for j in range(threads)]
+            for i in range(processes)]
+
+
+def pin_worker(cores: list):
+    """Pin the calling process to cores and size the torch thread pool to match"""
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+    logger.info(f"Worker {os.getpid()} pinned to cores {cores}")
+
+
+def bind_socket(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    """Listening socket inherited by every worker"""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def serve(app, host: str, port: int, processes: int, threads: Optional[int] = None,
+          preload: Optional[Callable] = None, on_worker_exit: Optional[Callable] = None,
+          log_level: str = "info"):
+    """
+    Run app in pre-forked worker processes sharing one socket
+    Args:
+        app: ASGI application, its lifespan runs in every worker
+        processes: Number of worker processes
+        threads: Cores and torch threads per worker (defaults to an even split)
+        preload: Called once in the master before forking, e.g. to load weights
+        on_worker_exit: Called with the pid of every worker that exits
+    """
+    if not hasattr(os, "fork"):
+        raise RuntimeError("Multi-process serving requires os.fork()")
+
+    os.environ["KUPU_WORKER_PROCESSES"] = str(processes)
+    if preload is not None:
+        preload()
+    sock = bind_socket(host, port)
+    slices = partition_cores(processes, threads)
+    workers = {}
+    stopping = False
+
+    def spawn(index: int):
+        pid = os.fork()
+        if pid == 0:
+            # Worker: default signal handling, uvicorn installs its own
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            exit_code = 1
+            try:
+                pin_worker(slices[index])
+                server = uvicorn.Server(uvicorn.Config(app, log_level=log_level))
+                server.run(sockets=[sock])
+                exit_code = 0
+            finally:
+                os._exit(exit_code)
+        workers[pid] = index
+        logger.info(f"Started worker {pid} on cores {slices[index]}")
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    logger.info(f"Serving on {host}:{port} with {processes} worker processes")
+    for index in range(processes):
+        spawn(index)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = workers.pop(pid, None)
+        if on_worker_exit is not None:
+            on_worker_exit(pid)
+        if index is not None and not stopping:
+            logger.error(f"Worker {pid} exited with status {status}, restarting")
+            # Avoid a tight crash loop
+            time.sleep(1)
+            spawn(index)
+
+    sock.close()
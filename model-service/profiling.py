@@ -0,0 +1,96 @@
+"""
+On-demand torch.profiler captures of individual inference jobs
+
+A job is profiled when its request carries the admin token, or when the
+profiler was armed for the next N jobs. Each capture writes a Chrome trace
+(`<id>.pt.trace.json`, also readable by the TensorBoard profiler plugin) and a
+top-ops summary (`<id>.txt`) to the output directory. Jobs that are not
+profiled only pay for an integer check.
+"""
+
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+import torch
+from loguru import logger
+from torch.profiler import ProfilerActivity, profile
+
+
+class RequestProfiler:
+    """Arms and runs torch.profiler captures of single jobs"""
+
+    def __init__(self, output_dir: str, row_limit: int = 30, history: int = 50):
+        self.output_dir = output_dir
+        self.row_limit = row_limit
+        self.captures = deque(maxlen=history)
+
+        self._lock = threading.Lock()
+        # Only one torch profiler can run per process
+        self._capture_lock = threading.Lock()
+        self._armed = 0
+
+    @property
+    def armed(self) -> int:
+        """Jobs left to profile"""
+        return self._armed
+
+    def arm(self, count: int):
+        """Profile the next count jobs (0 disarms)"""
+        with self._lock:
+            self._armed = max(count, 0)
+        logger.info(f"Profiler armed for {self._armed} job(s)")
+
+    def take(self) -> bool:
+        """Consume one armed capture, if any"""
+        if self._armed <= 0:
+            return False
+        with self._lock:
+            if self._armed <= 0:
+                return False
+            self._armed -= 1
+            return True
+
+    def new_capture_id(self) -> str:
+        """Unique, time-sortable capture id"""
+        return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+    @contextmanager
+    def capture(self, capture_id: str):
+        """Profile the block and write its trace and summary, even if it raises"""
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+
+        with self._capture_lock:
+            prof = profile(activities=activities, record_shapes=True, profile_memory=True)
+            start_time = time.time()
+            prof.start()
+            try:
+                yield
+            finally:
+                prof.stop()
+                self._export(prof, capture_id, time.time() - start_time)
+
+    def _export(self, prof, capture_id: str, seconds: float):
+        """Write the Chrome trace and top-ops table of a finished capture"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        trace_path = os.path.join(self.output_dir, f"{capture_id}.pt.trace.json")
+        summary_path = os.path.join(self.output_dir, f"{capture_id}.txt")
+
+        prof.export_chrome_trace(trace_path)
+        sort_by = "self_cuda_time_total" if torch.cuda.is_available() else "self_cpu_time_total"
+        with open(summary_path, "w") as f:
+            f.write(prof.key_averages(group_by_input_shape=True).table(
+                sort_by=sort_by, row_limit=self.row_limit))
+
+        self.captures.append({
+            "id": capture_id,
+            "seconds": seconds,
+            "trace": trace_path,
+            "summary": summary_path,
+        })
+        logger.info(f"Profile {capture_id} written to {self.output_dir}")
@@ -0,0 +1,140 @@
+"""
+Dynamic micro-batching scheduler for concurrent inpainting requests
+
+Callers block in BatchScheduler.forward while a background thread collects
+requests for a short window, groups them into shape buckets, runs one batched
+forward pass per bucket and hands each caller its own slice of the result.
+Smaller buckets are dispatched first.
+"""
+
+import queue
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future
+
+import numpy as np
+from loguru import logger
+
+
+class _BatchItem:
+    """Single pending forward pass"""
+
+    __slots__ = ("image", "mask", "bucket", "future")
+
+    def __init__(self, image: np.ndarray, mask: np.ndarray, bucket: tuple):
+        self.image = image
+        self.mask = mask
+        self.bucket = bucket
+        self.future = Future()
+
+
+class BatchScheduler:
+    """Collects forward passes from concurrent callers into shape-bucketed batches"""
+
+    def __init__(self, inpainter, max_batch_size: int = 4, max_wait_ms: float = 10.0,
+                 bucket_mod: int = 64):
+        if max_batch_size < 1:
+            raise ValueError(f"max_batch_size must be at least 1, got {max_batch_size}")
+
+        self.inpainter = inpainter
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        # Buckets must stay valid model inputs, so round up to pad_mod
+        self.bucket_mod = inpainter._ceil_modulo(bucket_mod, inpainter.pad_mod)
+
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def start(self):
+        """Start the batching thread"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="batch-scheduler", daemon=True)
+        self._thread.start()
+        logger.info(f"Batch scheduler started - max batch size: {self.max_batch_size}, "
+                    f"max wait: {self.max_wait * 1000:.1f}ms, bucket: {self.bucket_mod}px")
+
+    def stop(self):
+        """Stop the batching thread after the queued requests are served"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def forward(self, image: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        """Blocking forward pass of an unpadded image, batched with concurrent callers"""
+        if self._thread is None:
+            raise RuntimeError("Batch scheduler is not running")
+
+        h, w = image.shape[:2]
+        # Canonical bucket sizes take precedence over bucket_mod rounding.
+        # Inputs are padded to the bucket while they are copied into the batch
+        bucket = self.inpainter._padded_size(h, w, self.bucket_mod,
+                                             buckets=self.inpainter.bucket_sizes)
+        manager = self.inpainter.memory_manager
+        if manager is None:
+            return self._submit(image, mask, bucket)
+        # Every caller reserves its own share of the batch in its own thread, so an
+        # over-budget or waiting request never fails or stalls the other ones
+        with manager.admit(manager.estimate(bucket[0], bucket[1])):
+            return self._submit(image, mask, bucket)
+
+    def _submit(self, image: np.ndarray, mask: np.ndarray, bucket: tuple) -> np.ndarray:
+        """Queue a forward pass for the batching thread and wait for its result"""
+        item = _BatchItem(image, mask, bucket)
+        self._queue.put(item)
+        return item.future.result()
+
+    def _run(self):
+        """Batching loop: wait for a request, collect more for max_wait, dispatch"""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            buckets = defaultdict(list)
+            buckets[item.bucket].append(item)
+            stopping = False
+            deadline = time.monotonic() + self.max_wait
+
+            # Dispatch early once any bucket has a full batch
+            while len(buckets[item.bucket]) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                buckets[item.bucket].append(item)
+
+            # Smallest buckets first, so low resolution previews aren't stuck behind full passes
+            for bucket, items in sorted(buckets.items(), key=lambda entry: entry[0][0] * entry[0][1]):
+                for i in range(0, len(items), self.max_batch_size):
+                    self._dispatch(bucket, items[i:i + self.max_batch_size])
+
+            if stopping:
+                return
+
+    def _dispatch(self, bucket: tuple, items: list):
+        """Run one batched forward pass and scatter the results"""
+        logger.info(f"Dispatching batch of {len(items)} for bucket {bucket[0]}x{bucket[1]}")
+        try:
+            results = self.inpainter._forward_batch(
+                [item.image for item in items],
+                [item.mask for item in items],
+                bucket,
+                admit=False
+            )
+        except Exception as e:
+            for item in items:
+                item.future.set_exception(e)
+            return
+
+        for item, result in zip(items, results):
+            item.future.set_result(result)
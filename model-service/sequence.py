@@ -0,0 +1,343 @@
+"""
+Frame sequence inpainting, e.g. removing a watermark from extracted video frames
+
+Frames usually share one static mask. The mask is prepared once for every
+run of frames that share it: binarized, cropped to its region of interest,
+downscaled and padded into the model's mask input. Frames are inpainted in
+batches of `--batch-size`. A frame whose masked neighborhood (the region of
+interest the model sees) matches the last inferred frame, within
+`--threshold`, reuses that frame's inpainted pixels without a forward pass.
+
+Decoding and encoding run on a pool of worker threads (or processes) while
+the main thread keeps the model busy, like batch.py. Outputs that already
+exist are skipped.
+
+Usage:
+    python main.py sequence --frames frames/ --mask logo.png --output results/
+    python main.py sequence --frames frames/ --masks masks/ --output results/ --threshold 4
+"""
+
+import argparse
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+from PIL import Image
+
+from batch import (IMAGE_EXTENSIONS, add_pipeline_arguments, decode_pair, encode_and_write,
+                   load_inpainter)
+from formats import OUTPUT_FORMATS
+from inpainter import Inpainter
+from stages import stage
+
+
+class PreparedMask:
+    """A mask preprocessed once for all the frames that share it"""
+
+    def __init__(self, inpainter: Inpainter, mask: np.ndarray, batch_size: int):
+        self.mask = np.where(mask > 128, np.uint8(255), np.uint8(0))
+        h, w = self.mask.shape
+        bbox = inpainter._mask_bbox(self.mask, inpainter.roi_margin)
+        self.empty = bbox is None
+        if self.empty:
+            return
+        if not inpainter.use_roi:
+            bbox = (0, h, 0, w)
+
+        # Region of interest the model sees, same as Inpainter.inpaint
+        top, bottom, left, right = bbox
+        self.region = (slice(top, bottom), slice(left, right))
+        self.crop_size = (right - left, bottom - top)
+        self.crop_mask = self.mask[self.region]
+
+        self.small_size = inpainter._inference_size(bottom - top, right - left)
+        self.model_mask = self.crop_mask if self.small_size is None \
+            else inpainter._downscale_mask(self.crop_mask, self.small_size)
+        mask_h, mask_w = self.model_mask.shape
+        self.padded_size = inpainter._padded_size(mask_h, mask_w, inpainter.pad_mod,
+                                                  inpainter.pad_to_square, inpainter.min_size,
+                                                  inpainter.bucket_sizes)
+        self.mask_input = inpainter.prepare_mask_input(self.model_mask, self.padded_size,
+                                                       batch_size)
+
+
+class SequenceInpainter:
+    """Inpaints ordered frames in batches, reusing prepared masks and unchanged results"""
+
+    def __init__(self, inpainter: Inpainter, batch_size: int = 4, threshold: float = 0):
+        """
+        Args:
+            inpainter: Model used for the frames, its tiling option is ignored
+            batch_size: Frames per forward pass
+            threshold: Largest per-pixel difference from the last inferred frame's masked
+                       neighborhood for a frame to reuse its result (0 reuses exact matches)
+        """
+        self.inpainter = inpainter
+        self.batch_size = batch_size
+        self.threshold = threshold
+
+        self.frames = 0
+        self.inferred = 0
+        self.reused = 0
+        self.infer_time = 0.0
+
+        self._mask_source: Optional[np.ndarray] = None
+        self._prepared: Optional[PreparedMask] = None
+        # Neighborhood and inpainted crop of the last inferred frame
+        self._reference: Optional[np.ndarray] = None
+        self._reference_result: Optional[np.ndarray] = None
+
+    def inpaint(self, frames: Iterable) -> Iterator[np.ndarray]:
+        """
+        Inpaint frames in order
+        Args:
+            frames: (frame, mask) pairs of RGB uint8 frames (H, W, 3) and uint8 masks (H, W)
+                    with 255 for inpaint areas. Consecutive frames passing the same mask
+                    array, or equal masks, share the prepared mask.
+        Yields:
+            Inpainted frames in input order
+        """
+        pending = []
+        to_infer = 0
+        for frame, mask in frames:
+            if frame.shape[:2] != mask.shape:
+                raise ValueError(f"Mask size {mask.shape[::-1]} does not match "
+                                 f"frame size {frame.shape[1::-1]}")
+            self.frames += 1
+
+            if not self._same_mask(mask):
+                yield from self._flush(pending)
+                pending, to_infer = [], 0
+                self._use_mask(mask)
+
+            if self._prepared.empty:
+                pending.append((frame, None, False))
+            else:
+                crop = frame[self._prepared.region]
+                infer = not self._unchanged(crop)
+                if infer:
+                    self._reference = crop
+                    to_infer += 1
+                pending.append((frame, crop, infer))
+
+            # Reused frames wait for their reference, but no longer than two batches
+            if to_infer == self.batch_size or len(pending) >= 2 * self.batch_size:
+                yield from self._flush(pending)
+                pending, to_infer = [], 0
+
+        yield from self._flush(pending)
+
+    def _same_mask(self, mask: np.ndarray) -> bool:
+        """Whether mask matches the mask the current preparation was made from"""
+        if self._mask_source is None:
+            return False
+        return mask is self._mask_source or np.array_equal(mask, self._mask_source)
+
+    def _use_mask(self, mask: np.ndarray):
+        """Prepare a new mask, results of other masks are never reused"""
+        with stage("mask"):
+            self._prepared = PreparedMask(self.inpainter, mask, self.batch_size)
+        self._mask_source = mask
+        self._reference = None
+        self._reference_result = None
+
+    def _unchanged(self, crop: np.ndarray) -> bool:
+        """Whether a frame's neighborhood matches the last inferred frame's"""
+        if self._reference is None:
+            return False
+        if self.threshold <= 0:
+            return np.array_equal(crop, self._reference)
+        diff = np.abs(crop.astype(np.int16) - self._reference)
+        return diff.max() <= self.threshold
+
+    def _flush(self, pending: list) -> Iterator[np.ndarray]:
+        """Infer the pending frames that need it and yield all of them in order"""
+        crops = [crop for _, crop, infer in pending if infer]
+        results = iter(self._infer(crops) if crops else [])
+        prepared = self._prepared
+
+        for frame, crop, infer in pending:
+            if crop is None:
+                yield frame
+                continue
+
+            if infer:
+                self._reference_result = next(results)
+                patch = self._reference_result
+            else:
+                # Masked pixels from the reference, the rest from this frame
+                self.reused += 1
+                patch = self.inpainter._fast_unmasked_restore(
+                    self._reference_result.copy(), crop, prepared.crop_mask)
+
+            output = frame.copy()
+            output[prepared.region] = patch
+            yield output
+
+    def _infer(self, crops: list) -> list:
+        """Inpaint region of interest crops in one batch, like Inpainter._scaled_forward"""
+        inpainter = self.inpainter
+        prepared = self._prepared
+        start_time = time.perf_counter()
+
+        inputs = crops
+        if prepared.small_size is not None:
+            with stage("resize"):
+                inputs = [inpainter._resize(crop, prepared.small_size, Image.BICUBIC)
+                          for crop in crops]
+
+        outputs = inpainter._forward_batch(inputs, [prepared.model_mask] * len(inputs),
+                                           prepared.padded_size, prepared.mask_input)
+
+        results = []
+        for crop, small, output in zip(crops, inputs, outputs):
+            result = inpainter._fast_unmasked_restore(output, small, prepared.model_mask)
+            if prepared.small_size is not None:
+                with stage("resize"):
+                    result = inpainter._resize(result, prepared.crop_size, Image.BICUBIC)
+                result = inpainter._fast_unmasked_restore(result, crop, prepared.crop_mask)
+            results.append(result)
+
+        self.inferred += len(crops)
+        self.infer_time += time.perf_counter() - start_time
+        return results
+
+
+def decode_frame(path: Path) -> np.ndarray:
+    """Load an RGB frame"""
+    with Image.open(path) as image:
+        return np.asarray(image.convert("RGB"))
+
+
+def decode_mask(path: Path) -> np.ndarray:
+    """Load a grayscale mask"""
+    with Image.open(path) as image:
+        return np.asarray(image.convert("L"))
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """Sequence options, shared by `python main.py sequence` and `python sequence.py`"""
+    parser.add_argument("--frames", required=True, help="Directory of frames, in file name order")
+    masks = parser.add_mutually_exclusive_group(required=True)
+    masks.add_argument("--mask", help="Mask shared by every frame")
+    masks.add_argument("--masks", help="Directory of per-frame masks named like the frames")
+    add_pipeline_arguments(parser)
+    parser.add_argument("--batch-size", type=int, default=4, help="Frames per forward pass")
+    parser.add_argument("--threshold", type=float, default=0,
+                        help="Largest per-pixel difference in the masked neighborhood for a "
+                             "frame to reuse the last inferred result (0: exact matches only)")
+    parser.set_defaults(func=run)
+
+
+def run(args) -> int:
+    """Inpaint every frame, returns the process exit code"""
+    frames = sorted(path for path in Path(args.frames).iterdir()
+                    if path.suffix.lower() in IMAGE_EXTENSIONS)
+    masks = {}
+    if args.masks:
+        masks = {path.stem: path for path in sorted(Path(args.masks).iterdir())
+                 if path.suffix.lower() in IMAGE_EXTENSIONS}
+
+    extension = OUTPUT_FORMATS[args.format][2]
+    output_dir = Path(args.output)
+    jobs = []
+    failed = []
+    skipped = 0
+    for frame_path in frames:
+        output_path = output_dir / f"{frame_path.stem}{extension}"
+        if output_path.exists() and not args.overwrite:
+            skipped += 1
+        elif args.masks and frame_path.stem not in masks:
+            failed.append((output_path, "no mask"))
+        else:
+            jobs.append((frame_path, masks.get(frame_path.stem), output_path))
+    print(f"{len(frames)} frames, {skipped} already done, {len(jobs)} to inpaint")
+    if not jobs:
+        return 1 if failed else 0
+
+    static_mask = decode_mask(Path(args.mask)) if args.mask else None
+    sequence = SequenceInpainter(load_inpainter(args), args.batch_size, args.threshold)
+
+    prefetch = args.prefetch or 2 * max(args.workers, args.batch_size)
+    executor_class = ProcessPoolExecutor if args.processes else ThreadPoolExecutor
+    done = written = pixels = 0
+    start_time = time.perf_counter()
+
+    with executor_class(max_workers=args.workers) as pool:
+        # Output paths of the frames handed to the sequence, its results come back in order
+        outputs = deque()
+
+        def decoded_frames():
+            nonlocal pixels
+            decoding = deque()
+            next_job = 0
+            for _, _, output_path in jobs:
+                # Keep the decode queue full so the model never waits on I/O
+                while next_job < len(jobs) and len(decoding) < prefetch:
+                    frame_path, mask_path, _ = jobs[next_job]
+                    decoding.append(pool.submit(decode_frame, frame_path) if mask_path is None
+                                    else pool.submit(decode_pair, frame_path, mask_path))
+                    next_job += 1
+
+                try:
+                    decoded = decoding.popleft().result()
+                except Exception as e:
+                    failed.append((output_path, f"decode failed: {e}"))
+                    continue
+                frame, mask = (decoded, static_mask) if static_mask is not None else decoded
+                if frame.shape[:2] != mask.shape:
+                    failed.append((output_path, f"mask size {mask.shape[::-1]} does not match "
+                                                f"frame size {frame.shape[1::-1]}"))
+                    continue
+
+                outputs.append(output_path)
+                pixels += frame.shape[0] * frame.shape[1]
+                yield frame, mask
+
+        def collect(future, output_path):
+            nonlocal written
+            try:
+                future.result()
+                written += 1
+            except Exception as e:
+                failed.append((output_path, f"write failed: {e}"))
+
+        writing = deque()
+        for result in sequence.inpaint(decoded_frames()):
+            output_path = outputs.popleft()
+            writing.append((pool.submit(encode_and_write, result, output_path,
+                                        args.format, args.quality), output_path))
+            # Bound the results held in memory while they wait for a writer
+            while len(writing) > prefetch:
+                collect(*writing.popleft())
+
+            done += 1
+            if done % 100 == 0:
+                elapsed = time.perf_counter() - start_time
+                print(f"{done}/{len(jobs)} done, {done / elapsed:.2f} frames/s")
+
+        while writing:
+            collect(*writing.popleft())
+
+    elapsed = time.perf_counter() - start_time
+    print(f"Inpainted {written} frames in {elapsed:.1f}s: {written / elapsed:.2f} frames/s, "
+          f"{pixels / elapsed / 1e6:.2f} MP/s")
+    print(f"{sequence.inferred} frames inferred, {sequence.reused} reused unchanged results, "
+          f"model busy {sequence.infer_time / elapsed:.0%} of the time")
+    for output_path, reason in failed:
+        print(f"FAILED {output_path}: {reason}")
+    return 1 if failed else 0
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Inpaint an ordered sequence of frames")
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -7,28 +7,51 @@ using the existing Inpainter model from the parent directory.
 """
 
 import argparse
+import asyncio
 import base64
+import functools
+import hmac
 import io
+import json
 import os
-import shutil
 import sys
+import threading
+import time
 import traceback
 from pathlib import Path
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Annotated, Callable, Literal, Optional, Union
 
+import masks
+import metrics
 import numpy as np
+import prefork
 import psutil
 import torch
 import uvicorn
-from fastapi import FastAPI, HTTPException, Response
+from backends import BACKENDS
+from cache import ResultCache
+from fastapi import FastAPI, File, Form, Header, HTTPException, Response, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from huggingface_hub import hf_hub_download
+from formats import OUTPUT_FORMATS, delta_patch, encode_image
 from inpainter import Inpainter
+from jobs import FINISHED, Job, JobStore
 from loguru import logger
-from PIL import Image
-from pydantic import BaseModel
+from memory import AdmissionTimeout, MemoryBudgetExceeded, MemoryManager
+from models import (DEFAULT_MODELS, ModelBudgetExceeded, ModelLoadTimeout, ModelRegistry,
+                    ModelSpec, UnknownModel, download_spec, parse_model_specs)
+from PIL import Image, ImageOps
+from profiling import RequestProfiler
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+from scheduler import BatchScheduler
+from sessions import SessionStore
+from stages import stage
+from starlette.routing import Match
+from workers import PRIORITY_DEFAULT, PRIORITY_PREVIEW, InferencePool, QueueFullError
 
 logger.remove()
 
@@ -37,58 +60,220 @@ current_dir = Path(__file__).parent
 sys.path.append(str(current_dir))
 
 
-def download_model_if_missing():
-    """Download the LaMa model from Hugging Face if it doesn't exist locally"""
-    checkpoint_path = "./checkpoints/big-lama.pt"
+def env_flag(name: str, default: bool = False) -> bool:
+    """Read a boolean environment variable"""
+    return os.getenv(name, "1" if default else "0").lower() in ("1", "true", "yes")
 
-    # Convert relative path to absolute path
-    if not os.path.isabs(checkpoint_path):
-        # Remove leading "./" if present
-        clean_path = checkpoint_path.lstrip("./")
-        checkpoint_path = os.path.join(current_dir, clean_path)
 
-    checkpoint_file = Path(checkpoint_path)
+def parse_bucket_sizes(value: str) -> list:
+    """Parse "WIDTHxHEIGHT,..." into a list of (height, width) tuples"""
+    sizes = []
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        width, height = item.lower().split("x")
+        sizes.append((int(height), int(width)))
+    return sizes
+
+
+def inpainter_options_from_env() -> dict:
+    """Inpainter constructor options from KUPU_* environment variables"""
+    # KUPU_MAX_IMAGE_SIZE caps the inference resolution, 0 disables the cap
+    max_image_size = int(os.getenv("KUPU_MAX_IMAGE_SIZE", "1080"))
+    return {
+        "max_image_size": max_image_size or None,
+        "precision": os.getenv("KUPU_PRECISION", "fp32"),
+        "channels_last": env_flag("KUPU_CHANNELS_LAST"),
+        "optimize": env_flag("KUPU_OPTIMIZE"),
+        "num_threads": int(os.getenv("KUPU_THREADS", "0")) or None,
+        "interop_threads": int(os.getenv("KUPU_INTEROP_THREADS", "0")) or None,
+        "backend": os.getenv("KUPU_BACKEND", "torchscript"),
+        "onnx_path": os.getenv("KUPU_ONNX_PATH") or None,
+        "bucket_sizes": parse_bucket_sizes(os.getenv("KUPU_BUCKETS", "")),
+    }
+
+
+# The model is loaded during application startup, not at import time, so the
+# server binds its port immediately and reports readiness separately
+global_inpainter: Optional[Inpainter] = None
+model_ready = threading.Event()
+model_load_error: Optional[str] = None
+
+# Weights loaded by the multi-process master before forking, shared by its workers
+preloaded_inpainter: Optional[Inpainter] = None
+
+# Forward passes of every model share one memory budget
+memory_manager: Optional[MemoryManager] = None
 
-    # Check if model file exists and is a valid file (not a directory)
-    if checkpoint_file.exists() and checkpoint_file.is_file() and checkpoint_file.stat().st_size > 0:
-        logger.info(f"✅ Model found at: {checkpoint_path}")
-        return
 
-    # Create checkpoints directory if it doesn't exist
-    checkpoint_file.parent.mkdir(parents=True, exist_ok=True)
+def preload_model():
+    """Load the weights once in the multi-process master, workers share them copy-on-write"""
+    global preloaded_inpainter
 
-    logger.info(f"📥 Model not found. Downloading from Hugging Face...")
-    logger.info(f"📁 Saving to: {checkpoint_path}")
+    options = inpainter_options_from_env()
+    if options["backend"] != "torchscript":
+        raise RuntimeError("Multi-process serving requires the torchscript backend")
+    logger.info("🔄 Preloading model weights before forking workers...")
+    spec = model_registry.specs[model_registry.default]
+    download_spec(spec)
+    # CUDA contexts don't survive fork(), worker processes serve on CPU
+    preloaded_inpainter = Inpainter(device="cpu", checkpoint_path=spec.checkpoint_path, **options)
 
-    # Download model using huggingface_hub
-    downloaded_path = hf_hub_download(
-        repo_id="ardiantovn/big-lama",
-        filename="big-lama.pt",
-        cache_dir=None,  # Use default cache
-        local_dir=None   # Download to cache first
+
+def build_inpainter(spec: ModelSpec) -> Inpainter:
+    """Download, load, verify and warm up a registry model"""
+    global global_inpainter, memory_manager
+
+    is_default = spec.name == model_registry.default
+    if is_default and preloaded_inpainter is not None:
+        inpainter = preloaded_inpainter
+    else:
+        download_spec(spec)
+        options = inpainter_options_from_env()
+        if not is_default:
+            # KUPU_ONNX_PATH names the default model's export, the others sit next to their checkpoint
+            options["onnx_path"] = None
+        inpainter = Inpainter(checkpoint_path=spec.checkpoint_path, **options)
+    if env_flag("KUPU_VERIFY_MODE"):
+        check = inpainter.verify_execution_mode()
+        if not check["passed"]:
+            raise RuntimeError(f"Execution mode failed the fp32 accuracy check: {check}")
+
+    if memory_manager is None:
+        memory_manager = MemoryManager(
+            inpainter.device,
+            budget_bytes=int(os.getenv("KUPU_MEMORY_BUDGET_MB", "0")) * 1024 * 1024 or None,
+            bytes_per_pixel=int(os.getenv("KUPU_MEMORY_BYTES_PER_PIXEL", "2048")),
+            high_watermark=float(os.getenv("KUPU_MEMORY_HIGH_WATERMARK", "0.85")),
+            admit_timeout=float(os.getenv("KUPU_MEMORY_ADMIT_TIMEOUT", "30"))
+        )
+    inpainter.memory_manager = memory_manager
+    memory_manager.track_buffers(inpainter.buffers)
+    configure_batching(
+        inpainter,
+        int(os.getenv("KUPU_BATCH_SIZE", "1")),
+        float(os.getenv("KUPU_BATCH_WAIT_MS", "10"))
     )
+    if is_default:
+        # The default model backs /health and /memory, it counts as loaded while warming up
+        global_inpainter = inpainter
 
-    # Copy from cache to our target location
+    # Warmup passes for every shape bucket keep first requests off cold shapes, at the
+    # full batch size too when batching is on
+    if env_flag("KUPU_WARMUP", default=True):
+        batch_size = inpainter.scheduler.max_batch_size if inpainter.scheduler is not None else 1
+        timings = inpainter.warmup(batch_size=batch_size)
+        logger.info(f"🔥 Warmup of '{spec.name}' completed: {timings}")
+    return inpainter
 
-    shutil.copy2(downloaded_path, checkpoint_path)
 
-    logger.info(f"✅ Model downloaded successfully to: {checkpoint_path}")
+def load_model():
+    """Load the default model through the registry, then mark the server ready"""
+    global model_load_error
 
+    try:
+        logger.info("🔄 Initializing global inpainter...")
+        with model_registry.use() as inpainter:
+            model_ready.set()
+            logger.info(f"🎨 Global inpainter ready on device: {inpainter.device}")
+    except Exception as e:
+        logger.error(f"❌ Failed to initialize global inpainter: {e}")
+        logger.error(traceback.format_exc())
+        model_load_error = str(e)
+
+
+# Named checkpoints served side by side, loaded on first use and kept in an LRU
+# cache under KUPU_MODEL_MEMORY_MB. The default model is loaded at startup.
+model_registry = ModelRegistry(
+    parse_model_specs(os.getenv("KUPU_MODELS") or DEFAULT_MODELS),
+    loader=build_inpainter,
+    default=os.getenv("KUPU_DEFAULT_MODEL") or None,
+    budget_bytes=int(os.getenv("KUPU_MODEL_MEMORY_MB", "0")) * 1024 * 1024 or None,
+    idle_ttl=float(os.getenv("KUPU_MODEL_IDLE_TTL", "0")),
+    load_timeout=float(os.getenv("KUPU_MODEL_LOAD_TIMEOUT", "60"))
+)
 
-# Initialize global inpainter immediately at module level
-logger.info("🔄 Initializing global inpainter at module level...")
-try:
-    download_model_if_missing()
-    global_inpainter = Inpainter()
-    # logger.info(f"🎨 Global inpainter initialized with device: {global_inpainter.device}")
-except Exception as e:
-    logger.error(f"❌ Failed to initialize global inpainter: {e}")
-    global_inpainter = None
+# Progressive responses stream a quick pass capped at KUPU_PREVIEW_SIZE before the final
+# result, optionally with a lighter registry model
+preview_size = int(os.getenv("KUPU_PREVIEW_SIZE", "256"))
+preview_model = os.getenv("KUPU_PREVIEW_MODEL") or None
+if preview_model is not None and preview_model not in model_registry:
+    raise ValueError(f"KUPU_PREVIEW_MODEL '{preview_model}' is not configured: "
+                     f"{list(model_registry.specs)}")
+
+# Inference runs on a bounded worker pool so the event loop stays responsive
+inference_pool = InferencePool(
+    workers=int(os.getenv("KUPU_INFERENCE_WORKERS", "1")),
+    max_queue=int(os.getenv("KUPU_INFERENCE_QUEUE", "8")),
+    retry_after=int(os.getenv("KUPU_RETRY_AFTER", "1"))
+)
+
+# Content-addressed result cache, KUPU_CACHE_MB=0 disables it
+cache_mb = int(os.getenv("KUPU_CACHE_MB", "256"))
+result_cache = ResultCache(
+    max_bytes=cache_mb * 1024 * 1024,
+    disk_dir=os.getenv("KUPU_CACHE_DIR") or None,
+    max_disk_bytes=int(os.getenv("KUPU_CACHE_DISK_MB", "1024")) * 1024 * 1024
+) if cache_mb > 0 else None
+
+# Upload-once image sessions for iterative edits
+session_store = SessionStore(
+    max_sessions=int(os.getenv("KUPU_MAX_SESSIONS", "32")),
+    ttl_seconds=float(os.getenv("KUPU_SESSION_TTL", "900")),
+    max_bytes=int(os.getenv("KUPU_SESSION_MB", "1024")) * 1024 * 1024
+)
+
+# Result encoding runs on its own threads, off the event loop and the inference workers
+encode_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("KUPU_ENCODE_WORKERS", "2")),
+    thread_name_prefix="encode"
+)
+
+# Background inpaint jobs, results are kept for KUPU_JOB_TTL seconds after finishing
+job_store = JobStore(
+    max_jobs=int(os.getenv("KUPU_MAX_JOBS", "64")),
+    ttl_seconds=float(os.getenv("KUPU_JOB_TTL", "600")),
+    max_bytes=int(os.getenv("KUPU_JOB_MB", "256")) * 1024 * 1024
+)
+# Created on first use so it binds to the serving event loop
+job_slots: Optional[asyncio.Semaphore] = None
+
+# Admin token gating /admin endpoints and per-request profiling, unset disables both
+admin_token = os.getenv("KUPU_ADMIN_TOKEN") or None
+request_profiler = RequestProfiler(os.getenv("KUPU_PROFILE_DIR") or str(current_dir / "profiles"))
+
+# Queue depth, readiness and device memory are read when /metrics is scraped
+metrics.register_service(inference_pool, lambda: global_inpainter, model_ready.is_set)
+
+
+def configure_batching(inpainter: Inpainter, max_batch_size: int, max_wait_ms: float):
+    """Attach a micro-batching scheduler to an inpainter (batch size 1 disables it)"""
+    if inpainter.scheduler is not None:
+        inpainter.scheduler.stop()
+        inpainter.scheduler = None
+    if max_batch_size > 1:
+        scheduler = BatchScheduler(inpainter, max_batch_size, max_wait_ms)
+        scheduler.start()
+        inpainter.scheduler = scheduler
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Load the model on startup, in the background unless KUPU_BACKGROUND_LOAD=0"""
+    if env_flag("KUPU_BACKGROUND_LOAD", default=True):
+        threading.Thread(target=load_model, name="model-loader", daemon=True).start()
+    else:
+        await asyncio.to_thread(load_model)
+
+    yield
+
+    model_registry.unload_all()
+    inference_pool.shutdown()
+    encode_executor.shutdown(wait=False)
 
 
 app = FastAPI(
     title="Kupu Server",
     description="AI inpainter",
+    lifespan=lifespan,
 )
 
 # Security headers middleware
@@ -104,6 +289,30 @@ async def add_security_headers(request, call_next):
     response.headers["Permissions-Policy"] = "geolocation=(), microphone=(), camera=()"
     return response
 
+
+def route_label(request) -> str:
+    """Route template of a request, so metrics don't get a label per session id"""
+    for route in app.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return getattr(route, "path", None) or "/"
+    return "unmatched"
+
+
+@app.middleware("http")
+async def record_request_metrics(request, call_next):
+    start_time = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = route_label(request)
+        metrics.REQUESTS.labels(route, request.method, str(status)).inc()
+        metrics.REQUEST_SECONDS.labels(route, request.method).observe(
+            time.perf_counter() - start_time)
+
 # Configure CORS for production security
 app.add_middleware(
     CORSMiddleware,
@@ -112,9 +321,10 @@ app.add_middleware(
         "http://localhost:5173"
     ],
     allow_credentials=False,  # Changed to False for security
-    allow_methods=["GET", "POST", "OPTIONS"],
+    allow_methods=["GET", "POST", "DELETE", "OPTIONS"],
     allow_headers=["Content-Type", "Accept"],  # Restricted headers
-    expose_headers=["Cache-Control", "Pragma", "Expires"],
+    expose_headers=["Cache-Control", "Pragma", "Expires", "Retry-After",
+                    "X-Kupu-Image-Size", "X-Kupu-Patch-Offset"],
 )
 
 # Trusted host middleware for security
@@ -129,34 +339,138 @@ app.add_middleware(
 # Pydantic models for API contracts
 
 
-class InpaintRequest(BaseModel):
-    image: str  # base64 encoded resized image data for processing
-    # base64 encoded original image data for overlay
-    original_image: Optional[str] = None
-    mask: str   # base64 encoded mask data
-    original_width: Optional[int] = None  # original image width for upscaling
-    # original image height for upscaling
-    original_height: Optional[int] = None
+class Stroke(BaseModel):
+    points: list[tuple[float, float]]  # x, y in image pixels
+    radius: float = Field(0, ge=0)
+    fill: bool = False  # close and fill the polyline
+
+
+class StrokeMask(BaseModel):
+    type: Literal["strokes"]
+    strokes: list[Stroke]
+
+
+class RLEMask(BaseModel):
+    type: Literal["rle"]
+    size: tuple[int, int]  # height, width
+    counts: list[int]      # row-major runs, alternating unmasked and masked
+
+
+CompactMask = Annotated[Union[RLEMask, StrokeMask], Field(discriminator="type")]
+compact_mask_adapter = TypeAdapter(CompactMask)
 
 
 class SimplifiedInpaintRequest(BaseModel):
     image: str  # base64 encoded image data
-    mask: str   # base64 encoded mask data
+    mask: Union[str, CompactMask]  # base64 encoded mask data, or an RLE or stroke mask
+    format: str = "jpeg"  # jpeg, png or webp
+    quality: int = 95     # JPEG/WebP quality
+    delta: bool = False   # return only the changed patch and its offset
+    model: Optional[str] = None  # registry model name (default: KUPU_DEFAULT_MODEL)
+
+
+class DeltaResponse(BaseModel):
+    patch: Optional[str]  # base64 data URL, None if the mask was empty
+    x: int
+    y: int
+    width: int   # full image size
+    height: int
 
 
 class HealthResponse(BaseModel):
     status: str
     model_loaded: bool
+    ready: bool
     version: str = "1.0.0"
 
 
+class SessionResponse(BaseModel):
+    session_id: str
+    width: int
+    height: int
+    expires_in: float
+
+
+class CacheResponse(BaseModel):
+    enabled: bool
+    hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    memory_entries: int = 0
+    memory_bytes: int = 0
+    max_memory_bytes: int = 0
+    disk_bytes: Optional[int] = None
+    max_disk_bytes: Optional[int] = None
+
+
+class JobResponse(BaseModel):
+    job_id: str
+    status: str
+    created: float
+    timings: dict[str, float]
+    error: Optional[str] = None
+    status_code: Optional[int] = None
+    status_url: str
+    events_url: str
+    result_url: str
+
+
+class ModelInfo(BaseModel):
+    name: str
+    source: str
+    default: bool
+    resident: bool
+    loading: bool
+    in_use: int
+    memory_mb: float
+    idle_seconds: Optional[float] = None
+    loads: int
+    load_seconds: float
+
+
+class ModelsResponse(BaseModel):
+    default: str
+    budget_mb: float
+    resident_mb: float
+    resident: list[str]
+    evictions: int
+    models: list[ModelInfo]
+
+
+class ProfileCapture(BaseModel):
+    id: str
+    seconds: float
+    trace: str
+    summary: str
+
+
+class ProfilerResponse(BaseModel):
+    armed: int
+    output_dir: str
+    captures: list[ProfileCapture]
+
+
+class MemoryPolicyResponse(BaseModel):
+    budget_mb: float
+    reserved_mb: float
+    buffer_mb: float
+    active_jobs: int
+    bytes_per_pixel: int
+    high_watermark: float
+    pressure: float
+    admitted: int
+    rejected: int
+    cleanups: int
+
+
 class MemoryResponse(BaseModel):
     system_memory_mb: float
     system_memory_percent: float
     device_type: str
     mps_memory_mb: Optional[float] = None
     cuda_memory_mb: Optional[float] = None
-    config_max_image_size: int
+    config_max_image_size: Optional[int] = None
+    memory_policy: Optional[MemoryPolicyResponse] = None
 
 
 @app.get("/", include_in_schema=False)
@@ -166,21 +480,83 @@ async def root():
         "message": "Kupu Server",
         "api_docs": "/docs",
         "health_check": "/health",
-        "memory_check": "/memory"
+        "liveness_check": "/livez",
+        "readiness_check": "/readyz",
+        "memory_check": "/memory",
+        "cache_check": "/cache",
+        "metrics": "/metrics",
+        "models": "/models",
+        "jobs": "/jobs"
     }
 
 
+def model_status() -> str:
+    """Model lifecycle state: loading, warming_up, healthy or failed"""
+    if model_load_error is not None:
+        return "failed"
+    if model_ready.is_set():
+        return "healthy"
+    return "warming_up" if global_inpainter is not None else "loading"
+
+
 @app.get("/health", response_model=HealthResponse)
-async def health_check():
+async def health_check(response: Response):
     """Health check endpoint to verify server and model status"""
     model_loaded = global_inpainter is not None
+    ready = model_ready.is_set()
+
+    # Not ready until warmup finishes, so traffic never reaches a cold worker
+    if not ready:
+        response.status_code = 503
 
     return HealthResponse(
-        status="healthy",
-        model_loaded=model_loaded
+        status=model_status(),
+        model_loaded=model_loaded,
+        ready=ready
     )
 
 
+@app.get("/livez")
+async def liveness(response: Response):
+    """Liveness probe: fails only when model loading failed and the process should restart"""
+    status = model_status()
+    if status == "failed":
+        response.status_code = 503
+        return {"status": status, "error": model_load_error}
+    return {"status": status}
+
+
+@app.get("/readyz")
+async def readiness(response: Response):
+    """Readiness probe: succeeds once the model is loaded and warmed up"""
+    status = model_status()
+    if status != "healthy":
+        response.status_code = 503
+    return {"status": status}
+
+
+@app.get("/cache", response_model=CacheResponse)
+async def cache_status():
+    """Result cache hit/miss counters and usage"""
+    if result_cache is None:
+        return CacheResponse(enabled=False)
+    return CacheResponse(enabled=True, **result_cache.stats())
+
+
+@app.get("/models", response_model=ModelsResponse)
+async def models_status():
+    """Configured models, which of them are resident and the model memory budget"""
+    model_registry.expire_idle()
+    return ModelsResponse(**model_registry.stats())
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """Prometheus metrics"""
+    content, content_type = metrics.render()
+    return Response(content=content, media_type=content_type)
+
+
 @app.get("/memory", response_model=MemoryResponse)
 async def memory_status():
     """Memory status endpoint for debugging memory issues"""
@@ -191,11 +567,16 @@ async def memory_status():
     system_memory_percent = memory.percent
 
     device_type = "none"
+    max_image_size = None
+    memory_policy = None
     cuda_memory_mb = None
     mps_memory_mb = None
 
     if global_inpainter:
         device_type = global_inpainter.device
+        max_image_size = global_inpainter.max_image_size
+        if global_inpainter.memory_manager is not None:
+            memory_policy = global_inpainter.memory_manager.stats()
 
         # GPU memory if available
         if global_inpainter.device == "cuda" and torch.cuda.is_available():
@@ -210,28 +591,458 @@ async def memory_status():
         "system_memory_mb": system_memory_mb,
         "system_memory_percent": system_memory_percent,
         "device_type": device_type,
-        "config_max_image_size": 1080,
+        "config_max_image_size": max_image_size,
         "cuda_memory_mb": cuda_memory_mb,
-        "mps_memory_mb": mps_memory_mb
+        "mps_memory_mb": mps_memory_mb,
+        "memory_policy": memory_policy
     }
 
     return MemoryResponse(**response_data)
 
 
+def is_admin(token: Optional[str]) -> bool:
+    """Whether token matches KUPU_ADMIN_TOKEN"""
+    return admin_token is not None and token is not None and hmac.compare_digest(token, admin_token)
+
+
+def require_admin(token: Optional[str]):
+    """Reject admin requests, with 404 while no admin token is configured"""
+    if admin_token is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not is_admin(token):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+def profiler_status() -> ProfilerResponse:
+    """Current profiler state"""
+    return ProfilerResponse(
+        armed=request_profiler.armed,
+        output_dir=request_profiler.output_dir,
+        captures=list(request_profiler.captures)
+    )
+
+
+@app.get("/admin/profile", response_model=ProfilerResponse)
+async def get_profiler(x_admin_token: Optional[str] = Header(None)):
+    """Armed job count and recent profiler captures"""
+    require_admin(x_admin_token)
+    return profiler_status()
+
+
+@app.post("/admin/profile", response_model=ProfilerResponse)
+async def arm_profiler(count: int = 1, x_admin_token: Optional[str] = Header(None)):
+    """Profile the next count inference jobs (0 disarms)"""
+    require_admin(x_admin_token)
+    request_profiler.arm(count)
+    return profiler_status()
+
+
+def run_inpaint(inpainter: Inpainter, image_np: np.ndarray, mask_np: np.ndarray,
+                capture_id: Optional[str] = None, max_size: Optional[int] = None) -> np.ndarray:
+    """Blocking inference job, executed on an inference pool worker"""
+    if capture_id is None:
+        return inpainter.inpaint(image_np, mask_np, max_size=max_size)
+    with request_profiler.capture(capture_id):
+        return inpainter.inpaint(image_np, mask_np, max_size=max_size)
+
+
+# Results are never cached by browsers or proxies
+NO_CACHE_HEADERS = {
+    "Cache-Control": "no-store, no-cache, must-revalidate, private",
+    "Pragma": "no-cache",
+    "Expires": "0"
+}
+
+
+def decode_image(data: bytes, mode: str, name: str) -> np.ndarray:
+    """Decode encoded image bytes into a numpy array in the given PIL mode"""
+    try:
+        logger.info(f"Loading {name} from bytes")
+        with stage("image_decode"):
+            # Upright as browsers display it, the frame client-side masks are drawn in
+            image = ImageOps.exif_transpose(Image.open(io.BytesIO(data))).convert(mode)
+        logger.info(f"{name.capitalize()} loaded - size: {image.size}")
+    except Exception as e:
+        logger.error(f"Image load error: {e}")
+        raise HTTPException(
+            status_code=400, detail=f"Image load error: {e}")
+
+    return np.array(image)
+
+
+def load_mask(mask: Union[bytes, RLEMask, StrokeMask], height: int, width: int) -> np.ndarray:
+    """Decode an encoded mask, or rasterize a compact one at the image size"""
+    if isinstance(mask, bytes):
+        return decode_image(mask, 'L', 'mask')
+    try:
+        with stage("mask_rasterize"):
+            mask_np = masks.rasterize(mask.model_dump(), height, width)
+    except ValueError as e:
+        logger.error(f"Mask rasterize error: {e}")
+        raise HTTPException(status_code=400, detail=f"Mask error: {e}")
+    logger.info(f"Rasterized {mask.type} mask - shape: {mask_np.shape}")
+    return mask_np
+
+
+async def read_mask(mask: Optional[UploadFile],
+                    mask_data: Optional[str]) -> Union[bytes, RLEMask, StrokeMask]:
+    """Encoded mask upload or JSON compact mask form field, exactly one of them"""
+    if (mask is None) == (mask_data is None):
+        raise HTTPException(
+            status_code=400, detail="Send either a mask file or mask_data")
+    if mask is not None:
+        return await mask.read()
+    try:
+        return compact_mask_adapter.validate_json(mask_data)
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid mask_data: {e}")
+
+
+def load_images(image_bytes: bytes, mask: Union[bytes, RLEMask, StrokeMask]) -> tuple:
+    """Decode encoded image bytes and the mask into RGB and grayscale numpy arrays"""
+    image_np = decode_image(image_bytes, 'RGB', 'image')
+    mask_np = load_mask(mask, *image_np.shape[:2])
+    if mask_np.shape != image_np.shape[:2]:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Mask size {mask_np.shape[::-1]} does not match image size {image_np.shape[1::-1]}")
+    logger.info(
+        f"NumPy arrays created - image shape: {image_np.shape}, mask shape: {mask_np.shape}")
+    return image_np, mask_np
+
+
+def validate_model(model: Optional[str]):
+    """Reject model names missing from the registry with 400"""
+    if model is not None and model not in model_registry:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown model '{model}'. Must be one of: {list(model_registry.specs)}")
+
+
+async def acquire_model(name: str) -> Inpainter:
+    """Pin a registry model for a request, loading it off the event loop if needed"""
+    def release_if_acquired(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is None:
+            model_registry.release(name)
+
+    acquire = asyncio.ensure_future(asyncio.to_thread(model_registry.acquire, name))
+    try:
+        return await asyncio.shield(acquire)
+    except asyncio.CancelledError:
+        # The load carries on in its thread, unpin the model once it is done
+        acquire.add_done_callback(release_if_acquired)
+        raise
+    except UnknownModel as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ModelLoadTimeout as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(inference_pool.retry_after)}
+        )
+    except ModelBudgetExceeded as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error(f"Failed to load model '{name}': {e}")
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=503, detail=f"Model '{name}' failed to load: {e}")
+
+
+async def run_inference(image_np: np.ndarray, mask_np: np.ndarray,
+                        profile: bool = False, model: Optional[str] = None,
+                        preview: bool = False,
+                        before_dispatch: Optional[Callable] = None,
+                        on_dispatch: Optional[Callable] = None) -> np.ndarray:
+    """
+    Run an inpaint job on the inference pool, mapping overload to 503
+    Args:
+        profile: Profile this job with torch.profiler, bypassing the result cache
+        model: Registry model to inpaint with (default: the default model)
+        preview: Quick pass capped at KUPU_PREVIEW_SIZE, started ahead of queued
+                 full passes and never cached
+        before_dispatch: Coroutine function awaited on a result cache miss, before
+                         the job is dispatched
+        on_dispatch: Called as the job is handed to the inference pool
+    """
+    # Check if global inpainter is available
+    if global_inpainter is None:
+        logger.error("Global inpainter not available")
+        raise HTTPException(
+            status_code=503,
+            detail="Inpainting model not available.",
+            headers={"Retry-After": str(inference_pool.retry_after)}
+        )
+
+    model = model or model_registry.default
+    validate_model(model)
+    metrics.IMAGE_PIXELS.observe(image_np.shape[0] * image_np.shape[1])
+
+    cache_key = None
+    if result_cache is not None and not profile and not preview:
+        cache_key = await asyncio.to_thread(ResultCache.make_key, image_np, mask_np, model=model)
+        result = await asyncio.to_thread(result_cache.get, cache_key)
+        metrics.CACHE_LOOKUPS.labels("miss" if result is None else "hit").inc()
+        if result is not None:
+            logger.info("Result cache hit, skipping inference")
+            return result
+
+    if before_dispatch is not None:
+        await before_dispatch()
+
+    capture_id = None
+    if not preview and (profile or request_profiler.take()):
+        capture_id = request_profiler.new_capture_id()
+        logger.info(f"Profiling inpaint job as {capture_id}")
+
+    inpainter = await acquire_model(model)
+    logger.info(f"Dispatching {'preview' if preview else 'inpaint'} job to inference pool "
+                f"with model '{model}'")
+    try:
+        if on_dispatch is not None:
+            on_dispatch()
+        # Use simplified inpainting method
+        result = await inference_pool.run(
+            run_inpaint, inpainter, image_np, mask_np, capture_id,
+            preview_size if preview else None,
+            priority=PRIORITY_PREVIEW if preview else PRIORITY_DEFAULT,
+            # Unpinned once the worker thread is done with the model, which
+            # outlives this coroutine when the request is cancelled
+            on_done=functools.partial(model_registry.release, model))
+        logger.info(
+            f"Simplified inpainting completed - result shape: {result.shape}")
+        if cache_key is not None:
+            try:
+                await asyncio.to_thread(result_cache.put, cache_key, result)
+            except Exception as e:
+                # The result is still good, only caching it failed
+                logger.warning(f"Failed to cache result: {e}")
+        return result
+    except QueueFullError as e:
+        raise HTTPException(
+            status_code=503,
+            detail="Inference queue is full, retry later.",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except MemoryBudgetExceeded as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except AdmissionTimeout as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(inference_pool.retry_after)}
+        )
+    except Exception as e:
+        logger.error(f"Error during simplified inpainting: {e}")
+        raise
+
+
+def validate_output(fmt: str, quality: int):
+    """Reject unknown output formats and out of range qualities with 400"""
+    if fmt not in OUTPUT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid format '{fmt}'. Must be one of: {list(OUTPUT_FORMATS)}")
+    if not 1 <= quality <= 100:
+        raise HTTPException(status_code=400, detail="Quality must be between 1 and 100")
+
+
+def encode_output(result: np.ndarray, mask_np: np.ndarray, fmt: str = "jpeg",
+                  quality: int = 95, delta: bool = False) -> tuple:
+    """
+    Encode an inpainting result, executed on the encode pool
+    Args:
+        mask_np: Mask the result was inpainted with
+        delta: Encode only the bounding box of the pixels the mask let the model change
+    Returns:
+        (encoded bytes or None if a delta is empty, response headers). Delta responses
+        carry the full image size and the patch offset as `width,height` and `x,y`.
+    """
+    headers = {}
+    if delta:
+        headers["X-Kupu-Image-Size"] = f"{result.shape[1]},{result.shape[0]}"
+        patch = delta_patch(result, mask_np)
+        if patch is None:
+            return None, headers
+        result, (x, y) = patch
+        headers["X-Kupu-Patch-Offset"] = f"{x},{y}"
+
+    with stage("encode"):
+        return encode_image(result, fmt, quality), headers
+
+
+async def encode_in_pool(result: np.ndarray, mask_np: np.ndarray, fmt: str = "jpeg",
+                         quality: int = 95, delta: bool = False) -> tuple:
+    """encode_output on the encode pool"""
+    return await asyncio.get_running_loop().run_in_executor(
+        encode_executor, encode_output, result, mask_np, fmt, quality, delta)
+
+
+def image_response(data: Optional[bytes], headers: dict, media_type: str) -> Response:
+    """Encoded image response, 204 for an empty delta"""
+    if data is None:
+        return Response(status_code=204, headers={**NO_CACHE_HEADERS, **headers})
+    return Response(content=data, media_type=media_type, headers={**NO_CACHE_HEADERS, **headers})
+
+
+def delta_body(data: Optional[bytes], headers: dict, media_type: str,
+               result: np.ndarray) -> DeltaResponse:
+    """JSON delta response of encode_output bytes, a full image has offset 0,0"""
+    data_url = None
+    if data is not None:
+        with stage("base64_encode"):
+            data_url = f"data:{media_type};base64,{base64.b64encode(data).decode()}"
+        logger.info(f"Result converted to base64 - size: {len(data_url)} characters")
+    x, y = headers.get("X-Kupu-Patch-Offset", "0,0").split(",")
+    return DeltaResponse(patch=data_url, x=int(x), y=int(y),
+                         width=result.shape[1], height=result.shape[0])
+
+
+def preview_worthwhile(mask_np: np.ndarray) -> bool:
+    """Whether the final pass runs above the preview resolution, otherwise a preview saves nothing"""
+    masked = mask_np > 128
+    rows = np.flatnonzero(masked.any(axis=1))
+    if rows.size == 0:
+        return False
+    cols = np.flatnonzero(masked.any(axis=0))
+    h, w = mask_np.shape
+    if global_inpainter is None or not global_inpainter.use_roi:
+        return max(h, w) > preview_size
+    margin = 2 * global_inpainter.roi_margin
+    return max(min(rows[-1] - rows[0] + 1 + margin, h),
+               min(cols[-1] - cols[0] + 1 + margin, w)) > preview_size
+
+
+async def run_preview(image_np: np.ndarray, mask_np: np.ndarray, model: Optional[str],
+                      on_dispatch: Optional[Callable] = None) -> Optional[np.ndarray]:
+    """Preview pass of a progressive response, None if it failed"""
+    try:
+        return await run_inference(image_np, mask_np, model=preview_model or model,
+                                   preview=True, on_dispatch=on_dispatch)
+    except HTTPException as e:
+        logger.warning(f"Preview failed with {e.status_code}: {e.detail}")
+    except Exception as e:
+        logger.warning(f"Preview failed: {e}")
+    return None
+
+
+def sse_event(event: str, data: str) -> str:
+    """One server-sent event"""
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+def progressive_response(image_np: np.ndarray, mask_np: np.ndarray, profile: bool,
+                         model: Optional[str], fmt: str, quality: int, delta: bool,
+                         on_final: Optional[Callable] = None) -> StreamingResponse:
+    """
+    Server-sent events stream of a quick preview followed by the final result
+
+    On a result cache miss, a pass capped at KUPU_PREVIEW_SIZE is dispatched
+    alongside the final pass, with preview priority so it gets the next free
+    worker first, and is sent as a `preview` event, the DeltaResponse of its
+    changed patch. It is skipped when the mask region already fits the preview
+    resolution, and dropped if the final pass finishes first. The final result
+    follows as a `final` event, a DeltaResponse with offset 0,0 unless delta is
+    set. Failures of the final pass are sent as an `error` event with the status
+    code the non-progressive request would have returned.
+    Args:
+        on_final: Called with the final result before it is encoded
+    """
+    media_type = OUTPUT_FORMATS[fmt][1]
+
+    async def events():
+        queue = asyncio.Queue()
+        preview_pass = None
+
+        async def run_preview_pass(on_dispatch: Callable):
+            preview = await run_preview(image_np, mask_np, model, on_dispatch)
+            if preview is None:
+                return
+            data, headers = await encode_in_pool(preview, mask_np, fmt, quality, True)
+            await queue.put(sse_event("preview", delta_body(
+                data, headers, media_type, preview).model_dump_json()))
+
+        async def start_preview_pass():
+            nonlocal preview_pass
+            if not preview_worthwhile(mask_np):
+                return
+            dispatched = asyncio.Event()
+            preview_pass = asyncio.create_task(run_preview_pass(dispatched.set))
+            # The final job is dispatched as soon as the preview reached the pool, not
+            # when it is done, so an idle worker still starts the preview first
+            dispatch_wait = asyncio.ensure_future(dispatched.wait())
+            try:
+                await asyncio.wait([preview_pass, dispatch_wait],
+                                   return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                dispatch_wait.cancel()
+
+        async def produce():
+            try:
+                result = await run_inference(image_np, mask_np, profile, model,
+                                             before_dispatch=start_preview_pass)
+                if on_final is not None:
+                    on_final(result)
+                data, headers = await encode_in_pool(result, mask_np, fmt, quality, delta)
+                if preview_pass is not None and not preview_pass.done():
+                    # The final pass overtook the preview, which has nothing left to show
+                    preview_pass.cancel()
+                await queue.put(sse_event("final", delta_body(
+                    data, headers, media_type, result).model_dump_json()))
+            except HTTPException as e:
+                await queue.put(sse_event("error", json.dumps(
+                    {"status_code": e.status_code, "detail": e.detail})))
+            except Exception as e:
+                log_critical_error("progressive inpaint", e)
+                await queue.put(sse_event("error", json.dumps(
+                    {"status_code": 500, "detail": f"Progressive inpainting failed: {str(e)}"})))
+            finally:
+                if preview_pass is not None:
+                    preview_pass.cancel()
+                await queue.put(None)
+
+        producer = asyncio.create_task(produce())
+        try:
+            while (event := await queue.get()) is not None:
+                yield event
+        finally:
+            # The client went away
+            producer.cancel()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={**NO_CACHE_HEADERS, "X-Accel-Buffering": "no"}
+    )
+
+
+def log_critical_error(endpoint: str, e: Exception):
+    """Log an unexpected endpoint failure with its traceback"""
+    logger.error(f"=== CRITICAL ERROR in {endpoint} endpoint ===")
+    logger.error(f"Error type: {type(e).__name__}")
+    logger.error(f"Error message: {str(e)}")
+    logger.error("Full traceback:")
+    logger.error(traceback.format_exc())
+
+
 @app.post("/inpaint")
-async def inpaint(request: SimplifiedInpaintRequest):
+async def inpaint(request: SimplifiedInpaintRequest,
+                  x_kupu_profile: Optional[str] = Header(None)):
     """
     Simplified inpaint endpoint that only performs core AI inference
 
     Args:
         request: SimplifiedInpaintRequest containing base64 encoded image and mask
+        x_kupu_profile: Admin token, profiles this request with torch.profiler
 
     Returns:
-        Base64 encoded result image
+        Base64 encoded result image, or a DeltaResponse with only the changed patch
     """
     logger.info("=== Starting simplified inpaint request ===")
 
     try:
+        validate_output(request.format, request.quality)
+        validate_model(request.model)
+
         # Extract and validate image data
         logger.info("Validating input data formats")
         if not request.image.startswith('data:image/'):
@@ -239,7 +1050,7 @@ async def inpaint(request: SimplifiedInpaintRequest):
             raise HTTPException(
                 status_code=400, detail="Invalid image data format")
 
-        if not request.mask or not request.mask.startswith('data:image/'):
+        if isinstance(request.mask, str) and not request.mask.startswith('data:image/'):
             logger.error("Invalid mask data format")
             raise HTTPException(
                 status_code=400, detail="Invalid mask data format")
@@ -247,79 +1058,39 @@ async def inpaint(request: SimplifiedInpaintRequest):
         # Convert base64 to PIL Images
         logger.info("Converting base64 to image data")
         image_b64 = request.image.split(',')[1]
-        mask_b64 = request.mask.split(',')[1]
+        mask = request.mask
 
         try:
             logger.info("Decoding base64 data")
-            image_bytes = base64.b64decode(image_b64)
-            mask_bytes = base64.b64decode(mask_b64)
+            with stage("base64_decode"):
+                image_bytes = base64.b64decode(image_b64)
+                if isinstance(mask, str):
+                    mask = base64.b64decode(mask.split(',')[1])
             logger.info("Base64 decode successful")
         except Exception as e:
             logger.error(f"Base64 decode error: {e}")
             raise HTTPException(
                 status_code=400, detail=f"Base64 decode error: {e}")
 
-        # Load images
-        try:
-            logger.info("Loading images from bytes")
-            image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-            mask = Image.open(io.BytesIO(mask_bytes)).convert('L')
-            logger.info(
-                f"Images loaded - image size: {image.size}, mask size: {mask.size}")
-        except Exception as e:
-            logger.error(f"Image load error: {e}")
-            raise HTTPException(
-                status_code=400, detail=f"Image load error: {e}")
-
-        # Convert to numpy arrays
-        logger.info("Converting to numpy arrays")
-        image_np = np.array(image)
-        mask_np = np.array(mask)
-        logger.info(
-            f"NumPy arrays created - image shape: {image_np.shape}, mask shape: {mask_np.shape}")
-
-        # Check if global inpainter is available
-        if global_inpainter is None:
-            logger.error("Global inpainter not available")
-            raise HTTPException(
-                status_code=503,
-                detail="Inpainting model not available."
-            )
-
-        logger.info("Calling global inpainter.inpaint method")
-        try:
-            # Use simplified inpainting method
-            result = global_inpainter.inpaint(image_np, mask_np)
-            logger.info(
-                f"Simplified inpainting completed - result shape: {result.shape}")
-        except Exception as e:
-            logger.error(f"Error during simplified inpainting: {e}")
-            raise
-        finally:
-            # Explicit memory cleanup after inference
-            logger.info("Clearing memory cache")
-            if global_inpainter:
-                global_inpainter.clear_memory_cache()
+        image_np, mask_np = load_images(image_bytes, mask)
+        result = await run_inference(image_np, mask_np, is_admin(x_kupu_profile), request.model)
 
         # Convert result back to base64
         logger.info("Converting result to base64")
-        result_image = Image.fromarray(result.astype(np.uint8))
-        buffer = io.BytesIO()
-        result_image.save(buffer, format='JPEG', quality=95)
-        result_b64 = base64.b64encode(buffer.getvalue()).decode()
-        logger.info(
-            f"Result converted to base64 - size: {len(result_b64)} characters")
+        data, headers = await encode_in_pool(
+            result, mask_np, request.format, request.quality, request.delta)
+        body = delta_body(data, headers, OUTPUT_FORMATS[request.format][1], result)
 
-        # Return the result as base64 data URL with security headers
         logger.info("=== Simplified inpaint request completed successfully ===")
+        if request.delta:
+            return Response(content=body.model_dump_json(), media_type="application/json",
+                            headers=NO_CACHE_HEADERS)
+
+        # Return the result as base64 data URL with security headers
         response = Response(
-            content=f'"data:image/jpeg;base64,{result_b64}"',
+            content=f'"{body.patch}"',
             media_type="application/json",
-            headers={
-                "Cache-Control": "no-store, no-cache, must-revalidate, private",
-                "Pragma": "no-cache",
-                "Expires": "0"
-            }
+            headers=NO_CACHE_HEADERS
         )
         return response
 
@@ -327,16 +1098,321 @@ async def inpaint(request: SimplifiedInpaintRequest):
         logger.warning("HTTPException raised - re-raising")
         raise
     except Exception as e:
-        logger.error(f"=== CRITICAL ERROR in simplified inpaint endpoint ===")
-        logger.error(f"Error type: {type(e).__name__}")
-        logger.error(f"Error message: {str(e)}")
-        logger.error("Full traceback:")
-        logger.error(traceback.format_exc())
-
+        log_critical_error("simplified inpaint", e)
         raise HTTPException(
             status_code=500, detail=f"Simplified inpainting failed: {str(e)}")
 
 
+@app.post("/inpaint/raw")
+async def inpaint_raw(image: UploadFile = File(...), mask: Optional[UploadFile] = File(None),
+                      mask_data: Optional[str] = Form(None),
+                      format: str = Form("jpeg"), quality: int = Form(95),
+                      delta: bool = Form(False), model: Optional[str] = Form(None),
+                      progressive: bool = Form(False),
+                      x_kupu_profile: Optional[str] = Header(None)):
+    """
+    Binary inpaint endpoint taking multipart/form-data uploads
+
+    Args:
+        image: Encoded image file (PNG, JPEG, WebP, ...)
+        mask: Encoded mask file with white for inpaint areas
+        mask_data: RLE or stroke mask as JSON, instead of a mask file
+        format: Output format, jpeg, png or webp
+        quality: JPEG/WebP quality
+        delta: Return only the changed patch, offset in X-Kupu-Patch-Offset
+        model: Registry model to inpaint with (default: KUPU_DEFAULT_MODEL)
+        progressive: Stream a low resolution preview, then the result, as server-sent events
+        x_kupu_profile: Admin token, profiles this request with torch.profiler
+
+    Returns:
+        Encoded result image bytes, 204 for an empty delta, or the progressive event stream
+    """
+    logger.info("=== Starting raw inpaint request ===")
+
+    try:
+        validate_output(format, quality)
+        validate_model(model)
+        mask_input = await read_mask(mask, mask_data)
+        image_np, mask_np = load_images(await image.read(), mask_input)
+        if progressive:
+            return progressive_response(image_np, mask_np, is_admin(x_kupu_profile), model,
+                                        format, quality, delta)
+        result = await run_inference(image_np, mask_np, is_admin(x_kupu_profile), model)
+        data, headers = await encode_in_pool(result, mask_np, format, quality, delta)
+
+        logger.info("=== Raw inpaint request completed successfully ===")
+        return image_response(data, headers, OUTPUT_FORMATS[format][1])
+
+    except HTTPException:
+        logger.warning("HTTPException raised - re-raising")
+        raise
+    except Exception as e:
+        log_critical_error("raw inpaint", e)
+        raise HTTPException(
+            status_code=500, detail=f"Raw inpainting failed: {str(e)}")
+
+
+@app.post("/sessions", response_model=SessionResponse)
+async def create_session(image: UploadFile = File(...)):
+    """
+    Upload an image once for a series of mask-only inpaint calls
+
+    Args:
+        image: Encoded image file (PNG, JPEG, WebP, ...)
+
+    Returns:
+        Session id and image dimensions
+    """
+    image_np = decode_image(await image.read(), 'RGB', 'image')
+    session = session_store.create(image_np)
+
+    return SessionResponse(
+        session_id=session.session_id,
+        width=image_np.shape[1],
+        height=image_np.shape[0],
+        expires_in=session_store.ttl_seconds
+    )
+
+
+@app.post("/sessions/{session_id}/inpaint")
+async def inpaint_session(session_id: str,
+                          mask: Optional[UploadFile] = File(None),
+                          mask_data: Optional[str] = Form(None),
+                          chain: bool = Form(False),
+                          format: str = Form("jpeg"), quality: int = Form(95),
+                          delta: bool = Form(False), model: Optional[str] = Form(None),
+                          progressive: bool = Form(False),
+                          x_kupu_profile: Optional[str] = Header(None)):
+    """
+    Inpaint a session image with a new mask
+
+    Args:
+        session_id: Id returned by POST /sessions
+        mask: Encoded mask file with white for inpaint areas
+        mask_data: RLE or stroke mask as JSON, instead of a mask file
+        chain: Apply the mask to the previous result instead of the original image
+        format: Output format, jpeg, png or webp
+        quality: JPEG/WebP quality
+        delta: Return only the patch changed relative to the image the mask was
+               applied to, offset in X-Kupu-Patch-Offset
+        model: Registry model to inpaint with (default: KUPU_DEFAULT_MODEL)
+        progressive: Stream a low resolution preview, then the result, as server-sent events
+        x_kupu_profile: Admin token, profiles this request with torch.profiler
+
+    Returns:
+        Encoded result image bytes, 204 for an empty delta, or the progressive event stream
+    """
+    logger.info(f"=== Starting session inpaint request for {session_id} ===")
+
+    try:
+        validate_output(format, quality)
+        validate_model(model)
+        session = session_store.get(session_id)
+        if session is None:
+            raise HTTPException(
+                status_code=404, detail="Session not found or expired")
+
+        source = session.result if chain and session.result is not None else session.image
+        mask_np = load_mask(await read_mask(mask, mask_data), *source.shape[:2])
+        if mask_np.shape != source.shape[:2]:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Mask size {mask_np.shape[::-1]} does not match image size {source.shape[1::-1]}")
+
+        if progressive:
+            return progressive_response(
+                source, mask_np, is_admin(x_kupu_profile), model, format, quality, delta,
+                on_final=lambda result: session_store.set_result(session_id, result))
+        result = await run_inference(source, mask_np, is_admin(x_kupu_profile), model)
+        session_store.set_result(session_id, result)
+        data, headers = await encode_in_pool(result, mask_np, format, quality, delta)
+
+        logger.info("=== Session inpaint request completed successfully ===")
+        return image_response(data, headers, OUTPUT_FORMATS[format][1])
+
+    except HTTPException:
+        logger.warning("HTTPException raised - re-raising")
+        raise
+    except Exception as e:
+        log_critical_error("session inpaint", e)
+        raise HTTPException(
+            status_code=500, detail=f"Session inpainting failed: {str(e)}")
+
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    """Release a session and its stored images"""
+    if not session_store.delete(session_id):
+        raise HTTPException(
+            status_code=404, detail="Session not found or expired")
+    return {"deleted": session_id}
+
+
+def job_response(job: Job) -> JobResponse:
+    """Job status with the URLs for polling, progress events and the result"""
+    return JobResponse(
+        **job.snapshot(),
+        status_url=f"/jobs/{job.job_id}",
+        events_url=f"/jobs/{job.job_id}/events",
+        result_url=f"/jobs/{job.job_id}/result"
+    )
+
+
+def get_job(job_id: str) -> Job:
+    """Look up a job, 404 if unknown or expired"""
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job
+
+
+async def run_job(job: Job, image_bytes: bytes, mask: Union[bytes, RLEMask, StrokeMask],
+                  profile: bool,
+                  fmt: str, quality: int, delta: bool, model: Optional[str] = None):
+    """Decode, inpaint and encode in the background, recording progress on the job"""
+    global job_slots
+    if job_slots is None:
+        job_slots = asyncio.Semaphore(inference_pool.workers)
+
+    try:
+        # Wait for a free inference worker instead of overflowing the pool queue
+        async with job_slots:
+            job_store.set_stage(job, "decoding")
+            image_np, mask_np = await asyncio.to_thread(load_images, image_bytes, mask)
+
+            job_store.set_stage(job, "inferring")
+            result = await run_inference(image_np, mask_np, profile, model)
+
+        job_store.set_stage(job, "encoding")
+        data, headers = await encode_in_pool(result, mask_np, fmt, quality, delta)
+        job_store.finish(job, data, OUTPUT_FORMATS[fmt][1], headers)
+
+    except asyncio.CancelledError:
+        # Wake up progress listeners of a deleted job
+        job_store.fail(job, 410, "Job was cancelled")
+        raise
+    except HTTPException as e:
+        job_store.fail(job, e.status_code, str(e.detail))
+    except Exception as e:
+        log_critical_error("job", e)
+        job_store.fail(job, 500, f"Job inpainting failed: {str(e)}")
+
+
+@app.post("/jobs", response_model=JobResponse, status_code=202)
+async def create_job(image: UploadFile = File(...), mask: Optional[UploadFile] = File(None),
+                     mask_data: Optional[str] = Form(None),
+                     format: str = Form("jpeg"), quality: int = Form(95),
+                     delta: bool = Form(False), model: Optional[str] = Form(None),
+                     x_kupu_profile: Optional[str] = Header(None)):
+    """
+    Submit an inpaint job and return immediately
+
+    Args:
+        image: Encoded image file (PNG, JPEG, WebP, ...)
+        mask: Encoded mask file with white for inpaint areas
+        mask_data: RLE or stroke mask as JSON, instead of a mask file
+        format: Output format, jpeg, png or webp
+        quality: JPEG/WebP quality
+        delta: Keep only the changed patch as the result
+        model: Registry model to inpaint with (default: KUPU_DEFAULT_MODEL)
+        x_kupu_profile: Admin token, profiles this job with torch.profiler
+
+    Returns:
+        Job id and the URLs for its status, progress events and result
+    """
+    validate_output(format, quality)
+    validate_model(model)
+    if global_inpainter is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Inpainting model not available.",
+            headers={"Retry-After": str(inference_pool.retry_after)}
+        )
+    if job_store.active() >= job_store.max_jobs:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many jobs in progress, retry later.",
+            headers={"Retry-After": str(inference_pool.retry_after)}
+        )
+
+    mask_input = await read_mask(mask, mask_data)
+    image_bytes = await image.read()
+    job = job_store.create()
+    # The task reference keeps the job from being garbage collected mid-run
+    job.task = asyncio.create_task(
+        run_job(job, image_bytes, mask_input, is_admin(x_kupu_profile), format, quality, delta,
+                model))
+    return job_response(job)
+
+
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+async def job_status(job_id: str):
+    """Current stage, stage timings and error of a job"""
+    return job_response(get_job(job_id))
+
+
+@app.get("/jobs/{job_id}/result")
+async def job_result(job_id: str):
+    """
+    Encoded result image of a finished job
+
+    Returns 409 while the job is running, and the job's error status if it failed.
+    Delta jobs carry the same headers as delta /inpaint/raw responses.
+    """
+    job = get_job(job_id)
+    if job.status == "failed":
+        raise HTTPException(status_code=job.status_code, detail=job.error)
+    if job.status != "done":
+        raise HTTPException(
+            status_code=409,
+            detail=f"Job is {job.status}",
+            headers={"Retry-After": str(inference_pool.retry_after)}
+        )
+    return image_response(job.result, job.headers, job.media_type)
+
+
+# Comment lines sent while a job is quiet keep proxies from closing the stream
+JOB_KEEPALIVE_SECONDS = 15
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """
+    Server-sent events stream of a job's progress
+
+    Sends a `status` event with the job status on every stage change and ends
+    once the job is done or failed.
+    """
+    job = get_job(job_id)
+
+    async def events():
+        while True:
+            # Changes made while the snapshot is being sent are picked up by the version
+            seen = job.version
+            snapshot = job.snapshot()
+            yield f"event: status\ndata: {json.dumps(snapshot)}\n\n"
+            if snapshot["status"] in FINISHED:
+                return
+            while not await job.wait_for_change(JOB_KEEPALIVE_SECONDS, seen):
+                yield ": keepalive\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={**NO_CACHE_HEADERS, "X-Accel-Buffering": "no"}
+    )
+
+
+@app.delete("/jobs/{job_id}")
+async def delete_job(job_id: str):
+    """Drop a job and its result, a running job is cancelled"""
+    job = get_job(job_id)
+    if job.task is not None and not job.task.done():
+        job.task.cancel()
+    job_store.delete(job_id)
+    return {"deleted": job_id}
+
+
 def setup_static_files():
     """Setup static file serving for production mode"""
     react_build_path = current_dir.parent / "web" / "dist"
@@ -355,18 +1431,14 @@ def setup_static_files():
         return False
 
 
-def run_server(host: str = None, port: int = None, production: bool = False):
+def run_server(host: str = None, port: int = None, production: bool = False,
+               processes: int = 1, threads: Optional[int] = None):
+    """Run the FastAPI server, in pre-forked worker processes when processes > 1"""
     if host is None:
         host = "0.0.0.0"
     if port is None:
         port = 8003
 
-    # Check if global inpainter is available
-    if global_inpainter is None:
-        logger.error("Global inpainter not available")
-        raise RuntimeError("Failed to initialize inpainter at module level")
-
-    """Run the FastAPI server"""
     logger.info(f"📡 Server will be available at: http://{host}:{port}")
 
     # Setup static files for production
@@ -376,6 +1448,11 @@ def run_server(host: str = None, port: int = None, production: bool = False):
     logger.info(f"📋 API docs available at: http://{host}:{port}/docs")
     logger.info(f"📊 Health check: http://{host}:{port}/health")
 
+    if processes > 1:
+        prefork.serve(app, host, port, processes, threads,
+                      preload=preload_model, on_worker_exit=metrics.mark_process_dead)
+        return
+
     uvicorn.run(
         app,
         host=host,
@@ -396,16 +1473,39 @@ if __name__ == "__main__":
                         help='Enable auto-reload for development')
     parser.add_argument('--production', action='store_true',
                         help='Run in production mode')
+    parser.add_argument('--backend', type=str, choices=BACKENDS,
+                        default=os.getenv("KUPU_BACKEND", "torchscript"),
+                        help='Inference backend (default: torchscript)')
+    parser.add_argument('--onnx-path', type=str, default=os.getenv("KUPU_ONNX_PATH"),
+                        help='ONNX model for the onnx backend (default: checkpoints/big-lama.onnx)')
+    parser.add_argument('--workers', type=int, default=inference_pool.workers,
+                        help='Number of inference worker threads (default: 1)')
+    parser.add_argument('--max-queue', type=int, default=inference_pool.max_queue,
+                        help='Jobs allowed to wait for a worker before returning 503 (default: 8)')
+    parser.add_argument('--batch-size', type=int, default=int(os.getenv("KUPU_BATCH_SIZE", "1")),
+                        help='Max requests per batched forward pass, needs as many workers (default: 1, off)')
+    parser.add_argument('--batch-wait-ms', type=float, default=float(os.getenv("KUPU_BATCH_WAIT_MS", "10")),
+                        help='Max time to wait for a batch to fill (default: 10)')
+    parser.add_argument('--processes', type=int, default=int(os.getenv("KUPU_PROCESSES", "1")),
+                        help='Worker processes sharing the model weights, CPU only (default: 1)')
+    parser.add_argument('--threads', type=int, default=int(os.getenv("KUPU_THREADS", "0")) or None,
+                        help='Torch threads per process, pinned to as many cores (default: cores / processes)')
 
     args = parser.parse_args()
 
-    if args.reload:
-        # Check if global inpainter is available for reload mode
-        if global_inpainter is None:
-            logger.error("Global inpainter not available for reload mode")
-            raise RuntimeError(
-                "Failed to initialize inpainter at module level")
+    # Export settings, the model is configured from them at startup
+    os.environ["KUPU_BACKEND"] = args.backend
+    if args.onnx_path:
+        os.environ["KUPU_ONNX_PATH"] = args.onnx_path
+    os.environ["KUPU_INFERENCE_WORKERS"] = str(args.workers)
+    os.environ["KUPU_INFERENCE_QUEUE"] = str(args.max_queue)
+    os.environ["KUPU_BATCH_SIZE"] = str(args.batch_size)
+    os.environ["KUPU_BATCH_WAIT_MS"] = str(args.batch_wait_ms)
+    if args.threads:
+        os.environ["KUPU_THREADS"] = str(args.threads)
+    inference_pool.configure(args.workers, args.max_queue)
 
+    if args.reload:
         # Development mode with auto-reload
         logger.info(f"🌐 Server will bind to: {args.host}:{args.port}")
         uvicorn.run(
@@ -416,4 +1516,4 @@ if __name__ == "__main__":
             reload_dirs=[str(current_dir)]
         )
     else:
-        run_server(args.host, args.port, args.production)
+        run_server(args.host, args.port, args.production, args.processes, args.threads)
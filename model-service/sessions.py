@@ -0,0 +1,104 @@
+"""
+Upload-once image sessions for iterative edits
+
+A session keeps the decoded image (and the latest result, so edits can chain)
+on the server, so later inpaint calls only need to send a new mask.
+"""
+
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+from loguru import logger
+
+
+class ImageSession:
+    """Decoded image plus the most recent inpainting result"""
+
+    def __init__(self, session_id: str, image: np.ndarray):
+        self.session_id = session_id
+        self.image = image
+        self.result: Optional[np.ndarray] = None
+        self.last_access = time.monotonic()
+
+    @property
+    def nbytes(self) -> int:
+        return self.image.nbytes + (self.result.nbytes if self.result is not None else 0)
+
+
+class SessionStore:
+    """Session store bounded by idle TTL, session count and total bytes (LRU eviction)"""
+
+    def __init__(self, max_sessions: int = 32, ttl_seconds: float = 900,
+                 max_bytes: int = 1024 * 1024 * 1024):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+
+    def create(self, image: np.ndarray) -> ImageSession:
+        """Store a decoded image and return its new session"""
+        image.setflags(write=False)
+        session = ImageSession(secrets.token_urlsafe(16), image)
+        with self._lock:
+            self._sessions[session.session_id] = session
+            self._evict()
+        logger.info(f"Created session {session.session_id} for image {image.shape}")
+        return session
+
+    def get(self, session_id: str) -> Optional[ImageSession]:
+        """Return a live session and refresh its TTL, or None if unknown or expired"""
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            session.last_access = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def set_result(self, session_id: str, result: np.ndarray):
+        """Remember the latest result of a session for chained edits"""
+        result.setflags(write=False)
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return
+            session.result = result
+            self._evict()
+
+    def delete(self, session_id: str) -> bool:
+        """Drop a session, returning whether it existed"""
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._expire()
+            return len(self._sessions)
+
+    def _expire(self):
+        """Drop sessions idle for longer than the TTL (lock held)"""
+        deadline = time.monotonic() - self.ttl_seconds
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.last_access > deadline:
+                break
+            del self._sessions[session_id]
+            logger.info(f"Session {session_id} expired")
+
+    def _evict(self):
+        """Drop least recently used sessions beyond the count and byte limits (lock held)"""
+        self._expire()
+        total_bytes = sum(session.nbytes for session in self._sessions.values())
+        # Never evict the most recently used session
+        while len(self._sessions) > 1 and (
+                len(self._sessions) > self.max_sessions or total_bytes > self.max_bytes):
+            session_id, session = self._sessions.popitem(last=False)
+            total_bytes -= session.nbytes
+            logger.info(f"Session {session_id} evicted")
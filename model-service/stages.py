@@ -0,0 +1,52 @@
+"""
+Per-stage timing of the inpainting pipeline
+
+Pipeline code wraps each stage in `with stage("name"):`. Durations are added
+to the dict of the enclosing `collect()` block on the same thread, if any, and
+passed to every registered observer. Without a collector or observers a stage
+costs two perf_counter() calls.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+_local = threading.local()
+_observers = []
+
+
+def add_observer(observer: Callable[[str, float], None]):
+    """Call observer(stage_name, seconds) after every stage on any thread"""
+    _observers.append(observer)
+
+
+def remove_observer(observer: Callable[[str, float], None]):
+    """Stop calling a registered observer"""
+    _observers.remove(observer)
+
+
+@contextmanager
+def collect():
+    """Collect the total seconds per stage run on this thread inside the block"""
+    previous = getattr(_local, "timings", None)
+    timings = _local.timings = {}
+    try:
+        yield timings
+    finally:
+        _local.timings = previous
+
+
+@contextmanager
+def stage(name: str):
+    """Time one pipeline stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        timings = getattr(_local, "timings", None)
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+        for observer in _observers:
+            observer(name, elapsed)
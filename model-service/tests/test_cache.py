@@ -0,0 +1,111 @@
+"""ResultCache memory LRU and disk tier eviction"""
+
+import os
+
+import numpy as np
+
+from cache import ResultCache
+
+
+def result(value: int, nbytes: int = 1000) -> np.ndarray:
+    return np.full(nbytes, value, dtype=np.uint8)
+
+
+def test_make_key_binarizes_the_mask():
+    image = np.zeros((4, 4, 3), dtype=np.uint8)
+    mask = np.zeros((4, 4), dtype=np.uint8)
+    mask[1, 1] = 200
+    same = mask.copy()
+    same[1, 1] = 255
+
+    assert ResultCache.make_key(image, mask) == ResultCache.make_key(image, same)
+    assert ResultCache.make_key(image, mask) != ResultCache.make_key(image, mask, model="other")
+
+
+def test_memory_lru_evicts_least_recently_used():
+    cache = ResultCache(max_bytes=3000)
+    for key in "abc":
+        cache.put(key, result(ord(key)))
+
+    # Refresh a, so b is the least recently used
+    assert cache.get("a") is not None
+    cache.put("d", result(4))
+
+    assert cache.get("b") is None
+    assert all(cache.get(key) is not None for key in "acd")
+    assert cache.stats()["memory_bytes"] == 3000
+
+
+def test_memory_skips_results_over_the_budget():
+    cache = ResultCache(max_bytes=500)
+    cache.put("a", result(1))
+
+    assert cache.get("a") is None
+    assert cache.stats()["memory_entries"] == 0
+
+
+def test_results_are_read_only_copies():
+    cache = ResultCache()
+    original = result(1)
+    cache.put("a", original)
+    original[:] = 2
+
+    cached = cache.get("a")
+    assert (cached == 1).all()
+    assert not cached.flags.writeable
+
+
+def test_hit_and_miss_counters():
+    cache = ResultCache()
+    cache.put("a", result(1))
+    cache.get("a")
+    cache.get("b")
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+
+def test_disk_tier_serves_memory_misses(tmp_path):
+    cache = ResultCache(max_bytes=0, disk_dir=tmp_path)
+    cache.put("a", result(7))
+
+    cached = cache.get("a")
+    np.testing.assert_array_equal(cached, result(7))
+    assert cache.stats()["disk_hits"] == 1
+    # A new cache on the same directory picks up the stored results
+    assert ResultCache(max_bytes=0, disk_dir=tmp_path).get("a") is not None
+
+
+def test_disk_tier_evicts_least_recently_used_files(tmp_path):
+    cache = ResultCache(max_bytes=0, disk_dir=tmp_path, max_disk_bytes=4000)
+    for age, key in enumerate("abc"):
+        cache.put(key, result(age))
+        path = tmp_path / f"{key}.npy"
+        os.utime(path, (1000 + age, 1000 + age))
+
+    # Writing d pushes the tier over budget, a has the oldest mtime
+    cache.put("d", result(3))
+
+    assert sorted(path.stem for path in tmp_path.glob("*.npy")) == ["b", "c", "d"]
+    assert cache.get("a") is None
+    assert cache.stats()["disk_bytes"] <= 4000
+
+
+def test_disk_eviction_skips_files_removed_by_other_workers(tmp_path, monkeypatch):
+    cache = ResultCache(max_bytes=0, disk_dir=tmp_path, max_disk_bytes=4000)
+    for key in "abc":
+        cache.put(key, result(1))
+
+    # Another worker evicts a between the directory scan and the stat
+    scan = type(tmp_path).glob
+
+    def glob_then_remove(self, pattern):
+        paths = list(scan(self, pattern))
+        (tmp_path / "a.npy").unlink(missing_ok=True)
+        return paths
+
+    monkeypatch.setattr(type(tmp_path), "glob", glob_then_remove)
+    cache.put("d", result(1))
+
+    assert (tmp_path / "d.npy").exists()
+    assert cache.stats()["disk_bytes"] <= 4000
@@ -0,0 +1,129 @@
+"""RLE round trips and stroke rasterization against per-pixel references"""
+
+import numpy as np
+import pytest
+
+import masks
+
+
+def segment_distance(px: np.ndarray, py: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Distance of every point to the segment a-b"""
+    d = b - a
+    length2 = d @ d
+    t = np.zeros_like(px) if length2 == 0 else \
+        np.clip(((px - a[0]) * d[0] + (py - a[1]) * d[1]) / length2, 0, 1)
+    return np.hypot(px - (a[0] + t * d[0]), py - (a[1] + t * d[1]))
+
+
+def pixel_centers(height: int, width: int) -> tuple:
+    ys, xs = np.mgrid[0:height, 0:width]
+    return xs + 0.5, ys + 0.5
+
+
+def polyline_reference(points: np.ndarray, radius: float, height: int, width: int) -> np.ndarray:
+    """Pixels whose centers lie within radius of any segment"""
+    px, py = pixel_centers(height, width)
+    if len(points) == 1:
+        points = np.concatenate([points, points])
+    inside = np.zeros((height, width), dtype=bool)
+    for a, b in zip(points[:-1], points[1:]):
+        inside |= segment_distance(px, py, a, b) <= radius
+    return np.where(inside, np.uint8(255), np.uint8(0))
+
+
+def polygon_reference(points: np.ndarray, height: int, width: int) -> np.ndarray:
+    """Pixels whose centers have a nonzero winding number"""
+    px, py = pixel_centers(height, width)
+    winding = np.zeros((height, width), dtype=np.int64)
+    for (x0, y0), (x1, y1) in zip(points, np.roll(points, -1, axis=0)):
+        if y0 == y1:
+            continue
+        crosses = (np.minimum(y0, y1) <= py) & (py < np.maximum(y0, y1))
+        x = x0 + (py - y0) * (x1 - x0) / (y1 - y0)
+        winding += np.where(crosses & (x < px), 1 if y1 > y0 else -1, 0)
+    return np.where(winding != 0, np.uint8(255), np.uint8(0))
+
+
+@pytest.mark.parametrize("first_masked", [False, True])
+def test_rle_round_trip(first_masked):
+    rng = np.random.default_rng(0)
+    mask = np.where(rng.random((37, 53)) > 0.6, np.uint8(255), np.uint8(0))
+    mask[0, 0] = 255 if first_masked else 0
+
+    counts = masks.encode_rle(mask)
+
+    assert (counts[0] == 0) == first_masked
+    assert sum(counts) == mask.size
+    np.testing.assert_array_equal(masks.decode_rle(counts, 37, 53), mask)
+
+
+def test_rle_uniform_masks():
+    empty = np.zeros((4, 5), dtype=np.uint8)
+    full = np.full((4, 5), 255, dtype=np.uint8)
+
+    assert masks.encode_rle(empty) == [20]
+    assert masks.encode_rle(full) == [0, 20]
+    np.testing.assert_array_equal(masks.decode_rle([20], 4, 5), empty)
+    np.testing.assert_array_equal(masks.decode_rle([0, 20], 4, 5), full)
+
+
+@pytest.mark.parametrize("counts", [[5], [-1, 21], [[10, 10]]])
+def test_rle_rejects_invalid_counts(counts):
+    with pytest.raises(ValueError):
+        masks.decode_rle(counts, 4, 5)
+
+
+@pytest.mark.parametrize("seed", range(4))
+@pytest.mark.parametrize("radius", [0.5, 2.7, 9.3])
+def test_draw_polyline_matches_reference(seed, radius):
+    rng = np.random.default_rng(seed)
+    # Vertices partly outside the image exercise the clipping
+    points = rng.random((6, 2)) * [90, 70] - [10, 10]
+    mask = np.zeros((50, 70), dtype=np.uint8)
+
+    masks.draw_polyline(mask, points, radius)
+
+    np.testing.assert_array_equal(mask, polyline_reference(points, radius, 50, 70))
+
+
+def test_draw_polyline_single_point_is_a_dot():
+    points = np.array([[20.3, 15.6]])
+    mask = np.zeros((40, 40), dtype=np.uint8)
+
+    masks.draw_polyline(mask, points, 6.1)
+
+    np.testing.assert_array_equal(mask, polyline_reference(points, 6.1, 40, 40))
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_fill_polygon_matches_reference(seed):
+    rng = np.random.default_rng(seed)
+    # Random vertices give self-intersecting polygons, where winding matters
+    points = rng.random((12, 2)) * [90, 70] - [10, 10]
+    mask = np.zeros((50, 70), dtype=np.uint8)
+
+    masks.fill_polygon(mask, points)
+
+    np.testing.assert_array_equal(mask, polygon_reference(points, 50, 70))
+
+
+def test_fill_polygon_nonzero_winding_keeps_overlaps_filled():
+    # The same square twice, an even-odd fill would leave it empty
+    square = np.array([[5.2, 5.2], [30.7, 5.2], [30.7, 30.7], [5.2, 30.7]])
+    points = np.concatenate([square, square])
+    mask = np.zeros((40, 40), dtype=np.uint8)
+
+    masks.fill_polygon(mask, points)
+
+    np.testing.assert_array_equal(mask, polygon_reference(square, 40, 40))
+    assert mask[18, 18] == 255
+
+
+def test_rasterize_checks_rle_size():
+    with pytest.raises(ValueError, match="does not match"):
+        masks.rasterize({"type": "rle", "size": [4, 4], "counts": [16]}, 4, 5)
+
+
+def test_rasterize_rejects_non_finite_points():
+    with pytest.raises(ValueError):
+        masks.rasterize({"type": "strokes", "strokes": [{"points": [[1, float("nan")]]}]}, 4, 4)
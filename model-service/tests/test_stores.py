@@ -0,0 +1,135 @@
+"""SessionStore and JobStore TTL expiry and byte-limit eviction"""
+
+import time
+
+import numpy as np
+import pytest
+
+from jobs import JobStore
+from sessions import SessionStore
+
+
+class Clock:
+    """Stand-in for time.monotonic that only moves when advanced"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, "monotonic", clock)
+    return clock
+
+
+def image(nbytes: int = 300) -> np.ndarray:
+    return np.zeros((nbytes // 3, 1, 3), dtype=np.uint8)
+
+
+def test_session_expires_after_idle_ttl(clock):
+    store = SessionStore(ttl_seconds=60)
+    session = store.create(image())
+
+    clock.advance(59)
+    # Access refreshes the TTL
+    assert store.get(session.session_id) is session
+    clock.advance(59)
+    assert store.get(session.session_id) is session
+    clock.advance(61)
+    assert store.get(session.session_id) is None
+    assert len(store) == 0
+
+
+def test_session_count_limit_evicts_least_recently_used(clock):
+    store = SessionStore(max_sessions=2)
+    first = store.create(image())
+    second = store.create(image())
+    store.get(first.session_id)
+    store.create(image())
+
+    assert store.get(first.session_id) is first
+    assert store.get(second.session_id) is None
+
+
+def test_session_byte_limit_counts_results(clock):
+    store = SessionStore(max_bytes=1000)
+    first = store.create(image(300))
+    second = store.create(image(300))
+    assert len(store) == 2
+
+    # The result of the second session pushes the store over its byte limit
+    store.set_result(second.session_id, image(600))
+
+    assert store.get(first.session_id) is None
+    assert store.get(second.session_id) is second
+
+
+def test_session_store_keeps_the_latest_session_over_the_limit(clock):
+    store = SessionStore(max_bytes=100)
+    session = store.create(image(300))
+
+    assert store.get(session.session_id) is session
+    assert not session.image.flags.writeable
+
+
+def test_finished_job_expires_after_ttl(clock):
+    store = JobStore(ttl_seconds=60)
+    job = store.create()
+
+    # Running jobs never expire
+    clock.advance(120)
+    assert store.get(job.job_id) is job
+
+    store.finish(job, b"result", "image/png")
+    clock.advance(59)
+    assert store.get(job.job_id) is job
+    clock.advance(2)
+    assert store.get(job.job_id) is None
+
+
+def test_job_byte_limit_evicts_oldest_finished_jobs(clock):
+    store = JobStore(max_bytes=1000)
+    oldest, older, running = store.create(), store.create(), store.create()
+    store.finish(oldest, b"x" * 400, "image/png")
+    store.finish(older, b"x" * 400, "image/png")
+    assert len(store) == 3
+
+    newest = store.create()
+    store.finish(newest, b"x" * 400, "image/png")
+
+    assert store.get(oldest.job_id) is None
+    assert all(store.get(job.job_id) is job for job in (older, running, newest))
+
+
+def test_job_count_limit_never_evicts_running_jobs(clock):
+    store = JobStore(max_jobs=2)
+    running = [store.create() for _ in range(3)]
+
+    assert len(store) == 3
+    assert store.active() == 3
+
+    store.fail(running[0], 500, "failed")
+    store.create()
+
+    assert store.get(running[0].job_id) is None
+    assert store.active() == 3
+
+
+def test_job_stage_timings(clock):
+    store = JobStore()
+    job = store.create()
+    clock.advance(1)
+    store.set_stage(job, "inferring")
+    clock.advance(2)
+    store.finish(job, b"", "image/png")
+
+    assert job.timings == {"queued": 1, "inferring": 2}
+    with pytest.raises(ValueError):
+        store.set_stage(job, "sleeping")
@@ -0,0 +1,139 @@
+"""InferencePool admission, priorities and cancellation accounting"""
+
+import asyncio
+import threading
+
+import pytest
+
+from workers import PRIORITY_PREVIEW, InferencePool, QueueFullError
+
+
+@pytest.fixture
+def pool():
+    pool = InferencePool(workers=1, max_queue=1, retry_after=3)
+    yield pool
+    pool.shutdown()
+
+
+async def until(condition, timeout: float = 5.0):
+    """Poll the event loop until condition() holds"""
+    async with asyncio.timeout(timeout):
+        while not condition():
+            await asyncio.sleep(0.001)
+
+
+async def cancel(task: asyncio.Task):
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+
+def test_run_returns_the_result(pool):
+    async def main():
+        return await pool.run(pow, 2, 10)
+
+    assert asyncio.run(main()) == 1024
+    assert pool.pending == 0
+
+
+def test_job_errors_are_raised_and_accounted(pool):
+    async def main():
+        with pytest.raises(ZeroDivisionError):
+            await pool.run(lambda: 1 / 0)
+        return await pool.run(lambda: "next")
+
+    assert asyncio.run(main()) == "next"
+    assert pool.pending == 0 and pool.in_flight == 0
+
+
+def test_rejects_jobs_beyond_workers_and_queue(pool):
+    release = threading.Event()
+    done = []
+
+    async def main():
+        running = asyncio.create_task(pool.run(release.wait))
+        queued = asyncio.create_task(pool.run(lambda: None))
+        await until(lambda: pool.pending == 2)
+
+        with pytest.raises(QueueFullError) as rejected:
+            await pool.run(lambda: None, on_done=lambda: done.append("rejected"))
+        assert rejected.value.retry_after == 3
+        assert done == ["rejected"]
+
+        release.set()
+        await asyncio.gather(running, queued)
+
+    asyncio.run(main())
+    assert pool.pending == 0
+
+
+def test_cancelled_running_job_keeps_its_worker_until_the_thread_ends(pool):
+    release = threading.Event()
+    done = []
+
+    async def main():
+        running = asyncio.create_task(pool.run(release.wait, on_done=lambda: done.append("job")))
+        await until(lambda: pool.in_flight == 1)
+        await cancel(running)
+
+        # The thread still runs: the job stays pending and holds the only worker
+        assert pool.pending == 1 and pool.in_flight == 1
+        assert done == []
+        queued = asyncio.create_task(pool.run(lambda: "queued"))
+        await until(lambda: pool.pending == 2)
+        assert not queued.done()
+
+        release.set()
+        assert await queued == "queued"
+        assert done == ["job"]
+
+    asyncio.run(main())
+    assert pool.pending == 0 and pool.in_flight == 0
+
+
+def test_cancelled_queued_job_never_runs(pool):
+    release = threading.Event()
+    ran = []
+    done = []
+
+    async def main():
+        running = asyncio.create_task(pool.run(release.wait))
+        await until(lambda: pool.in_flight == 1)
+        queued = asyncio.create_task(
+            pool.run(ran.append, "queued", on_done=lambda: done.append("queued")))
+        await until(lambda: pool.pending == 2)
+
+        await cancel(queued)
+        assert pool.pending == 1
+        assert done == ["queued"]
+
+        release.set()
+        await running
+
+    asyncio.run(main())
+    assert ran == []
+    assert pool.pending == 0 and pool.in_flight == 0
+
+
+def test_preview_priority_overtakes_queued_jobs():
+    pool = InferencePool(workers=1, max_queue=4)
+    release = threading.Event()
+    order = []
+
+    async def main():
+        running = asyncio.create_task(pool.run(release.wait))
+        await until(lambda: pool.in_flight == 1)
+        queued = [asyncio.create_task(pool.run(order.append, f"final{i}")) for i in range(2)]
+        await until(lambda: pool.pending == 3)
+        queued.append(asyncio.create_task(
+            pool.run(order.append, "preview", priority=PRIORITY_PREVIEW)))
+        await until(lambda: pool.pending == 4)
+
+        release.set()
+        await asyncio.gather(running, *queued)
+
+    try:
+        asyncio.run(main())
+    finally:
+        pool.shutdown()
+    assert order == ["preview", "final0", "final1"]
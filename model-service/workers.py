@@ -0,0 +1,151 @@
+"""
+Bounded worker pool for running blocking inference off the asyncio event loop
+
+Jobs waiting for a worker are started in priority order, then in submission
+order, so quick preview passes overtake queued full-quality jobs.
+"""
+
+import asyncio
+import functools
+import heapq
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from loguru import logger
+
+# Job priorities, lower values start first
+PRIORITY_PREVIEW = 0
+PRIORITY_DEFAULT = 1
+
+
+class QueueFullError(Exception):
+    """Raised when the pool already holds its maximum number of jobs"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Inference queue is full")
+        self.retry_after = retry_after
+
+
+class InferencePool:
+    """Thread pool with a bounded wait queue and fast rejection when full"""
+
+    def __init__(self, workers: int = 1, max_queue: int = 8, retry_after: int = 1):
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        # Workers handed to a job, and (priority, sequence, future) of the jobs waiting
+        # for one. Only touched from the event loop.
+        self._busy = 0
+        self._waiters = []
+        self._sequence = itertools.count()
+        self.configure(workers, max_queue, retry_after)
+
+    def configure(self, workers: int, max_queue: int, retry_after: Optional[int] = None):
+        """Update pool limits, only valid before the first job is submitted"""
+        if self._executor is not None:
+            raise RuntimeError("Inference pool is already running")
+        if workers < 1:
+            raise ValueError(f"workers must be at least 1, got {workers}")
+        if max_queue < 0:
+            raise ValueError(f"max_queue must not be negative, got {max_queue}")
+
+        self.workers = workers
+        self.max_queue = max_queue
+        if retry_after is not None:
+            self.retry_after = retry_after
+        logger.info(f"Inference pool configured with {workers} workers, queue size {max_queue}")
+
+    @property
+    def pending(self) -> int:
+        """Jobs running or waiting for a worker"""
+        return self._pending
+
+    @property
+    def in_flight(self) -> int:
+        """Jobs currently running on a worker"""
+        return min(self._pending, self.workers)
+
+    @property
+    def queued(self) -> int:
+        """Jobs waiting for a free worker"""
+        return max(self._pending - self.workers, 0)
+
+    async def run(self, fn: Callable, *args, priority: int = PRIORITY_DEFAULT,
+                  on_done: Optional[Callable] = None, **kwargs):
+        """
+        Run fn(*args, **kwargs) on a worker thread, raising QueueFullError when full
+        Args:
+            priority: Jobs with lower priority values get a free worker first
+            on_done: Called once the job is over: rejected, cancelled before it
+                     started, or finished on its worker thread, even if the
+                     awaiting caller was cancelled first
+        """
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                logger.warning(f"Rejecting job, {self._pending} jobs pending")
+                if on_done is not None:
+                    on_done()
+                raise QueueFullError(self.retry_after)
+            self._pending += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="inference")
+
+        acquired = False
+        future = None
+        try:
+            await self._acquire_worker(priority)
+            acquired = True
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+            return await asyncio.shield(future)
+        finally:
+            if future is not None and not future.done():
+                # A cancelled job's thread runs on, it stays pending and keeps its
+                # worker until it finishes
+                future.add_done_callback(lambda _: self._finish(True, on_done))
+            else:
+                self._finish(acquired, on_done)
+
+    def _finish(self, release: bool, on_done: Optional[Callable] = None):
+        """Account for a job that finished, or left the queue without running"""
+        if release:
+            self._release_worker()
+        with self._lock:
+            self._pending -= 1
+        if on_done is not None:
+            on_done()
+
+    async def _acquire_worker(self, priority: int):
+        """Wait until a worker is handed to this job"""
+        if self._busy < self.workers and not self._waiters:
+            self._busy += 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), waiter))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # A worker handed over just before the cancellation goes to the next job
+            if waiter.done() and not waiter.cancelled():
+                self._release_worker()
+            raise
+
+    def _release_worker(self):
+        """Hand a finished job's worker to the next waiting job, skipping cancelled ones"""
+        while self._waiters:
+            _, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._busy -= 1
+
+    def shutdown(self):
+        """Stop the worker threads, waiting for running jobs to finish"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
@@ -154,33 +154,17 @@ function Editor() {
         ctx.stroke()
         ctx.fill()
       }
-
-      // Create mask from lassos
-      const maskCanvas = document.createElement("canvas")
-      maskCanvas.width = image.width
-      maskCanvas.height = image.height
-      const maskCtx = maskCanvas.getContext("2d")
-      if (!maskCtx) return
-      maskCtx.fillStyle = "black"
-      maskCtx.fillRect(0, 0, maskCanvas.width, maskCanvas.height)
-      maskCtx.fillStyle = "white"
-
-      lassos.forEach((points) => {
-        if (points.length < 2) return
-        maskCtx.beginPath()
-        const start = points[0]
-        maskCtx.moveTo(start.x, start.y)
-        points.slice(1).forEach((p) => {
-          maskCtx.lineTo(p.x, p.y)
-        })
-        maskCtx.closePath()
-        maskCtx.fill()
-      })
-      const maskData = maskCanvas.toDataURL("image/png")
-      setMask(maskData)
     }
   }, [image, transform, lassos, points, showLastProcessed, lastProcessedImage])
 
+  // Send the lassos as filled stroke polygons, the server rasterizes them
+  useEffect(() => {
+    const strokes = lassos
+      .filter((points) => points.length >= 2)
+      .map((points) => ({ points: points.map((p) => [p.x, p.y]), fill: true }))
+    setMask(JSON.stringify({ type: "strokes", strokes }))
+  }, [lassos])
+
   useEffect(() => {
     if (lastProcessedImage) setShowLastProcessed(true)
   }, [lastProcessedImage])
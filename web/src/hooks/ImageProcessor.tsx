@@ -3,6 +3,7 @@ import { createContext, useContext, useState } from "react"
 type Context = {
   image: string | null
   setImage: (img: string | null) => void
+  // RLE or stroke mask JSON, see model-service/masks.py
   mask: string | null
   setMask: (mask: string | null) => void
   isProcessing: boolean
@@ -31,6 +32,63 @@ const useImageProcessor = () => {
   return useContext(ctx)
 }
 
+// Patch of a progressive event, see DeltaResponse in model-service/server.py
+type Delta = {
+  patch: string | null
+  x: number
+  y: number
+  width: number
+  height: number
+}
+
+// Draw a delta's patch over the image it was inpainted from
+const compositeDelta = async (base: string, delta: Delta) => {
+  const canvas = document.createElement("canvas")
+  canvas.width = delta.width
+  canvas.height = delta.height
+  const context = canvas.getContext("2d")!
+  const baseBlob = await fetch(base).then((r) => r.blob())
+  context.drawImage(
+    await createImageBitmap(baseBlob),
+    0,
+    0,
+    delta.width,
+    delta.height,
+  )
+
+  // No patch: the mask was empty and nothing changed
+  if (delta.patch) {
+    const patchBlob = await fetch(delta.patch).then((r) => r.blob())
+    context.drawImage(await createImageBitmap(patchBlob), delta.x, delta.y)
+  }
+  return new Promise<Blob>((resolve) =>
+    canvas.toBlob((blob) => resolve(blob!), "image/png"),
+  )
+}
+
+// Parse the server-sent events of a streamed response
+async function* readEvents(res: Response) {
+  const reader = res.body!.pipeThrough(new TextDecoderStream()).getReader()
+  let buffer = ""
+  while (true) {
+    const { value, done } = await reader.read()
+    if (done) return
+    buffer += value
+    let end
+    while ((end = buffer.indexOf("\n\n")) >= 0) {
+      const block = buffer.slice(0, end)
+      buffer = buffer.slice(end + 2)
+      let event = "message"
+      let data = ""
+      for (const line of block.split("\n")) {
+        if (line.startsWith("event: ")) event = line.slice(7)
+        else if (line.startsWith("data: ")) data += line.slice(6)
+      }
+      if (data) yield { event, data: JSON.parse(data) }
+    }
+  }
+}
+
 export const ImageProcessorProvider = ({
   children,
 }: {
@@ -41,6 +99,7 @@ export const ImageProcessorProvider = ({
   const [processing, setProcessing] = useState(false)
   const [resultHistory, setResultHistory] = useState<string[]>([])
   const [lastProcessedImage, setProcessingImage] = useState<string | null>(null)
+  const [sessionId, setSessionId] = useState<string | null>(null)
 
   const process = async () => {
     if (!image) return ""
@@ -48,25 +107,76 @@ export const ImageProcessorProvider = ({
 
     const baseUrl = import.meta.env.VITE_API_BASE_URL ?? "http://localhost:8003"
 
-    const body = {
-      image,
-      mask,
+    // Upload the image once per session, later edits only send the mask
+    const createSession = async () => {
+      const body = new FormData()
+      body.append("image", await fetch(image).then((res) => res.blob()))
+      const res = await fetch(`${baseUrl}/sessions`, { method: "POST", body })
+      if (!res.ok) {
+        const detail = await res.json().then(
+          (data) => data.detail,
+          () => res.statusText,
+        )
+        throw new Error(`Session upload failed (${res.status}): ${detail}`)
+      }
+      const id = (await res.json()).session_id as string
+      setSessionId(id)
+      return id
+    }
+
+    // Only the lossless patch around the mask comes back, composited locally.
+    // A low resolution preview streams in first, then the final result
+    const inpaintSession = async (id: string) => {
+      const body = new FormData()
+      if (mask) body.append("mask_data", mask)
+      body.append("format", "png")
+      body.append("delta", "true")
+      body.append("progressive", "true")
+      return fetch(`${baseUrl}/sessions/${id}/inpaint`, { method: "POST", body })
     }
 
-    const result = await fetch(`${baseUrl}/inpaint`, {
-      method: "POST",
-      headers: {
-        "Content-Type": "application/json",
-      },
-      body: JSON.stringify(body),
-    })
-      .then((res) => res.json())
-      .then((data) => data as string)
-
-    setResultHistory((prev) => [result, ...prev])
-    setProcessing(false)
-    setProcessingImage(result)
-    return result
+    const previous = lastProcessedImage
+    let preview: string | null = null
+    try {
+      let res = await inpaintSession(sessionId ?? (await createSession()))
+      // Sessions expire on the server, start a new one and retry once
+      if (res.status === 404) res = await inpaintSession(await createSession())
+
+      // Errors before streaming starts come back as plain JSON
+      const contentType = res.headers.get("Content-Type") ?? ""
+      if (!res.ok || !contentType.startsWith("text/event-stream")) {
+        const detail = await res.json().then(
+          (data) => data.detail,
+          () => res.statusText,
+        )
+        throw new Error(`Inpainting failed (${res.status}): ${detail}`)
+      }
+
+      let result: string | null = null
+      for await (const { event, data } of readEvents(res)) {
+        if (event === "error") throw new Error(data.detail)
+        const url = await compositeDelta(image, data).then((blob) =>
+          URL.createObjectURL(blob),
+        )
+        if (event === "preview") {
+          preview = url
+          setProcessingImage(url)
+        } else result = url
+      }
+      if (!result) throw new Error("Inpainting stream ended without a result")
+
+      const final = result
+      setResultHistory((prev) => [final, ...prev])
+      setProcessingImage(final)
+      return final
+    } catch (error) {
+      // Don't leave a preview on screen as if it were the result
+      if (preview) setProcessingImage(previous)
+      throw error
+    } finally {
+      setProcessing(false)
+      if (preview) URL.revokeObjectURL(preview)
+    }
   }
 
   const downloadImage = (index: number) => {
@@ -84,6 +194,7 @@ export const ImageProcessorProvider = ({
         image,
         setImage: (img) => {
           setImage(img)
+          setSessionId(null)
           setProcessingImage(null)
         },
         downloadImage,